@@ -3,6 +3,9 @@ ASGI config for api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+- HTTP -> Django.
+- WebSocket -> chat en tiempo real (market.ws_chat, /ws/chat/<id>/).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +16,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importar después de get_asgi_application() (apps ya cargadas)
+from market.ws_chat import chat_websocket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        return await chat_websocket(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -145,6 +145,43 @@ DATABASES = {
     }
 }
 
+# Caché de respuestas públicas (market/helpers_cache.py).
+# locmem es por proceso: con varios workers de gunicorn o management commands
+# (import_puntos) usa un backend compartido, p.ej.
+#   CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+#   CACHE_LOCATION=redis://host:6379/1
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "cambioteca"),
+        "TIMEOUT": int(os.getenv("CACHE_TIMEOUT", "60")),
+    }
+}
+
+# Búsqueda de libros (market/busqueda.py): "auto" | "mysql" (FULLTEXT) | "indice"
+BUSQUEDA_BACKEND = os.getenv("BUSQUEDA_BACKEND", "auto")
+
+# Chat en tiempo real (market/ws_chat.py y long-poll de market/views_longpoll.py).
+# Procfile: `web` (WSGI) atiende la API normal, streaming y /media/ (sendfile);
+# `realtime` (api.asgi + uvicorn) sólo /ws/ y las rutas .../espera/ (el proxy o
+# el dominio aparte enrutan esas). Bajo WSGI el long-poll responde sin esperar.
+# InMemoryBroker sólo reparte eventos dentro de UN proceso: con web + realtime,
+# más de un worker o varias réplicas, usar Redis (pip install redis):
+#   CHAT_BROKER=market.helpers_realtime.RedisBroker
+#   CHAT_BROKER_URL=redis://host:6379/2
+CHAT_BROKER = os.getenv("CHAT_BROKER", "market.helpers_realtime.InMemoryBroker")
+CHAT_BROKER_URL = os.getenv("CHAT_BROKER_URL", "")
+
+# Archivo del chat (market/helpers_archivo.py, `manage.py archivar_chats`):
+# intercambios Completado/Cancelado sin actividad en N días
+CHAT_ARCHIVO_DIAS = int(os.getenv("CHAT_ARCHIVO_DIAS", "180"))
+
+# Outbox de eventos (market/helpers_eventos.py): bandeja, badges, versión de la
+# caché y populares los mantienen consumidores, no las vistas. En producción los
+# corre el proceso `eventos` del Procfile; en desarrollo (sin ese proceso) se
+# procesan al commit de la transacción que emitió.
+EVENTOS_AL_COMMIT = os.getenv("EVENTOS_AL_COMMIT", "1" if DEBUG else "0") == "1"
+
 
 
 
@@ -184,6 +221,10 @@ CORS_ALLOWED_ORIGINS = env_list(
     "http://localhost:8100,http://127.0.0.1:8100"
 )
 CORS_ALLOW_CREDENTIALS = True
+# Cabeceras propias que el front necesita leer (paginación keyset, sync, GET condicional)
+CORS_EXPOSE_HEADERS = [
+    "ETag", "Last-Modified", "X-Next-Cursor", "X-Has-More", "X-Sync-Cursor",
+]
 CSRF_TRUSTED_ORIGINS = env_list(
     "CSRF_TRUSTED_ORIGINS",
     "http://localhost:8100,http://127.0.0.1:8100"
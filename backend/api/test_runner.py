@@ -0,0 +1,21 @@
+from django.apps import apps
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+
+class UnmanagedTablesRunner(DiscoverRunner):
+    """Crea en la BD de test las tablas de los modelos managed=False (ver api/settings_test.py)."""
+
+    def setup_databases(self, **kwargs):
+        config = super().setup_databases(**kwargs)
+        for alias in connections:
+            conn = connections[alias]
+            existentes = set(conn.introspection.table_names())
+            with conn.schema_editor() as editor:
+                for model in apps.get_models():
+                    meta = model._meta
+                    if meta.managed or meta.proxy or meta.db_table in existentes:
+                        continue
+                    editor.create_model(model)
+                    existentes.add(meta.db_table)
+        return config
@@ -1,8 +1,6 @@
 # backend/api/urls.py
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.conf import settings
-from django.views.static import serve as dj_serve
 from django.http import JsonResponse, HttpResponse
 
 # Vistas de CORE (públicas/usuario/admin)
@@ -30,7 +28,7 @@ from core.views import (
 # Auth JWT (login / logout-all) ya estandarizado en views_auth
 from core import views_auth as auth
 from market import views as market_views
-
+from market.views_media import serve_media
 
 # --------- endpoints simples ----------
 def index(_request):
@@ -94,7 +92,7 @@ urlpatterns = [
     path("api/", include("market.urls")),
 ]
 
-# Media (Railway / producción sin Nginx)
+# Media (Railway / producción sin Nginx): ETag fuerte, Range, immutable, WebP
 urlpatterns += [
-    re_path(r"^media/(?P<path>.*)$", dj_serve, {"document_root": settings.MEDIA_ROOT}),
+    re_path(r"^media/(?P<path>.*)$", serve_media, name="media"),
 ]
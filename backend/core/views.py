@@ -2,11 +2,11 @@
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
-from django.core.files.storage import default_storage
 from django.core.mail import EmailMultiAlternatives, send_mail
 from email.mime.image import MIMEImage
 from django.contrib.auth.hashers import check_password, make_password
 from django.db.models import Q, Avg, Count, F
+from django.db import transaction
 from rest_framework.decorators import api_view, permission_classes, parser_classes
 
 
@@ -15,6 +15,9 @@ from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from market.views import media_abs
+from market.helpers_imagenes import guardar_imagen
+from market.helpers_cache import cached_response, CATALOGO
+from market.helpers_bandeja import sincronizar_bandeja, conversaciones_de_usuario
 from django.http import HttpResponse
 from django.shortcuts import redirect
 
@@ -55,36 +58,21 @@ import secrets
 # =========================
 # Helpers
 # =========================
-def _abs_media_url(request, rel_path: str | None = None) -> str:
+def _abs_media_url(request, rel_path: str | None = None, size: str | None = None) -> str:
     """
     Wrapper hacia market.media_abs para unificar la lógica de media.
     Soporta MEDIA_URL relativo o absoluto y paths ya absolutos.
     """
-    return media_abs(request, rel_path or None)
+    return media_abs(request, rel_path or None, size)
 
 
 
 def _save_avatar(file_obj) -> str:
     """
-    Guarda el archivo en MEDIA_ROOT/avatars/<uuid>.<ext> y devuelve la ruta relativa.
+    Guarda el avatar en MEDIA_ROOT/avatars/ con sus derivados (thumb/card/full,
+    JPEG+WebP, sin EXIF) y devuelve la ruta relativa de la variante base.
     """
-    try:
-        file_obj.seek(0)
-    except Exception:
-        pass
-
-    original = getattr(file_obj, "name", "avatar")
-    ext = os.path.splitext(original)[1].lower() or ".jpg"
-    rel_path = f"avatars/{uuid.uuid4().hex}{ext}"
-
-    try:
-        base_str = str(settings.MEDIA_ROOT)
-        os.makedirs(os.path.join(base_str, "avatars"), exist_ok=True)
-    except Exception:
-        pass
-
-    saved_rel = default_storage.save(rel_path, file_obj)
-    return str(saved_rel).replace("\\", "/")
+    return guardar_imagen(file_obj, "avatars")
 
 # =========================
 # LOGIN HS256 (opcional / no recomendado si ya usas SimpleJWT en views_auth.py)
@@ -176,12 +164,14 @@ def register_usuario(request):
 # =========================
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@cached_response(CATALOGO, timeout=60 * 60)
 def regiones_view(request):
     qs = Region.objects.all().order_by("nombre")
     return Response(RegionSerializer(qs, many=True).data)
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@cached_response(CATALOGO, timeout=60 * 60)
 def comunas_view(request):
     region_id = request.query_params.get("region")
     qs = Comuna.objects.all().order_by("nombre")
@@ -368,7 +358,7 @@ def user_profile_view(request, user_id: int):
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def user_intercambios_view(request, user_id: int):
-    from market.models import ImagenLibro, Conversacion
+    from market.models import Conversacion
 
     qs = (
         Intercambio.objects
@@ -389,14 +379,8 @@ def user_intercambios_view(request, user_id: int):
     def _portada_abs(libro):
         if not libro:
             return None
-        rel = (
-            ImagenLibro.objects
-            .filter(id_libro=libro)
-            .order_by('-is_portada', 'orden', 'id_imagen')
-            .values_list('url_imagen', flat=True)
-            .first()
-        ) or ''
-        return _abs_media_url(request, rel)
+        # portada ya resuelta en libro.portada (sin consulta extra)
+        return _abs_media_url(request, getattr(libro, 'portada', None) or '', "card")
 
     out = []
     for i in qs:
@@ -440,20 +424,13 @@ def user_intercambios_view(request, user_id: int):
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def user_books_view(request, user_id: int):
-    from market.models import ImagenLibro
-
     qs = (Libro.objects
           .filter(id_usuario_id=user_id, disponible=True)
-          .only("id_libro", "titulo", "autor", "fecha_subida")
+          .only("id_libro", "titulo", "autor", "fecha_subida", "portada")
           .order_by("-fecha_subida", "-id_libro"))
 
     def _portada_abs(l):
-        rel = (ImagenLibro.objects
-               .filter(id_libro=l)
-               .order_by("-is_portada", "orden", "id_imagen")
-               .values_list("url_imagen", flat=True)
-               .first()) or ""
-        return _abs_media_url(request, rel)
+        return _abs_media_url(request, l.portada or "", "card")
 
     out = [{
         "id": b.id_libro,
@@ -551,7 +528,11 @@ def update_user_profile(request, id: int):
     for f in EDITABLE_FIELDS:
         if f in request.data:
             setattr(u, f, (request.data.get(f) or "").strip())
-    u.save()
+    with transaction.atomic():
+        u.save()
+        if "nombres" in request.data:
+            # nombre desnormalizado en la bandeja de chats de sus contrapartes
+            sincronizar_bandeja(conversaciones_de_usuario(u.pk))
 
     data = UsuarioSummarySerializer(u).data
     data.update({
@@ -583,7 +564,9 @@ def update_user_avatar(request, id: int):
     try:
         rel = _save_avatar(file_obj)
         u.imagen_perfil = rel
-        u.save(update_fields=["imagen_perfil"])
+        with transaction.atomic():
+            u.save(update_fields=["imagen_perfil"])
+            sincronizar_bandeja(conversaciones_de_usuario(u.pk))
         abs_url = _abs_media_url(request, rel)
         return Response({"imagen_perfil": rel, "avatar_url": abs_url}, status=200)
     except Exception as e:
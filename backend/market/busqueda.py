@@ -0,0 +1,180 @@
+# market/busqueda.py
+"""
+Búsqueda de libros por título / autor / editorial / género.
+
+- Índice: texto normalizado en libro_busqueda + índice invertido en libro_termino.
+  Se mantiene desde create_book / update_book / delete_book (indexar_libro /
+  desindexar_libro) y se reconstruye con `manage.py rebuild_busqueda`.
+- Backends:
+    * "mysql":  MATCH(texto) AGAINST(... IN BOOLEAN MODE) sobre el FULLTEXT.
+    * "indice": índice invertido portable (SQLite / tests locales / MySQL sin FULLTEXT).
+  settings.BUSQUEDA_BACKEND = "auto" (default) | "mysql" | "indice"
+- Resultados ordenados por relevancia con paginación keyset:
+  el cursor es "<score>:<id_libro>" del último resultado de la página.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Libro, LibroBusqueda, LibroTermino
+
+PESOS = {
+    "titulo": 3,
+    "autor": 2,
+    "editorial": 1,
+    "genero": 1,
+}
+
+STOPWORDS = {
+    "a", "al", "de", "del", "el", "en", "la", "las", "lo", "los", "o", "u",
+    "un", "una", "unos", "unas", "y", "e", "por", "para", "con", "sin",
+    "the", "of", "and",
+}
+
+MAX_TERMINO = 64
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalizar(texto: str | None) -> str:
+    """Minúsculas y sin tildes/diacríticos ('Canción' -> 'cancion')."""
+    texto = unicodedata.normalize("NFKD", str(texto or ""))
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    return texto.casefold()
+
+
+def tokenizar(texto: str | None) -> list:
+    """Tokens normalizados, sin stopwords ni duplicados (mantiene el orden)."""
+    out = []
+    for tok in _TOKEN_RE.findall(normalizar(texto)):
+        tok = tok.strip("_")[:MAX_TERMINO]
+        if len(tok) < 2 or tok in STOPWORDS or tok in out:
+            continue
+        out.append(tok)
+    return out
+
+
+def _campos(libro: Libro) -> dict:
+    genero = getattr(getattr(libro, "id_genero", None), "nombre", None)
+    return {
+        "titulo": libro.titulo,
+        "autor": libro.autor,
+        "editorial": libro.editorial,
+        "genero": genero,
+    }
+
+
+def indexar_libro(libro_id: int) -> None:
+    """(Re)indexa un libro. Idempotente."""
+    libro = Libro.objects.select_related("id_genero").filter(pk=libro_id).first()
+    if not libro:
+        desindexar_libro(libro_id)
+        return
+
+    campos = _campos(libro)
+    pesos = {}
+    for campo, valor in campos.items():
+        for tok in tokenizar(valor):
+            pesos[tok] = max(pesos.get(tok, 0), PESOS[campo])
+
+    with transaction.atomic():
+        LibroBusqueda.objects.update_or_create(
+            id_libro_id=libro.id_libro,
+            defaults={
+                "texto": " ".join(normalizar(v) for v in campos.values() if v),
+                "actualizado_en": timezone.now(),
+            },
+        )
+        LibroTermino.objects.filter(id_libro_id=libro.id_libro).delete()
+        LibroTermino.objects.bulk_create([
+            LibroTermino(id_libro_id=libro.id_libro, termino=tok, peso=peso)
+            for tok, peso in pesos.items()
+        ])
+
+
+def desindexar_libro(libro_id: int) -> None:
+    LibroTermino.objects.filter(id_libro_id=libro_id).delete()
+    LibroBusqueda.objects.filter(id_libro_id=libro_id).delete()
+
+
+def _backend() -> str:
+    b = (getattr(settings, "BUSQUEDA_BACKEND", "auto") or "auto").lower()
+    if b == "auto":
+        return "mysql" if connection.vendor == "mysql" else "indice"
+    return b
+
+
+def parse_cursor(raw: str | None):
+    """'12.5:340' -> (12.5, 340); basura -> None."""
+    try:
+        score, pk = str(raw).split(":", 1)
+        return float(score), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+def _fmt_cursor(score, pk) -> str:
+    return f"{round(float(score), 6):g}:{int(pk)}"
+
+
+def _buscar_indice(tokens, limit, cursor):
+    q = Q()
+    for tok in tokens:
+        # prefijo: "princ" encuentra "principito" (usa el índice de termino)
+        q |= Q(termino__startswith=tok)
+
+    qs = (LibroTermino.objects
+          .filter(q)
+          .values("id_libro_id")
+          .annotate(score=Sum("peso")))
+    if cursor:
+        score, pk = cursor
+        qs = qs.filter(Q(score__lt=score) | Q(score=score, id_libro_id__lt=pk))
+    rows = qs.order_by("-score", "-id_libro_id")
+    if limit is not None:
+        rows = rows[:limit]
+    return [(r["id_libro_id"], float(r["score"])) for r in rows]
+
+
+def _buscar_mysql(tokens, limit, cursor):
+    boolean = " ".join(f"{tok}*" for tok in tokens)
+    score_sql = "ROUND(MATCH(texto) AGAINST (%s IN BOOLEAN MODE), 6)"
+    sql = (
+        f"SELECT id_libro, {score_sql} AS score "
+        f"FROM libro_busqueda "
+        f"WHERE MATCH(texto) AGAINST (%s IN BOOLEAN MODE)"
+    )
+    params = [boolean, boolean]
+    if cursor:
+        sql += f" AND ({score_sql} < %s OR ({score_sql} = %s AND id_libro < %s))"
+        params += [boolean, cursor[0], boolean, cursor[0], cursor[1]]
+    sql += " ORDER BY score DESC, id_libro DESC"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        return [(int(pk), float(score)) for pk, score in cur.fetchall()]
+
+
+def buscar_libros(query: str, limit: int | None = 50, cursor=None):
+    """
+    Devuelve (ids_ordenados_por_relevancia, next_cursor | None).
+    `cursor` es el valor ya parseado con parse_cursor(); limit=None = sin tope.
+    """
+    tokens = tokenizar(query)
+    if not tokens:
+        return [], None
+
+    if _backend() == "mysql":
+        rows = _buscar_mysql(tokens, limit, cursor)
+    else:
+        rows = _buscar_indice(tokens, limit, cursor)
+
+    ids = [pk for pk, _ in rows]
+    next_cursor = _fmt_cursor(rows[-1][1], rows[-1][0]) if limit and len(rows) == limit else None
+    return ids, next_cursor
@@ -0,0 +1,154 @@
+# market/busqueda_chat.py
+"""
+Búsqueda de mensajes dentro de las conversaciones de un usuario.
+
+- Índice invertido en mensaje_termino: una fila (usuario, término, mensaje)
+  por cada participante de la conversación. La consulta sólo recorre los
+  términos del propio usuario (uq_mensaje_termino empieza por id_usuario),
+  así que no crece con el volumen total de mensajes.
+- Mismos tokens que la búsqueda de libros (busqueda.tokenizar: sin tildes,
+  minúsculas, sin stopwords). Todos los términos deben aparecer (AND), por
+  prefijo: "provi 12" encuentra "Providencia 1234".
+- Se mantiene desde enviar_mensaje / sync por lotes / propuesta de encuentro
+  (indexar_mensajes, en la misma transacción). Los mensajes archivados
+  conservan sus entradas. `manage.py rebuild_busqueda_chat` reconstruye.
+- Resultados del más nuevo al más antiguo; cursor = id_mensaje del último
+  resultado (?cursor=), siguiente página en X-Next-Cursor.
+"""
+from .busqueda import _TOKEN_RE, normalizar, tokenizar
+from .models import ConversacionMensaje, ConversacionMensajeArchivo, ConversacionParticipante, MensajeTermino
+
+BUSQUEDA_CHAT_PAGE_SIZE = 20
+BUSQUEDA_CHAT_MAX_PAGE_SIZE = 100
+MAX_TERMINOS_MENSAJE = 200
+FRAGMENTO_ANCHO = 80
+LOTE = 1000
+
+
+# =========================
+# Indexación
+# =========================
+
+def _participantes(conv_ids) -> dict:
+    out = {}
+    for cid, uid in (ConversacionParticipante.objects
+                     .filter(id_conversacion_id__in=set(conv_ids))
+                     .values_list("id_conversacion_id", "id_usuario_id")):
+        out.setdefault(cid, []).append(uid)
+    return out
+
+
+def indexar_mensajes(mensajes, usuarios=None) -> int:
+    """
+    Agrega los términos de `mensajes` para cada participante. `usuarios`
+    (opcional) evita la consulta si todos son de la misma conversación.
+    """
+    mensajes = [m for m in mensajes if m is not None]
+    if not mensajes:
+        return 0
+    por_conv = None if usuarios is not None else _participantes(m.id_conversacion_id for m in mensajes)
+    filas = []
+    for m in mensajes:
+        destinatarios = usuarios if usuarios is not None else por_conv.get(m.id_conversacion_id, [])
+        for tok in tokenizar(m.cuerpo)[:MAX_TERMINOS_MENSAJE]:
+            for uid in destinatarios:
+                filas.append(MensajeTermino(id_usuario_id=uid, termino=tok,
+                                            id_mensaje=m.id_mensaje, id_conversacion=m.id_conversacion_id))
+    MensajeTermino.objects.bulk_create(filas, ignore_conflicts=True, batch_size=LOTE)
+    return len(filas)
+
+
+def reindexar_conversacion(conversacion_id: int) -> int:
+    """Recalcula las entradas de una conversación (vivos + archivados)."""
+    MensajeTermino.objects.filter(id_conversacion=conversacion_id).delete()
+    usuarios = _participantes([conversacion_id]).get(conversacion_id, [])
+    if not usuarios:
+        return 0
+    n = 0
+    for modelo in (ConversacionMensaje, ConversacionMensajeArchivo):
+        lote = []
+        for m in (modelo.objects
+                  .filter(id_conversacion_id=conversacion_id)
+                  .only("id_mensaje", "id_conversacion_id", "cuerpo")
+                  .iterator(chunk_size=LOTE)):
+            lote.append(m)
+            if len(lote) >= LOTE:
+                n += indexar_mensajes(lote, usuarios)
+                lote = []
+        n += indexar_mensajes(lote, usuarios)
+    return n
+
+
+# =========================
+# Consulta
+# =========================
+
+def fragmento(cuerpo, tokens, ancho: int = FRAGMENTO_ANCHO) -> str:
+    """Recorte de `ancho` caracteres alrededor de la primera coincidencia."""
+    texto = " ".join((cuerpo or "").split())
+    if len(texto) <= ancho:
+        return texto
+    pos = 0
+    for m in _TOKEN_RE.finditer(texto):
+        if any(normalizar(m.group()).startswith(t) for t in tokens):
+            pos = m.start()
+            break
+    ini = max(0, min(pos - ancho // 3, len(texto) - ancho))
+    fin = ini + ancho
+    return ("…" if ini else "") + texto[ini:fin] + ("…" if fin < len(texto) else "")
+
+
+def _parse_limit(raw) -> int:
+    try:
+        limit = int(raw or BUSQUEDA_CHAT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = BUSQUEDA_CHAT_PAGE_SIZE
+    return max(1, min(limit, BUSQUEDA_CHAT_MAX_PAGE_SIZE))
+
+
+def buscar_mensajes(user_id: int, query: str, limit=None, cursor=None, conversacion_id=None):
+    """Devuelve (resultados, next_cursor | None)."""
+    tokens = tokenizar(query)
+    if not tokens:
+        return [], None
+    limit = _parse_limit(limit)
+
+    propios = MensajeTermino.objects.filter(id_usuario_id=user_id)
+    if conversacion_id:
+        propios = propios.filter(id_conversacion=conversacion_id)
+    qs = propios.filter(termino__startswith=tokens[0])
+    for tok in tokens[1:]:
+        qs = qs.filter(id_mensaje__in=propios.filter(termino__startswith=tok).values("id_mensaje"))
+    try:
+        if cursor not in (None, ""):
+            qs = qs.filter(id_mensaje__lt=int(cursor))
+    except (TypeError, ValueError):
+        pass
+
+    hits = list(qs.values_list("id_mensaje", "id_conversacion").distinct().order_by("-id_mensaje")[:limit + 1])
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = str(hits[-1][0])
+
+    ids = [h[0] for h in hits]
+    campos = ("id_mensaje", "id_usuario_emisor_id", "cuerpo", "enviado_en", "eliminado")
+    mensajes = {r["id_mensaje"]: r for r in ConversacionMensaje.objects.filter(pk__in=ids).values(*campos)}
+    faltan = [i for i in ids if i not in mensajes]
+    if faltan:
+        mensajes.update({r["id_mensaje"]: r for r in
+                         ConversacionMensajeArchivo.objects.filter(pk__in=faltan).values(*campos)})
+
+    resultados = []
+    for id_mensaje, id_conversacion in hits:
+        m = mensajes.get(id_mensaje)
+        if not m or m["eliminado"]:
+            continue
+        resultados.append({
+            "id_conversacion": id_conversacion,
+            "id_mensaje": id_mensaje,
+            "emisor_id": m["id_usuario_emisor_id"],
+            "enviado_en": m["enviado_en"],
+            "fragmento": fragmento(m["cuerpo"], tokens),
+        })
+    return resultados, next_cursor
@@ -75,3 +75,28 @@ STATUS_REASON = {
     "BAJA": "BAJA",
     "COMPLETADO": "COMPLETADO",
 }
+
+# Ledger de reservas de libros (tabla reserva_libro, ver helpers_reservas.py)
+RESERVA_ROL = {
+    "OFERTA": "OFERTA",            # ofrecido en una solicitud Pendiente (exclusiva)
+    "SOLICITUD": "SOLICITUD",      # deseado en una solicitud Pendiente (una por solicitante)
+    "INTERCAMBIO": "INTERCAMBIO",  # en un intercambio Pendiente/Aceptado (exclusiva)
+}
+
+# Tipos de evento de la bitácora evento_intercambio (ver helpers_eventos.py)
+EVENTO_TIPO = {
+    "SOLICITUD_CREADA": "SOLICITUD_CREADA",
+    "SOLICITUD_ACEPTADA": "SOLICITUD_ACEPTADA",
+    "SOLICITUD_RECHAZADA": "SOLICITUD_RECHAZADA",
+    "SOLICITUD_CANCELADA": "SOLICITUD_CANCELADA",
+    "ENCUENTRO_PROPUESTO": "ENCUENTRO_PROPUESTO",
+    "ENCUENTRO_CONFIRMADO": "ENCUENTRO_CONFIRMADO",
+    "ENCUENTRO_RECHAZADO": "ENCUENTRO_RECHAZADO",
+    "INTERCAMBIO_CREADO": "INTERCAMBIO_CREADO",
+    "INTERCAMBIO_COMPLETADO": "INTERCAMBIO_COMPLETADO",
+    "INTERCAMBIO_CANCELADO": "INTERCAMBIO_CANCELADO",
+    "LIBRO_BAJA": "LIBRO_BAJA",
+    "LIBRO_CREADO": "LIBRO_CREADO",
+    "LIBRO_ACTUALIZADO": "LIBRO_ACTUALIZADO",
+    "LIBRO_ELIMINADO": "LIBRO_ELIMINADO",
+}
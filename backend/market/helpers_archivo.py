@@ -0,0 +1,92 @@
+# market/helpers_archivo.py
+"""
+Archivo en frío del chat.
+
+Una conversación se archiva cuando su intercambio está Completado/Cancelado
+y no tiene actividad (conversacion.actualizado_en) hace CHAT_ARCHIVO_DIAS:
+- sus mensajes pasan (mismos ids) a conversacion_mensaje_archivo y se borran
+  de conversacion_mensaje, que queda sólo con chats vivos;
+- conversacion.archivada_en = now -> escribible pasa a 0 (actualizar_escribible)
+  y pagina_mensajes lee de la tabla de archivo sin que el cliente lo note;
+- los participantes quedan archivado=1 (bandeja y badges vía sincronizar_bandeja).
+
+Cada conversación se mueve en su propia transacción, con la fila de
+conversacion bloqueada: un enviar_mensaje concurrente falla su UPDATE
+condicional y deshace su INSERT. `manage.py archivar_chats` es el job
+(cron / proceso programado).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .constants import INTERCAMBIO_ESTADO
+from .helpers_bandeja import sincronizar_bandeja
+from .models import (
+    Conversacion, ConversacionMensaje, ConversacionMensajeArchivo, ConversacionParticipante,
+)
+
+ESTADOS_FINALES = (INTERCAMBIO_ESTADO["COMPLETADO"], INTERCAMBIO_ESTADO["CANCELADO"])
+LOTE_MENSAJES = 500
+
+CAMPOS = ("id_mensaje", "id_conversacion_id", "id_usuario_emisor_id", "cuerpo",
+          "enviado_en", "editado_en", "eliminado", "id_cliente")
+
+
+def dias_default() -> int:
+    return int(getattr(settings, "CHAT_ARCHIVO_DIAS", 180))
+
+
+def _archivables(dias: int):
+    corte = timezone.now() - timedelta(days=dias)
+    return Conversacion.objects.filter(
+        archivada_en__isnull=True,
+        actualizado_en__lt=corte,
+        id_intercambio__estado_intercambio__in=ESTADOS_FINALES,
+    )
+
+
+def candidatas(dias: int, limite=None) -> list:
+    qs = _archivables(dias).order_by("id_conversacion").values_list("id_conversacion", flat=True)
+    return list(qs[:limite] if limite else qs)
+
+
+def archivar_conversacion(conversacion_id: int, dias: int):
+    """Mueve los mensajes de una conversación. Devuelve cuántos, o None si ya no aplica."""
+    with transaction.atomic():
+        # re-verifica bajo lock (pudo llegar un mensaje o archivarla otro proceso)
+        if not _archivables(dias).select_for_update().filter(pk=conversacion_id).exists():
+            return None
+        now = timezone.now()
+        movidos = 0
+        lote = []
+        qs = ConversacionMensaje.objects.filter(id_conversacion_id=conversacion_id).order_by("id_mensaje")
+        for fila in qs.values(*CAMPOS).iterator(chunk_size=LOTE_MENSAJES):
+            lote.append(ConversacionMensajeArchivo(archivado_en=now, **fila))
+            if len(lote) >= LOTE_MENSAJES:
+                ConversacionMensajeArchivo.objects.bulk_create(lote, ignore_conflicts=True)
+                movidos += len(lote)
+                lote = []
+        if lote:
+            ConversacionMensajeArchivo.objects.bulk_create(lote, ignore_conflicts=True)
+            movidos += len(lote)
+        qs.delete()
+
+        Conversacion.objects.filter(pk=conversacion_id).update(archivada_en=now)
+        ConversacionParticipante.objects.filter(id_conversacion_id=conversacion_id).update(archivado=True)
+        # escribible=0 + aviso a sockets, filas de bandeja archivadas y badges
+        sincronizar_bandeja([conversacion_id])
+    return movidos
+
+
+def archivar(dias=None, limite=None) -> tuple:
+    """Archiva todas las candidatas. Devuelve (conversaciones, mensajes)."""
+    dias = dias_default() if dias is None else dias
+    convs = mensajes = 0
+    for conv_id in candidatas(dias, limite):
+        n = archivar_conversacion(conv_id, dias)
+        if n is not None:
+            convs += 1
+            mensajes += n
+    return convs, mensajes
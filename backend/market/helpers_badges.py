@@ -0,0 +1,199 @@
+# market/helpers_badges.py
+"""
+Contadores por usuario (tabla usuario_contadores) para GET /api/me/badges/:
+una lectura por PK en vez de la bandeja completa + COUNT de solicitudes.
+
+- chat_no_leidos: +n en enviar_mensaje (bandeja_mensaje), -n en marcar_visto
+  (bandeja_visto); sincronizar_bandeja lo recuenta para los afectados.
+- solicitudes_no_vistas: 0 en marcar_listado_solicitudes_visto; tras cada
+  transición (crear, rechazar, cancelar, aceptar, bajas...) lo recuenta con
+  recontar_solicitudes_de() el consumidor "contadores" (helpers_eventos).
+- solicitudes_version: +1 en cada evento de una solicitud del usuario
+  (emitir -> subir_version_solicitudes); validador ETag de sus listados.
+- solicitudes_visto_hasta: marca de agua (mayor id_solicitud recibido que el
+  usuario ya vio). "No vista" = id_solicitud > marca y visto_por_receptor=0
+  (la columna vieja sólo conserva lo marcado antes de la marca de agua).
+- Si falta la fila de un usuario se crea recontando (lazy).
+- `manage.py reconcile_badges` recalcula todo y reporta la deriva.
+"""
+from django.db import connection
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .constants import SOLICITUD_ESTADO
+from .models import BandejaChat, ContadorUsuario, SolicitudIntercambio
+
+CAMPOS = ("chat_no_leidos", "solicitudes_no_vistas")
+
+
+def _ids(user_ids) -> list:
+    return sorted({int(u) for u in user_ids or [] if u})
+
+
+# =========================
+# Recuentos (fuente de verdad)
+# =========================
+
+def contar_chat(user_ids) -> dict:
+    ids = _ids(user_ids)
+    if not ids:
+        return {}
+    out = dict.fromkeys(ids, 0)
+    out.update(BandejaChat.objects
+               .filter(id_usuario_id__in=ids, archivado=False)
+               .values("id_usuario_id")
+               .annotate(t=Sum("no_leidos"))
+               .values_list("id_usuario_id", "t"))
+    return {k: int(v or 0) for k, v in out.items()}
+
+
+def contar_solicitudes(user_ids) -> dict:
+    ids = _ids(user_ids)
+    if not ids:
+        return {}
+    visto_hasta = (ContadorUsuario.objects
+                   .filter(pk=OuterRef("id_usuario_receptor_id"))
+                   .values("solicitudes_visto_hasta")[:1])
+    out = dict.fromkeys(ids, 0)
+    out.update(SolicitudIntercambio.objects
+               .filter(id_usuario_receptor_id__in=ids,
+                       id_solicitud__gt=Coalesce(Subquery(visto_hasta), Value(0)),
+                       estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]],
+                       visto_por_receptor=False)
+               .values("id_usuario_receptor_id")
+               .annotate(c=Count("pk"))
+               .values_list("id_usuario_receptor_id", "c"))
+    return {k: int(v or 0) for k, v in out.items()}
+
+
+def _guardar(valores: dict, campos) -> None:
+    """valores: {user_id: {campo: n}} -> upsert sólo de `campos`."""
+    if set(campos) != set(CAMPOS) and valores:
+        # usuario sin fila: se crea completa (si no, el otro contador quedaría en 0)
+        existentes = set(ContadorUsuario.objects.filter(pk__in=list(valores)).values_list("pk", flat=True))
+        faltan = [u for u in valores if u not in existentes]
+        if faltan:
+            recontar(faltan)
+            valores = {u: v for u, v in valores.items() if u in existentes}
+    if not valores:
+        return
+    now = timezone.now()
+    filas = [ContadorUsuario(id_usuario_id=uid, actualizado_en=now, **vals) for uid, vals in valores.items()]
+    conflict_target = {}
+    if connection.features.supports_update_conflicts_with_target:
+        conflict_target["unique_fields"] = ["id_usuario"]
+    ContadorUsuario.objects.bulk_create(
+        filas, update_conflicts=True, update_fields=list(campos) + ["actualizado_en"], **conflict_target
+    )
+
+
+def recontar_chat(user_ids) -> None:
+    _guardar({u: {"chat_no_leidos": n} for u, n in contar_chat(user_ids).items()}, ["chat_no_leidos"])
+
+
+def recontar_solicitudes(user_ids) -> None:
+    _guardar({u: {"solicitudes_no_vistas": n} for u, n in contar_solicitudes(user_ids).items()},
+             ["solicitudes_no_vistas"])
+
+
+def recontar_solicitudes_de(solicitud_ids) -> None:
+    ids = [x for x in solicitud_ids or [] if x]
+    if ids:
+        recontar_solicitudes(SolicitudIntercambio.objects
+                             .filter(pk__in=ids)
+                             .values_list("id_usuario_receptor_id", flat=True))
+
+
+def recontar(user_ids) -> dict:
+    """Recalcula ambos contadores; devuelve {user_id: (chat, solicitudes)}."""
+    chat, sol = contar_chat(user_ids), contar_solicitudes(user_ids)
+    _guardar({u: {"chat_no_leidos": chat[u], "solicitudes_no_vistas": sol[u]} for u in chat}, CAMPOS)
+    return {u: (chat[u], sol[u]) for u in chat}
+
+
+# =========================
+# Incrementales (caminos calientes)
+# =========================
+
+def _sumar(campo: str, user_ids, n: int) -> None:
+    ids = _ids(user_ids)
+    if not ids or not n:
+        return
+    expr = F(campo) + n if n > 0 else Greatest(F(campo) - Value(-n), Value(0))
+    hechos = ContadorUsuario.objects.filter(pk__in=ids).update(**{campo: expr, "actualizado_en": timezone.now()})
+    if hechos < len(ids):
+        existentes = set(ContadorUsuario.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        faltan = [u for u in ids if u not in existentes]
+        # sin fila: se crea con el valor real (la escritura ya está aplicada en esta transacción)
+        recontar(faltan)
+
+
+def sumar_chat(user_ids, n: int = 1) -> None:
+    _sumar("chat_no_leidos", user_ids, n)
+
+
+def sumar_solicitudes(user_id: int, n: int = 1) -> None:
+    _sumar("solicitudes_no_vistas", [user_id], n)
+
+
+def subir_version_solicitudes(solicitud_ids) -> int:
+    """
+    +1 a solicitudes_version de solicitante y receptor de esas solicitudes: un
+    UPDATE (los usuarios salen de una subconsulta). Lo llama emitir() dentro de
+    la transición. Usuarios sin fila no suben: version_solicitudes() la crea.
+    """
+    ids = [int(x) for x in solicitud_ids or [] if x]
+    if not ids:
+        return 0
+    sol = SolicitudIntercambio.objects.filter(pk__in=ids)
+    return (ContadorUsuario.objects
+            .filter(Q(pk__in=sol.values("id_usuario_solicitante_id")) |
+                    Q(pk__in=sol.values("id_usuario_receptor_id")))
+            .update(solicitudes_version=F("solicitudes_version") + 1))
+
+
+def marcar_solicitudes_vistas_hasta(user_id: int) -> int:
+    """
+    Sube solicitudes_visto_hasta al mayor id_solicitud recibido (nunca la baja)
+    y deja solicitudes_no_vistas en 0. Una fila; devuelve la marca.
+    """
+    hasta = int(SolicitudIntercambio.objects
+                .filter(id_usuario_receptor_id=user_id)
+                .aggregate(m=Max("id_solicitud"))["m"] or 0)
+    cambios = dict(solicitudes_visto_hasta=Greatest(F("solicitudes_visto_hasta"), Value(hasta)),
+                   solicitudes_no_vistas=0, actualizado_en=timezone.now())
+    if not ContadorUsuario.objects.filter(pk=user_id).update(**cambios):
+        recontar([user_id])  # crea la fila
+        ContadorUsuario.objects.filter(pk=user_id).update(**cambios)
+    return hasta
+
+
+# =========================
+# Lectura
+# =========================
+
+def version_solicitudes(user_id: int) -> int:
+    """Lectura por PK; sin fila se crea (recontando) y arranca en 0."""
+    v = ContadorUsuario.objects.filter(pk=user_id).values_list("solicitudes_version", flat=True).first()
+    if v is None:
+        recontar([user_id])
+        return 0
+    return v
+
+
+def badges(user_id: int) -> dict:
+    """Una lectura por PK (si no hay fila, se crea recontando)."""
+    row = (ContadorUsuario.objects
+           .filter(pk=user_id)
+           .values("chat_no_leidos", "solicitudes_no_vistas", "actualizado_en")
+           .first())
+    if row is None:
+        chat, sol = recontar([user_id])[int(user_id)]
+        row = {"chat_no_leidos": chat, "solicitudes_no_vistas": sol, "actualizado_en": timezone.now()}
+    return {
+        "chat_unread": row["chat_no_leidos"],
+        "requests_unseen": row["solicitudes_no_vistas"],
+        "total": row["chat_no_leidos"] + row["solicitudes_no_vistas"],
+        "actualizado_en": row["actualizado_en"],
+    }
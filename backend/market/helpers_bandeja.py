@@ -0,0 +1,273 @@
+# market/helpers_bandeja.py
+"""
+Bandeja de chats desnormalizada (tabla bandeja_chat, una fila por
+participante) para que lista_conversaciones no repita el JOIN de 7 tablas.
+
+Mantenimiento:
+- bandeja_mensaje(): enviar_mensaje / sync por lotes -> preview + no_leidos+n
+  del otro (dentro de la transacción del mensaje).
+- bandeja_visto(): marcar_visto -> no_leidos=0.
+- sincronizar_bandeja(conv_ids): recalcula las filas completas desde las
+  tablas fuente. Tras las transiciones de solicitud/intercambio y los cambios
+  de libro lo llama el consumidor "bandeja" (helpers_eventos); en cambios de
+  perfil, la vista.
+  Selectores: conversaciones_de_solicitudes / _de_libro / _de_usuario.
+  También refresca Conversacion.escribible (helpers_chat.actualizar_escribible).
+- `manage.py rebuild_bandeja` reconstruye todo (backfill / deriva).
+- Cada cambio de no_leidos se refleja en el badge (helpers_badges).
+
+Lectura: pagina_bandeja() = scan de ix_bandeja_usuario con keyset
+(?cursor=<epoch_us>:<id_conversacion>, orden ultimo_enviado_en DESC);
+limit=None = bandeja completa (clientes que no paginan).
+
+no_leidos cuenta mensajes del OTRO posteriores a ultimo_visto_id_mensaje.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .helpers_badges import recontar_chat, sumar_chat
+from .helpers_chat import actualizar_escribible
+from .models import (
+    BandejaChat, Conversacion, ConversacionMensaje, ConversacionMensajeArchivo, ConversacionParticipante,
+)
+
+PREVIEW_MAX = 255
+BANDEJA_PAGE_SIZE = 50
+BANDEJA_MAX_PAGE_SIZE = 200
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+CAMPOS = [
+    "rol", "archivado",
+    "otro_usuario_id", "otro_nombre_usuario", "otro_nombres", "otro_imagen_perfil",
+    "titulo", "id_intercambio", "intercambio_estado", "libro_solicitado_titulo", "libro_ofrecido_titulo",
+    "ultimo_id_mensaje", "ultimo_mensaje", "ultimo_enviado_en", "no_leidos", "actualizado_en",
+]
+
+
+def _preview(cuerpo) -> str | None:
+    return (cuerpo or "")[:PREVIEW_MAX] if cuerpo is not None else None
+
+
+# =========================
+# Selectores de conversaciones afectadas
+# =========================
+
+def conversaciones_de_solicitudes(solicitud_ids) -> list:
+    ids = [x for x in solicitud_ids or [] if x]
+    if not ids:
+        return []
+    return list(Conversacion.objects
+                .filter(id_intercambio__id_solicitud_id__in=ids)
+                .values_list("id_conversacion", flat=True))
+
+
+def conversaciones_de_libro(libro_id: int) -> list:
+    return list(Conversacion.objects
+                .filter(Q(id_intercambio__id_libro_ofrecido_aceptado_id=libro_id) |
+                        Q(id_intercambio__id_solicitud__id_libro_deseado_id=libro_id))
+                .values_list("id_conversacion", flat=True)
+                .distinct())
+
+
+def conversaciones_de_usuario(user_id: int) -> list:
+    # conversaciones donde `user_id` aparece como "el otro" (nombre/avatar)
+    return list(BandejaChat.objects
+                .filter(otro_usuario_id=user_id)
+                .values_list("id_conversacion_id", flat=True)
+                .distinct())
+
+
+# =========================
+# Recalcular filas completas
+# =========================
+
+def _filas(conv_ids) -> list:
+    no_leidos = (ConversacionMensaje.objects
+                 .filter(id_conversacion=OuterRef("id_conversacion"),
+                         id_mensaje__gt=OuterRef("ultimo_visto_id_mensaje"))
+                 .exclude(id_usuario_emisor=OuterRef("id_usuario"))
+                 .values("id_conversacion")
+                 .annotate(c=Count("pk"))
+                 .values("c")[:1])
+
+    parts = list(
+        ConversacionParticipante.objects
+        .filter(id_conversacion_id__in=conv_ids)
+        .select_related(
+            "id_usuario",
+            "id_conversacion__id_intercambio__id_solicitud__id_libro_deseado",
+            "id_conversacion__id_intercambio__id_libro_ofrecido_aceptado",
+        )
+        .annotate(n_no_leidos=Coalesce(Subquery(no_leidos), 0))
+        .order_by("id_conversacion_id", "id")
+    )
+
+    por_conv = {}
+    for p in parts:
+        por_conv.setdefault(p.id_conversacion_id, []).append(p)
+
+    ultimos = {c.id_conversacion.ultimo_id_mensaje for c in parts if c.id_conversacion.ultimo_id_mensaje}
+    cuerpos = dict(ConversacionMensaje.objects
+                   .filter(pk__in=ultimos)
+                   .values_list("id_mensaje", "cuerpo")) if ultimos else {}
+    if ultimos - set(cuerpos):
+        # conversaciones archivadas: el último mensaje está en la tabla de archivo
+        cuerpos.update(ConversacionMensajeArchivo.objects
+                       .filter(pk__in=ultimos - set(cuerpos))
+                       .values_list("id_mensaje", "cuerpo"))
+
+    now = timezone.now()
+    filas = []
+    for conv_id, ps in por_conv.items():
+        conv = ps[0].id_conversacion
+        ix = conv.id_intercambio
+        si = getattr(ix, "id_solicitud", None)
+        estado = (getattr(ix, "estado_intercambio", None) or "").strip() or (getattr(si, "estado", None) or "").strip()
+        libro_sol = getattr(getattr(si, "id_libro_deseado", None), "titulo", None)
+        libro_ofr = getattr(getattr(ix, "id_libro_ofrecido_aceptado", None), "titulo", None)
+
+        for me in ps:
+            otro = next((p.id_usuario for p in ps if p.id_usuario_id != me.id_usuario_id), None)
+            filas.append(BandejaChat(
+                id_usuario_id=me.id_usuario_id,
+                id_conversacion_id=conv_id,
+                rol=me.rol,
+                archivado=bool(me.archivado),
+                otro_usuario_id=getattr(otro, "pk", None),
+                otro_nombre_usuario=getattr(otro, "nombre_usuario", None),
+                otro_nombres=getattr(otro, "nombres", None),
+                otro_imagen_perfil=getattr(otro, "imagen_perfil", None),
+                titulo=conv.titulo,
+                id_intercambio=getattr(ix, "id_intercambio", None),
+                intercambio_estado=estado or None,
+                libro_solicitado_titulo=libro_sol,
+                libro_ofrecido_titulo=libro_ofr,
+                ultimo_id_mensaje=conv.ultimo_id_mensaje or 0,
+                ultimo_mensaje=_preview(cuerpos.get(conv.ultimo_id_mensaje)),
+                ultimo_enviado_en=conv.actualizado_en or now,
+                no_leidos=int(me.n_no_leidos or 0),
+                actualizado_en=now,
+            ))
+    return filas
+
+
+def sincronizar_bandeja(conv_ids) -> int:
+    """Recalcula (upsert) las filas de esas conversaciones; borra las huérfanas."""
+    conv_ids = sorted({int(x) for x in conv_ids or [] if x})
+    if not conv_ids:
+        return 0
+    # 👈 mismo punto de enganche que las transiciones: caché de enviar_mensaje
+    actualizar_escribible(conv_ids)
+    filas = _filas(conv_ids)
+
+    vigentes = {(f.id_usuario_id, f.id_conversacion_id) for f in filas}
+    usuarios = {f.id_usuario_id for f in filas}
+    for pk, uid, cid in (BandejaChat.objects
+                         .filter(id_conversacion_id__in=conv_ids)
+                         .values_list("pk", "id_usuario_id", "id_conversacion_id")):
+        if (uid, cid) not in vigentes:
+            BandejaChat.objects.filter(pk=pk).delete()
+            usuarios.add(uid)
+
+    if filas:
+        conflict_target = {}
+        if connection.features.supports_update_conflicts_with_target:
+            conflict_target["unique_fields"] = ["id_usuario", "id_conversacion"]
+        BandejaChat.objects.bulk_create(filas, update_conflicts=True, update_fields=CAMPOS, **conflict_target)
+    recontar_chat(usuarios)
+    return len(filas)
+
+
+# =========================
+# Actualizaciones incrementales (caminos calientes)
+# =========================
+
+def bandeja_mensaje(conversacion_id: int, mensaje, cuando=None, n: int = 1) -> list:
+    """
+    Nuevo mensaje: preview/orden para todos, +n no leídos para los demás
+    (n > 1 en lotes: `mensaje` es el último del lote).
+    Devuelve los ids de los participantes (para publicar en sus canales).
+    """
+    now = cuando or timezone.now()
+    filas = BandejaChat.objects.filter(id_conversacion_id=conversacion_id)
+    partes = list(filas.values_list("id_usuario_id", "archivado"))
+    if not partes:
+        # conversación sin filas aún (previa al backfill): se calcula completa
+        sincronizar_bandeja([conversacion_id])
+        return list(filas.values_list("id_usuario_id", flat=True))
+    # 👈 envíos concurrentes sin lock: si ya comiteó uno más nuevo, este no pisa
+    # preview ni cursor (el long-poll usa ultimo_id_mensaje__gt). Igual que
+    # Conversacion (Greatest); los no leídos se suman aparte, siempre.
+    filas.filter(ultimo_id_mensaje__lt=mensaje.id_mensaje).update(
+        ultimo_id_mensaje=mensaje.id_mensaje,
+        ultimo_mensaje=_preview(mensaje.cuerpo),
+        ultimo_enviado_en=now,
+        actualizado_en=now,
+    )
+    otros = [u for u, _ in partes if u != mensaje.id_usuario_emisor_id]
+    if otros:
+        filas.filter(id_usuario_id__in=otros).update(no_leidos=F("no_leidos") + n)
+    sumar_chat([u for u, archivado in partes if u in otros and not archivado], n)
+    return [u for u, _ in partes]
+
+
+def bandeja_visto(conversacion_id: int, user_id: int) -> None:
+    """Llamar dentro de una transacción: bloquea la fila para que el -n del badge cuadre."""
+    fila = (BandejaChat.objects
+            .select_for_update()
+            .filter(id_conversacion_id=conversacion_id, id_usuario_id=user_id)
+            .values("pk", "no_leidos", "archivado")
+            .first())
+    if not fila or not fila["no_leidos"]:
+        return
+    BandejaChat.objects.filter(pk=fila["pk"]).update(no_leidos=0, actualizado_en=timezone.now())
+    if not fila["archivado"]:
+        sumar_chat([user_id], -fila["no_leidos"])
+
+
+# =========================
+# Lectura paginada
+# =========================
+
+def _fmt_cursor(ts, conv_id) -> str:
+    return f"{(ts - _EPOCH) // timedelta(microseconds=1)}:{int(conv_id)}"
+
+
+def _parse_cursor(raw):
+    """'1700000000123456:42' -> (datetime, 42); basura -> None."""
+    try:
+        us, pk = str(raw).split(":", 1)
+        return _EPOCH + timedelta(microseconds=int(us)), int(pk)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def pagina_bandeja(user_id: int, limit=BANDEJA_PAGE_SIZE, cursor=None):
+    """Devuelve (filas BandejaChat, next_cursor | None). limit=None: sin tope."""
+    qs = (BandejaChat.objects
+          .filter(id_usuario_id=user_id, archivado=False)
+          .order_by("-ultimo_enviado_en", "-id_conversacion_id"))
+    pos = _parse_cursor(cursor) if cursor else None
+    if pos:
+        ts, pk = pos
+        qs = qs.filter(Q(ultimo_enviado_en__lt=ts) | Q(ultimo_enviado_en=ts, id_conversacion_id__lt=pk))
+    if limit is None:
+        return list(qs), None
+
+    try:
+        limit = int(limit or BANDEJA_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = BANDEJA_PAGE_SIZE
+    limit = max(1, min(limit, BANDEJA_MAX_PAGE_SIZE))
+
+    filas = list(qs[:limit + 1])
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        next_cursor = _fmt_cursor(ultima.ultimo_enviado_en, ultima.id_conversacion_id)
+    return filas, next_cursor
@@ -0,0 +1,114 @@
+# market/helpers_cache.py
+"""
+Caché de respuestas para endpoints públicos de solo lectura.
+
+- Clave = dominio + versión del dominio + esquema + host + ruta + query params
+  ordenados (las respuestas llevan URLs absolutas de imágenes).
+- Cada escritura relevante llama a bump_version(<dominio>) y las claves
+  viejas simplemente dejan de usarse (expiran por TIMEOUT).
+- Backend: settings.CACHES["default"] (locmem por defecto; para varios
+  workers/procesos usar uno compartido, p.ej. Redis, vía CACHE_BACKEND).
+- Contadores hit/miss por dominio: stats() / GET /api/cache/stats/.
+"""
+import hashlib
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+# Dominios de invalidación
+LIBROS = "libros"          # latest, populares, libros_por_genero
+CATALOGO = "catalogo"      # géneros, regiones, comunas
+PUNTOS = "puntos"          # puntos_encuentro
+
+DOMINIOS = (LIBROS, CATALOGO, PUNTOS)
+
+_VER_KEY = "cv:{}"
+_STAT_KEY = "cstat:{}:{}"
+
+
+def get_version(dominio: str) -> int:
+    key = _VER_KEY.format(dominio)
+    ver = cache.get(key)
+    if ver is None:
+        cache.add(key, 1, timeout=None)
+        ver = cache.get(key) or 1
+    return int(ver)
+
+
+def _incr(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        # no existía (o expiró): la creamos; si otro proceso ganó, reintenta
+        if not cache.add(key, 2 if key.startswith("cv:") else 1, timeout=None):
+            cache.incr(key)
+
+
+def bump_version(*dominios: str) -> None:
+    """Invalida los dominios indicados cuando la transacción actual hace commit."""
+    def _do():
+        for d in dominios:
+            _incr(_VER_KEY.format(d))
+    transaction.on_commit(_do)
+
+
+def _stat(dominio: str, tipo: str) -> None:
+    try:
+        _incr(_STAT_KEY.format(tipo, dominio))
+    except Exception:
+        pass
+
+
+def stats() -> dict:
+    out = {}
+    for d in DOMINIOS:
+        hits = int(cache.get(_STAT_KEY.format("hit", d)) or 0)
+        misses = int(cache.get(_STAT_KEY.format("miss", d)) or 0)
+        out[d] = {
+            "version": get_version(d),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if (hits + misses) else None,
+        }
+    return out
+
+
+def _response_key(dominio: str, request) -> str:
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.lists()))
+    # 👈 esquema + host: los payloads traen URLs absolutas (media_abs / build_absolute_uri)
+    raw = f"{request.scheme}://{request.get_host()}{request.path}?{params}"
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return f"resp:{dominio}:v{get_version(dominio)}:{digest}"
+
+
+def cached_response(dominio: str, timeout: int | None = None):
+    """
+    Decorador para vistas GET (funciones @api_view o @action de un ViewSet).
+    Va DEBAJO de @api_view / @action. Solo cachea respuestas 200.
+    """
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            request = next(a for a in args if hasattr(a, "query_params"))
+            key = _response_key(dominio, request)
+
+            data = cache.get(key)
+            if data is not None:
+                _stat(dominio, "hit")
+                resp = Response(data)
+                resp["X-Cache"] = "HIT"
+                return resp
+
+            _stat(dominio, "miss")
+            resp = fn(*args, **kwargs)
+            if getattr(resp, "status_code", None) == 200 and hasattr(resp, "data"):
+                if timeout is None:
+                    cache.set(key, resp.data)
+                else:
+                    cache.set(key, resp.data, timeout)
+                resp["X-Cache"] = "MISS"
+            return resp
+        return wrapper
+    return deco
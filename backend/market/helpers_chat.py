@@ -0,0 +1,235 @@
+# market/helpers_chat.py
+"""
+Paginación keyset de mensajes del chat.
+
+Índice requerido: conversacion_mensaje (id_conversacion, id_mensaje)
+-> `manage.py indices_chat` lo crea/verifica (tabla managed=False).
+
+    sin cursor        -> los `limit` más recientes (has_more = hay más antiguos)
+    before_id=<id>    -> los `limit` anteriores a id (has_more = hay más antiguos)
+    after_id=<id>     -> los `limit` siguientes a id (has_more = hay más nuevos)
+
+Siempre se devuelven en orden ascendente de id_mensaje. Si la conversación
+está archivada (helpers_archivo) se lee conversacion_mensaje_archivo.
+
+Envío sin locks: Conversacion.escribible es una caché de "la solicitud está
+Pendiente/Aceptada" que mantienen las transiciones (actualizar_escribible,
+llamada desde sincronizar_bandeja). insertar_mensaje() = 1 INSERT + 1 UPDATE
+condicional (WHERE escribible y el emisor participa); si el UPDATE no toca
+filas se deshace el INSERT. Nada de select_for_update sobre la solicitud.
+`manage.py bench_chat` compara ambos caminos (mensajes/s).
+
+Lotes (cola offline de la app): insertar_lote() = 1 bulk_create + 1 UPDATE
+por conversación tocada; `id_cliente` (único por emisor) hace idempotente
+el reenvío del mismo lote. Los reenvíos concurrentes del mismo emisor se
+serializan con un lock sobre su fila de usuario: así "creado" (y los efectos
+que dispara) sale de una sola llamada.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core.models import Usuario
+
+from .constants import SOLICITUD_ESTADO
+from .helpers_realtime import publicar_chat
+from .models import Conversacion, ConversacionMensaje, ConversacionMensajeArchivo, ConversacionParticipante
+
+ESTADOS_ESCRIBIBLES = (SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"])
+
+MENSAJES_PAGE_SIZE = 50
+MENSAJES_MAX_PAGE_SIZE = 200
+SYNC_MAX_LOTE = 100
+ID_CLIENTE_MAX = 64
+
+
+def mensaje_dict(m) -> dict:
+    """Forma de un ConversacionMensaje en la API (listado, long-poll y socket)."""
+    return {
+        "id_mensaje": m.id_mensaje,
+        "emisor_id": m.id_usuario_emisor_id,
+        "cuerpo": m.cuerpo,
+        "enviado_en": m.enviado_en,
+        "eliminado": m.eliminado,
+    }
+
+
+def parse_limit(raw) -> int:
+    try:
+        limit = int(raw or MENSAJES_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = MENSAJES_PAGE_SIZE
+    return max(1, min(limit, MENSAJES_MAX_PAGE_SIZE))
+
+
+def pagina_mensajes(conversacion_id: int, before_id=None, after_id=None, limit: int | None = MENSAJES_PAGE_SIZE):
+    """
+    Devuelve (mensajes, has_more). Una consulta de página (limit + 1);
+    limit=None: sin tope (historial completo, has_more=False).
+    """
+    archivada = Conversacion.objects.filter(pk=conversacion_id, archivada_en__isnull=False).exists()
+    modelo = ConversacionMensajeArchivo if archivada else ConversacionMensaje
+    qs = modelo.objects.filter(id_conversacion_id=conversacion_id)
+
+    if limit is None:
+        if after_id is not None:
+            qs = qs.filter(id_mensaje__gt=after_id)
+        if before_id is not None:
+            qs = qs.filter(id_mensaje__lt=before_id)
+        return [mensaje_dict(m) for m in qs.order_by("id_mensaje")], False
+
+    if after_id is not None:
+        filas = list(qs.filter(id_mensaje__gt=after_id).order_by("id_mensaje")[:limit + 1])
+        has_more = len(filas) > limit
+        filas = filas[:limit]
+    else:
+        if before_id is not None:
+            qs = qs.filter(id_mensaje__lt=before_id)
+        filas = list(qs.order_by("-id_mensaje")[:limit + 1])
+        has_more = len(filas) > limit
+        filas = filas[:limit][::-1]
+
+    return [mensaje_dict(m) for m in filas], has_more
+
+
+# =========================
+# Envío (camino caliente)
+# =========================
+
+def insertar_mensaje(conversacion_id: int, emisor_id: int, cuerpo: str, cuando=None):
+    """
+    INSERT + UPDATE condicional de conversacion. Devuelve el mensaje, o None
+    si la conversación no existe, no es escribible o el emisor no participa
+    (el INSERT se deshace).
+    """
+    now = cuando or timezone.now()
+    try:
+        with transaction.atomic():
+            m = ConversacionMensaje.objects.create(
+                id_conversacion_id=conversacion_id,
+                id_usuario_emisor_id=emisor_id,
+                cuerpo=cuerpo,
+                enviado_en=now,
+            )
+            # GREATEST: con envíos concurrentes el último id nunca retrocede
+            ok = Conversacion.objects.filter(
+                Exists(ConversacionParticipante.objects.filter(
+                    id_conversacion_id=OuterRef("pk"), id_usuario_id=emisor_id)),
+                pk=conversacion_id, escribible=True,
+            ).update(
+                actualizado_en=now,
+                ultimo_id_mensaje=Greatest(F("ultimo_id_mensaje"), m.id_mensaje),
+            )
+            if not ok:
+                transaction.set_rollback(True)
+                return None
+    except IntegrityError:
+        # FK inexistente (conversación o emisor): el llamador decide el error
+        return None
+    return m
+
+
+def insertar_lote(emisor_id: int, items, cuando=None):
+    """
+    items: [{"client_id", "id_conversacion", "cuerpo"}] ya validados (client_id únicos).
+    Devuelve ({client_id: (estado, id_mensaje | None)}, {id_conversacion: [mensajes nuevos]}).
+    estado: "creado" | "duplicado" (ya estaba) | "rechazado" (no participa / no escribible).
+    Llamar dentro de una transacción.
+    """
+    now = cuando or timezone.now()
+    client_ids = [it["client_id"] for it in items]
+    # 👈 un reenvío concurrente del mismo lote espera aquí y luego ve estas filas en `previos`
+    Usuario.objects.select_for_update().filter(pk=emisor_id).values_list("pk", flat=True).first()
+    previos = dict(ConversacionMensaje.objects
+                   .select_for_update()  # lectura bloqueante: lo último comiteado, no el snapshot
+                   .filter(id_usuario_emisor_id=emisor_id, id_cliente__in=client_ids)
+                   .values_list("id_cliente", "id_mensaje"))
+    permitidas = set(ConversacionParticipante.objects
+                     .filter(id_usuario_id=emisor_id,
+                             id_conversacion_id__in={it["id_conversacion"] for it in items},
+                             id_conversacion__escribible=True)
+                     .values_list("id_conversacion_id", flat=True))
+
+    resultado = {}
+    nuevos = []
+    for it in items:
+        cid = it["client_id"]
+        if cid in previos:
+            resultado[cid] = ("duplicado", previos[cid])
+        elif it["id_conversacion"] not in permitidas:
+            resultado[cid] = ("rechazado", None)
+        else:
+            nuevos.append(ConversacionMensaje(
+                id_conversacion_id=it["id_conversacion"],
+                id_usuario_emisor_id=emisor_id,
+                cuerpo=it["cuerpo"],
+                enviado_en=now,
+                id_cliente=cid,
+            ))
+    if not nuevos:
+        return resultado, {}
+
+    # MySQL no devuelve los PK del INSERT múltiple: se releen por (emisor, id_cliente).
+    # Con el lock del emisor nadie más inserta estos id_cliente (no están en `previos`):
+    # todo lo releído lo insertó esta llamada, y el DELETE de abajo sólo toca filas propias.
+    ConversacionMensaje.objects.bulk_create(nuevos, ignore_conflicts=True)
+    por_conv = {}
+    for m in (ConversacionMensaje.objects
+              .filter(id_usuario_emisor_id=emisor_id, id_cliente__in=[m.id_cliente for m in nuevos])
+              .order_by("id_mensaje")):
+        por_conv.setdefault(m.id_conversacion_id, []).append(m)
+
+    for conv_id, ms in list(por_conv.items()):
+        ok = Conversacion.objects.filter(pk=conv_id, escribible=True).update(
+            actualizado_en=now,
+            ultimo_id_mensaje=Greatest(F("ultimo_id_mensaje"), ms[-1].id_mensaje),
+        )
+        if not ok:
+            # se cerró entre la validación y el UPDATE: fuera esos mensajes
+            ConversacionMensaje.objects.filter(pk__in=[m.id_mensaje for m in ms]).delete()
+            del por_conv[conv_id]
+            for m in ms:
+                resultado[m.id_cliente] = ("rechazado", None)
+            continue
+        for m in ms:
+            resultado[m.id_cliente] = ("creado", m.id_mensaje)
+
+    for m in nuevos:
+        # ignorado por el índice único y no visible: otro reenvío lo insertó
+        resultado.setdefault(m.id_cliente, ("duplicado", None))
+    return resultado, por_conv
+
+
+# =========================
+# Caché "escribible" (transiciones)
+# =========================
+
+def actualizar_escribible(conv_ids) -> int:
+    """
+    Recalcula Conversacion.escribible desde el estado de la solicitud (y
+    archivada_en: una conversación archivada nunca es escribible); sólo
+    escribe (y sube escritura_version) donde cambió. Avisa a los sockets.
+    """
+    ids = sorted({int(x) for x in conv_ids or [] if x})
+    if not ids:
+        return 0
+    abrir, cerrar, version = [], [], {}
+    filas = (Conversacion.objects
+             .filter(pk__in=ids)
+             .values_list("id_conversacion", "escribible", "escritura_version",
+                          "archivada_en", "id_intercambio__id_solicitud__estado"))
+    for pk, actual, v, archivada, estado in filas:
+        debe = archivada is None and (estado or "").strip() in ESTADOS_ESCRIBIBLES
+        if bool(actual) != debe:
+            (abrir if debe else cerrar).append(pk)
+            version[pk] = v + 1
+
+    for lista, valor in ((abrir, True), (cerrar, False)):
+        if lista:
+            Conversacion.objects.filter(pk__in=lista).update(
+                escribible=valor, escritura_version=F("escritura_version") + 1)
+            for pk in lista:
+                # 🔔 el cliente habilita/deshabilita la caja de texto
+                publicar_chat(pk, "estado", {"escribible": valor, "escritura_version": version[pk]})
+    return len(abrir) + len(cerrar)
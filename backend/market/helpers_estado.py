@@ -1,7 +1,8 @@
 # helpers_estado.py (o dentro de views si prefieres)
-from django.utils import timezone
-from .constants import STATUS_REASON
-from .models import Libro
+from django.db.models import Exists, OuterRef, Q, Max, Value, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from .constants import STATUS_REASON, INTERCAMBIO_ESTADO, SOLICITUD_ESTADO
+from .models import Libro, Intercambio, SolicitudIntercambio, SolicitudOferta
 
 def set_owner_unavailable(libro: Libro, flag: bool):
     """
@@ -24,3 +25,149 @@ def set_owner_unavailable(libro: Libro, flag: bool):
             # Si estaba BAJA/COMPLETADO, no cambies nada
             return
     libro.save(update_fields=["disponible", "status_reason"])
+
+
+# =========================
+# en_negociacion (columna mantenida en libro)
+# =========================
+
+# Intercambios activos (Pendiente/Aceptado) donde participa el libro (cualquiera de los roles)
+intercambio_activo_ix = Exists(
+    Intercambio.objects.filter(
+        Q(id_libro_ofrecido_aceptado=OuterRef('pk')) |
+        Q(id_solicitud__id_libro_deseado=OuterRef('pk'))
+    ).filter(
+        Q(estado_intercambio__iexact=INTERCAMBIO_ESTADO["PENDIENTE"]) |
+        Q(estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"])
+    )
+)
+
+# Pendiente SALIENTE: el dueño ofreció este libro en una solicitud PENDIENTE
+pendiente_saliente_ix = Exists(
+    SolicitudOferta.objects.filter(
+        id_libro_ofrecido_id=OuterRef('pk'),
+        id_solicitud__id_usuario_solicitante_id=OuterRef('id_usuario_id'),
+    ).filter(
+        id_solicitud__estado__iexact=SOLICITUD_ESTADO["PENDIENTE"]
+    )
+)
+
+
+def libros_de_solicitudes(solicitud_ids) -> set:
+    """
+    IDs de todos los libros que participan en las solicitudes dadas
+    (deseado, ofrecido aceptado y libros ofrecidos en sus ofertas).
+    Llamar ANTES de cambiar estados masivamente para saber qué recalcular.
+    """
+    ids = [int(s) for s in solicitud_ids if s]
+    if not ids:
+        return set()
+
+    out = set()
+    for deseado, aceptado in (SolicitudIntercambio.objects
+                              .filter(pk__in=ids)
+                              .values_list("id_libro_deseado_id", "id_libro_ofrecido_aceptado_id")):
+        out.update(x for x in (deseado, aceptado) if x)
+    out.update(SolicitudOferta.objects
+               .filter(id_solicitud_id__in=ids)
+               .values_list("id_libro_ofrecido_id", flat=True))
+    out.update(x for x in (Intercambio.objects
+                           .filter(id_solicitud_id__in=ids)
+                           .values_list("id_libro_ofrecido_aceptado_id", flat=True)) if x)
+    return out
+
+
+def solicitudes_activas_de_libro(libro_id: int) -> list:
+    """Solicitudes Pendiente/Aceptada donde el libro es deseado, ofrecido o aceptado."""
+    return list(SolicitudIntercambio.objects
+                .filter(Q(id_libro_deseado_id=libro_id) |
+                        Q(ofertas__id_libro_ofrecido_id=libro_id) |
+                        Q(id_libro_ofrecido_aceptado_id=libro_id),
+                        estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]])
+                .values_list("id_solicitud", flat=True)
+                .distinct())
+
+
+def recalcular_negociacion(libro_ids) -> int:
+    """
+    Recalcula libro.en_negociacion para los libros indicados a partir de
+    intercambios activos y pendientes salientes. Se llama dentro de la misma
+    transacción que cambia el estado del intercambio/solicitud.
+    Devuelve cuántas filas de libro cambiaron.
+    """
+    ids = {int(x) for x in libro_ids if x}
+    if not ids:
+        return 0
+
+    activos = set()
+    for pk, ix, sal in (Libro.objects
+                        .filter(pk__in=ids)
+                        .annotate(_ix=intercambio_activo_ix, _sal=pendiente_saliente_ix)
+                        .values_list("pk", "_ix", "_sal")):
+        if ix or sal:
+            activos.add(pk)
+
+    changed = 0
+    if activos:
+        changed += (Libro.objects
+                    .filter(pk__in=activos, en_negociacion=False)
+                    .update(en_negociacion=True))
+    libres = ids - activos
+    if libres:
+        changed += (Libro.objects
+                    .filter(pk__in=libres, en_negociacion=True)
+                    .update(en_negociacion=False))
+    return changed
+
+
+# =========================
+# ultima_actividad_id (columna mantenida en libro)
+# =========================
+# Misma marca compuesta que usaba my_books: el mayor id entre
+# intercambios (como aceptado o deseado) y solicitudes (como deseado).
+# Se compara contra LibroSolicitudesVistas.ultimo_visto_id_intercambio.
+
+def registrar_actividad(libro_ids, actividad_id) -> int:
+    """
+    Sube libro.ultima_actividad_id a `actividad_id` (nunca la baja).
+    Llamar al crear una solicitud o un intercambio, dentro de la misma transacción.
+    """
+    ids = {int(x) for x in libro_ids if x}
+    if not ids or not actividad_id:
+        return 0
+    return (Libro.objects
+            .filter(pk__in=ids, ultima_actividad_id__lt=int(actividad_id))
+            .update(ultima_actividad_id=int(actividad_id)))
+
+
+def recalcular_actividad(libro_ids) -> int:
+    """Reconstruye ultima_actividad_id desde intercambios/solicitudes. Devuelve filas cambiadas."""
+    ids = {int(x) for x in libro_ids if x}
+    if not ids:
+        return 0
+
+    max_ix_acc_sq = (Intercambio.objects
+                     .filter(id_libro_ofrecido_aceptado=OuterRef("pk"))
+                     .values("id_libro_ofrecido_aceptado")
+                     .annotate(m=Max("id_intercambio")).values("m")[:1])
+    max_ix_des_sq = (Intercambio.objects
+                     .filter(id_solicitud__id_libro_deseado=OuterRef("pk"))
+                     .values("id_solicitud__id_libro_deseado")
+                     .annotate(m=Max("id_intercambio")).values("m")[:1])
+    max_si_sq = (SolicitudIntercambio.objects
+                 .filter(id_libro_deseado=OuterRef("pk"))
+                 .values("id_libro_deseado")
+                 .annotate(m=Max("id_solicitud")).values("m")[:1])
+
+    changed = 0
+    for pk, actual, calc in (Libro.objects
+                             .filter(pk__in=ids)
+                             .annotate(_act=Greatest(
+                                 Coalesce(Subquery(max_ix_acc_sq), Value(0)),
+                                 Coalesce(Subquery(max_ix_des_sq), Value(0)),
+                                 Coalesce(Subquery(max_si_sq), Value(0)),
+                             ))
+                             .values_list("pk", "ultima_actividad_id", "_act")):
+        if int(actual or 0) != int(calc or 0):
+            changed += Libro.objects.filter(pk=pk).update(ultima_actividad_id=int(calc or 0))
+    return changed
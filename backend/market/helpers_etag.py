@@ -0,0 +1,173 @@
+# market/helpers_etag.py
+"""
+GET condicional (ETag / Last-Modified / 304) para los listados que el
+front consulta en bucle.
+
+Cada endpoint define un "validador": UNA consulta agregada e indexada
+(count / max id / max timestamp) o una versión por usuario que cambia cuando
+cambia el payload.
+Si el cliente manda If-None-Match (o If-Modified-Since) y coincide,
+respondemos 304 sin tocar serializers.
+
+libro.actualizado_en e intercambio.actualizado_en los mantiene MySQL
+(ON UPDATE CURRENT_TIMESTAMP, migración 0017), así que también cubren
+los .update() masivos.
+"""
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from django.db.models import Count, Max, Subquery, Sum
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+
+from .helpers_badges import version_solicitudes
+from .models import (
+    Libro, Calificacion, Favorito,
+    BandejaChat, TituloPopularidad,
+)
+
+
+def _etag(request, partes) -> str:
+    raw = "|".join([request.path, request.META.get("QUERY_STRING", "")] + [str(p) for p in partes])
+    return 'W/"%s"' % hashlib.sha1(raw.encode("utf-8")).hexdigest()[:27]
+
+
+def _ultimo(partes):
+    fechas = [p for p in partes if isinstance(p, datetime)]
+    if not fechas:
+        return None
+    last = max(f if timezone.is_aware(f) else timezone.make_aware(f) for f in fechas)
+    return int(last.timestamp())
+
+
+def _opaco(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _no_modificado(request, etag, last_ts) -> bool:
+    inm = request.META.get("HTTP_IF_NONE_MATCH")
+    if inm:
+        # comparación débil: W/"x" == "x"; sólo tags reales ("*" no valida una caché)
+        tags = {_opaco(t.strip()) for t in inm.split(",")}
+        return _opaco(etag) in tags
+    ims = request.META.get("HTTP_IF_MODIFIED_SINCE")
+    if ims and last_ts is not None:
+        since = parse_http_date_safe(ims)
+        return since is not None and last_ts <= since
+    return False
+
+
+def con_etag(validador):
+    """
+    Decorador para vistas GET (funciones @api_view o @action de un ViewSet).
+    Va DEBAJO de @api_view / @action y ENCIMA de @cached_response.
+    `validador(request, **kwargs)` devuelve una tupla de valores o None (sin validar).
+    """
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            request = next(a for a in args if hasattr(a, "query_params"))
+            partes = validador(request, **kwargs)
+            if partes is None:
+                return fn(*args, **kwargs)
+
+            etag = _etag(request, partes)
+            last_ts = _ultimo(partes)
+            if _no_modificado(request, etag, last_ts):
+                resp = Response(status=304)
+            else:
+                resp = fn(*args, **kwargs)
+                if getattr(resp, "status_code", None) != 200:
+                    return resp
+
+            resp["ETag"] = etag
+            if last_ts is not None:
+                resp["Last-Modified"] = http_date(last_ts)
+            resp["Cache-Control"] = "private, no-cache"
+            return resp
+        return wrapper
+    return deco
+
+
+def _valores(agg: dict):
+    return tuple(agg[k] for k in sorted(agg))
+
+
+def _user_id(request):
+    try:
+        return int(request.query_params.get("user_id") or 0) or None
+    except (TypeError, ValueError):
+        return None
+
+
+# =========================
+# Validadores
+# =========================
+
+def v_libros_publicos(request, **kwargs):
+    """latest / libros_por_genero / catalogo: disponibles y no en negociación (ix_libro_publico)."""
+    return _valores(
+        Libro.objects
+        .filter(disponible=True, en_negociacion=False)
+        .aggregate(n=Count("pk"), i=Max("pk"), u=Max("actualizado_en"))
+    )
+
+
+def v_catalogo(request, **kwargs):
+    """Como v_libros_publicos + calificaciones (el catálogo trae el rating del dueño)."""
+    ultima_calif = Calificacion.objects.order_by("-pk").values("pk")[:1]
+    return _valores(
+        Libro.objects
+        .filter(disponible=True, en_negociacion=False)
+        .aggregate(n=Count("pk"), i=Max("pk"), u=Max("actualizado_en"),
+                   c=Max(Subquery(ultima_calif)))
+    )
+
+
+def v_populares(request, **kwargs):
+    return _valores(
+        TituloPopularidad.objects
+        .aggregate(n=Count("pk"), u=Max("actualizado_en"))
+    )
+
+
+def _v_solicitudes(uid: int):
+    """
+    usuario_contadores.solicitudes_version (una lectura por PK): la sube emitir()
+    en cada transición, propuesta o cambio de libro de una solicitud del usuario.
+    Recibidas y enviadas comparten versión (la URL distingue el ETag).
+    """
+    return (version_solicitudes(uid),)
+
+
+def v_solicitudes_recibidas(request, **kwargs):
+    uid = _user_id(request)
+    return _v_solicitudes(uid) if uid else None
+
+
+def v_solicitudes_enviadas(request, **kwargs):
+    uid = _user_id(request)
+    return _v_solicitudes(uid) if uid else None
+
+
+def v_conversaciones(request, user_id=None, **kwargs):
+    if not user_id:
+        return None
+    return _valores(
+        BandejaChat.objects
+        .filter(id_usuario_id=user_id, archivado=False)
+        .aggregate(n=Count("pk"), u=Max("actualizado_en"), m=Max("ultimo_id_mensaje"), v=Sum("no_leidos"))
+    )
+
+
+def v_favoritos(request, **kwargs):
+    uid = _user_id(request)
+    if not uid:
+        return None
+    return _valores(
+        Favorito.objects
+        .filter(id_usuario_id=uid)
+        .aggregate(n=Count("pk"), i=Max("pk"), u=Max("id_libro__actualizado_en"))
+    )
@@ -0,0 +1,254 @@
+# market/helpers_eventos.py
+"""
+Outbox / bitácora de eventos del ciclo de vida de solicitudes e intercambios
+(tabla evento_intercambio).
+
+- Escritura: las transiciones llaman emitir(...) dentro de SU transacción; si
+  la transición hace rollback, el evento tampoco existe. Un INSERT (bulk) por
+  llamada + un UPDATE de solicitudes_version de las partes (ETag); los datos
+  del evento son los mínimos para enrutar (ids, actor).
+- Lectura: consumidores registrados con @consumidor("nombre", tipos=...).
+  procesar("nombre") toma el checkpoint (evento_consumidor) con lock, lee el
+  siguiente lote por id y llama al handler con la lista de eventos; handler y
+  avance del checkpoint van en la misma transacción (si el handler falla, el
+  lote se reintenta en la próxima pasada). Efectos externos (broker, correo)
+  deben ir en transaction.on_commit.
+- Los ids se asignan al INSERT pero se ven al COMMIT, así que un lote puede
+  traer N+1 sin N (N aún sin comitear). El checkpoint guarda esos ids salteados
+  bajo ultimo_id (ConsumidorEventos.huecos) y los vuelve a buscar en cada pasada
+  durante EVENTOS_VENTANA_HUECOS; pasado ese plazo se dan por perdidos (INSERT
+  deshecho: InnoDB no reutiliza el id).
+- `manage.py procesar_eventos` corre los consumidores (una pasada o --cada N s);
+  con settings.EVENTOS_AL_COMMIT (desarrollo) emitir() además los corre al
+  commit de la transición.
+- Consumidores incluidos: lo derivado de las transiciones que las vistas ya no
+  tocan (bandeja_chat, badges de solicitudes, versión de caché LIBROS,
+  ranking de populares) y los avisos por socket. Las vistas sólo escriben el
+  estado y lo que protege la próxima escritura (en_negociacion, reservas,
+  Conversacion.escribible) más el evento.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .constants import EVENTO_TIPO
+from .helpers_badges import subir_version_solicitudes
+from .models import ConsumidorEventos, EventoIntercambio, Intercambio, SolicitudIntercambio
+
+EVENTOS_VENTANA_HUECOS = timedelta(minutes=5)
+HUECOS_MAX = 10000  # ids salteados recordados por consumidor
+LOTE_DEFAULT = 500
+
+_CONSUMIDORES = {}  # nombre -> (handler, tipos | None)
+
+
+# =========================
+# Escritura
+# =========================
+
+def emitir(tipo: str, solicitud_ids=(), intercambio_id=None, actor=None, **datos) -> int:
+    """
+    Agrega un evento `tipo` por cada solicitud de `solicitud_ids` (o uno sin
+    solicitud si viene vacío). Llamar dentro de la transacción de la transición.
+    """
+    ids = sorted({int(s) for s in solicitud_ids or () if s}) or [None]
+    now = timezone.now()
+    EventoIntercambio.objects.bulk_create([
+        EventoIntercambio(tipo=tipo, id_solicitud=sid, id_intercambio=intercambio_id,
+                          id_actor=actor, datos=datos, creado_en=now)
+        for sid in ids
+    ])
+    # 👈 validador ETag de los listados de ambas partes (misma transacción)
+    subir_version_solicitudes(ids)
+    if getattr(settings, "EVENTOS_AL_COMMIT", False):
+        transaction.on_commit(procesar_todos, robust=True)
+    return len(ids)
+
+
+# =========================
+# Consumidores
+# =========================
+
+def consumidor(nombre: str, tipos=None):
+    """Registra `fn(eventos: list[EventoIntercambio])` como consumidor `nombre`."""
+    def deco(fn):
+        _CONSUMIDORES[nombre] = (fn, set(tipos) if tipos else None)
+        return fn
+    return deco
+
+
+def consumidores() -> list:
+    return sorted(_CONSUMIDORES)
+
+
+def _huecos(cp, ahora) -> dict:
+    """{id: epoch en que se detectó} sin los vencidos."""
+    limite = (ahora - EVENTOS_VENTANA_HUECOS).timestamp()
+    return {int(pk): t for pk, t in (cp.huecos or {}).items() if t >= limite}
+
+
+def procesar(nombre: str, lote: int = LOTE_DEFAULT) -> int:
+    """
+    Una pasada del consumidor `nombre`: los huecos que ya comitearon + el
+    siguiente lote por id. Devuelve cuántos eventos entregó al handler (o saltó por tipo).
+    """
+    fn, tipos = _CONSUMIDORES[nombre]
+    with transaction.atomic():
+        ConsumidorEventos.objects.get_or_create(nombre=nombre)
+        cp = ConsumidorEventos.objects.select_for_update().get(pk=nombre)
+        ahora = timezone.now()
+        huecos = _huecos(cp, ahora)
+
+        tardios = list(EventoIntercambio.objects
+                       .filter(pk__in=list(huecos))
+                       .order_by("pk")) if huecos else []
+        nuevos = list(EventoIntercambio.objects
+                      .filter(pk__gt=cp.ultimo_id)
+                      .order_by("pk")[:max(1, lote)])
+        for e in tardios:
+            del huecos[e.pk]
+        if nuevos:
+            # ids entre el checkpoint y el mayor leído que todavía no se ven
+            leidos = {e.pk for e in nuevos}
+            desde = max(cp.ultimo_id + 1, nuevos[-1].pk - HUECOS_MAX)
+            huecos.update((pk, ahora.timestamp()) for pk in range(desde, nuevos[-1].pk) if pk not in leidos)
+        huecos = dict(sorted(huecos.items())[-HUECOS_MAX:])
+
+        eventos = tardios + nuevos  # tardíos < ultimo_id < nuevos: ya en orden
+        if not eventos and len(huecos) == len(cp.huecos or {}):
+            return 0
+        propios = [e for e in eventos if tipos is None or e.tipo in tipos]
+        if propios:
+            fn(propios)
+        if nuevos:
+            cp.ultimo_id = nuevos[-1].pk
+        cp.huecos = {str(pk): t for pk, t in huecos.items()}
+        cp.procesados += len(propios)
+        cp.actualizado_en = ahora
+        cp.save(update_fields=["ultimo_id", "huecos", "procesados", "actualizado_en"])
+    return len(eventos)
+
+
+def procesar_todos(lote: int = LOTE_DEFAULT) -> int:
+    """Vacía todos los consumidores (desarrollo/tests; en producción, el proceso `eventos`)."""
+    total = 0
+    for nombre in consumidores():
+        while True:
+            hechos = procesar(nombre, lote)
+            total += hechos
+            if not hechos:
+                break
+    return total
+
+
+def pendientes(nombre: str) -> int:
+    cp = ConsumidorEventos.objects.filter(pk=nombre).first()
+    if cp is None:
+        return EventoIntercambio.objects.count()
+    huecos = list(_huecos(cp, timezone.now()))
+    return EventoIntercambio.objects.filter(Q(pk__gt=cp.ultimo_id) | Q(pk__in=huecos)).count()
+
+
+# =========================
+# Consumidores incluidos
+# =========================
+
+_T = EVENTO_TIPO
+# Cambian disponibilidad / en_negociacion / datos de libros visibles en listados
+TIPOS_LIBROS = {
+    _T["SOLICITUD_CREADA"], _T["SOLICITUD_ACEPTADA"], _T["SOLICITUD_RECHAZADA"], _T["SOLICITUD_CANCELADA"],
+    _T["INTERCAMBIO_CREADO"], _T["INTERCAMBIO_COMPLETADO"], _T["INTERCAMBIO_CANCELADO"],
+    _T["LIBRO_BAJA"], _T["LIBRO_CREADO"], _T["LIBRO_ACTUALIZADO"], _T["LIBRO_ELIMINADO"],
+}
+TIPOS_SOLICITUD = TIPOS_LIBROS - {_T["LIBRO_CREADO"], _T["LIBRO_ACTUALIZADO"]}
+
+
+@consumidor("cache", tipos=TIPOS_LIBROS)
+def _invalidar_cache(eventos):
+    """Una subida de versión de LIBROS por lote (al commit del checkpoint)."""
+    from .helpers_cache import LIBROS, bump_version
+
+    bump_version(LIBROS)
+
+
+@consumidor("bandeja", tipos=TIPOS_LIBROS)
+def _bandeja(eventos):
+    """
+    Filas de bandeja_chat (y badge de chat) de las conversaciones tocadas: las
+    de las solicitudes del lote; en eventos de libro, las de ese libro (si cambió
+    el título o se dio de baja) o las que trae el evento (libro ya borrado).
+    """
+    from .helpers_bandeja import conversaciones_de_libro, conversaciones_de_solicitudes, sincronizar_bandeja
+
+    convs = set(conversaciones_de_solicitudes({e.id_solicitud for e in eventos if e.id_solicitud}))
+    libros = set()
+    for e in eventos:
+        datos = e.datos or {}
+        convs.update(datos.get("conversaciones") or ())
+        if e.tipo == _T["LIBRO_BAJA"] or (e.tipo == _T["LIBRO_ACTUALIZADO"] and "titulo" in (datos.get("campos") or ())):
+            libros.add(datos.get("id_libro"))
+    for libro_id in libros - {None}:
+        convs.update(conversaciones_de_libro(libro_id))
+    sincronizar_bandeja(convs)
+
+
+@consumidor("contadores", tipos=TIPOS_SOLICITUD)
+def _contadores(eventos):
+    """Badge de solicitudes (ContadorUsuario) de los receptores tocados, recontado."""
+    from .helpers_badges import recontar_solicitudes, recontar_solicitudes_de
+
+    recontar_solicitudes_de({e.id_solicitud for e in eventos if e.id_solicitud})
+    recontar_solicitudes({(e.datos or {}).get("id_usuario") for e in eventos} - {None})
+
+
+@consumidor("populares", tipos={_T["INTERCAMBIO_COMPLETADO"], _T["LIBRO_BAJA"], _T["LIBRO_CREADO"],
+                                _T["LIBRO_ACTUALIZADO"], _T["LIBRO_ELIMINADO"]})
+def _populares(eventos):
+    """+1 por título en cada intercambio completado; repeticiones de los títulos tocados."""
+    from .helpers_populares import actualizar_repeticiones, registrar_intercambio_completado
+
+    completados = [e.id_intercambio for e in eventos
+                   if e.tipo == _T["INTERCAMBIO_COMPLETADO"] and e.id_intercambio]
+    # 👈 un título por rol (ofrecido aceptado / deseado), como el ranking completo
+    for ofrecido, deseado in (Intercambio.objects
+                              .filter(pk__in=completados)
+                              .values_list("id_libro_ofrecido_aceptado__titulo",
+                                           "id_solicitud__id_libro_deseado__titulo")):
+        registrar_intercambio_completado([ofrecido, deseado])
+    actualizar_repeticiones({t for e in eventos for t in (e.datos or {}).get("titulos") or ()})
+
+
+@consumidor("notificaciones")
+def _notificar(eventos):
+    """
+    Avisa a solicitante y receptor en su canal personal (type "solicitud") para
+    que el front re-sincronice con ?since=. Requiere un broker compartido
+    (RedisBroker) si los sockets viven en otro proceso.
+    Publica al hacer commit del checkpoint: si el lote se deshace, no avisa.
+    """
+    from .helpers_realtime import publicar_usuarios
+
+    sol_ids = {e.id_solicitud for e in eventos if e.id_solicitud}
+    partes = {pk: (a, b) for pk, a, b in (SolicitudIntercambio.objects
+                                          .filter(pk__in=sol_ids)
+                                          .values_list("id_solicitud", "id_usuario_solicitante_id",
+                                                       "id_usuario_receptor_id"))}
+    avisos = []
+    for e in eventos:
+        usuarios = [u for u in partes.get(e.id_solicitud, ()) if u != e.id_actor]
+        if usuarios:
+            avisos.append((usuarios, {
+                "evento": e.tipo, "id_evento": e.pk, "id_solicitud": e.id_solicitud,
+                "id_intercambio": e.id_intercambio,
+            }))
+
+    def _publicar():
+        # 👈 ya fuera de la transacción: publicar_usuarios publica de inmediato
+        for usuarios, data in avisos:
+            publicar_usuarios(usuarios, "solicitud", data)
+
+    if avisos:
+        transaction.on_commit(_publicar)
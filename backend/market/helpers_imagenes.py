@@ -0,0 +1,161 @@
+# market/helpers_imagenes.py
+"""
+Pipeline de imágenes (libros y avatars) con Pillow.
+
+Al subir se generan derivados de tamaño fijo en JPEG y WebP, sin EXIF
+(se aplica la orientación antes de re-codificar):
+
+    books/<uuid>_thumb.jpg / .webp   (lado mayor 200 px)
+    books/<uuid>_card.jpg  / .webp   (lado mayor 600 px)
+    books/<uuid>_full.jpg  / .webp   (lado mayor 1600 px)
+
+En BD se guarda la ruta del "_full.jpg" (url_imagen / portada / imagen_perfil);
+las demás variantes se derivan del nombre con variante(rel, "thumb").
+El archivo subido se conserva tal cual (con su EXIF) fuera de lo público:
+
+    originales/books/<uuid>.<ext>    (serve_media no sirve originales/)
+
+para poder regenerar derivados sin perder calidad.
+Imágenes antiguas (sin "_full.") se devuelven tal cual.
+Para generar derivados de lo ya subido: `manage.py rebuild_derivados`.
+"""
+import io
+import os
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from PIL import Image, ImageOps
+
+VARIANTES = {
+    "thumb": 200,
+    "card": 600,
+    "full": 1600,
+}
+FORMATOS = ("jpg", "webp")
+BASE = "full"
+
+ORIGINALES = "originales"
+# formato Pillow -> extensión del original guardado (otros formatos: ".bin")
+EXT_ORIGINAL = {"JPEG": "jpg", "MPO": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif",
+                "BMP": "bmp", "TIFF": "tif"}
+EXT_ORIGINAL_OTRO = "bin"
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def variante(rel: str | None, size: str | None, fmt: str = "jpg") -> str | None:
+    """Ruta de la variante pedida, o `rel` tal cual si no tiene derivados."""
+    if not rel or not size or size not in VARIANTES or fmt not in FORMATOS:
+        return rel
+    rel = rel.replace("\\", "/")
+    stem, ext = os.path.splitext(rel)
+    if not stem.endswith(f"_{BASE}"):
+        return rel
+    return f"{stem[:-len(BASE)]}{size}.{fmt}"
+
+
+def variantes_de(rel: str | None) -> list:
+    """Todas las rutas derivadas (incluida la base) de una imagen del pipeline."""
+    if not rel:
+        return []
+    if variante(rel, "thumb") == rel:
+        return [rel]
+    return [variante(rel, s, f) for s in VARIANTES for f in FORMATOS]
+
+
+def originales_de(rel: str | None) -> list:
+    """Rutas posibles del original conservado de una imagen del pipeline."""
+    rel = (rel or "").replace("\\", "/")
+    stem = os.path.splitext(rel)[0]
+    if not stem.endswith(f"_{BASE}"):
+        return []
+    stem = f"{ORIGINALES}/{stem[:-len(BASE) - 1]}"
+    return [f"{stem}.{ext}" for ext in sorted({*EXT_ORIGINAL.values(), EXT_ORIGINAL_OTRO})]
+
+
+def size_pedido(request, default: str | None = None) -> str | None:
+    """?img=thumb|card|full en la query; si no, `default`."""
+    try:
+        raw = (request.query_params.get("img") or "").strip().lower()
+    except Exception:
+        raw = ""
+    return raw if raw in VARIANTES else default
+
+
+def _abrir(file_obj):
+    try:
+        file_obj.seek(0)
+    except Exception:
+        pass
+    img = Image.open(file_obj)
+    img.load()
+    formato = img.format
+    img = ImageOps.exif_transpose(img)  # aplica orientación; el EXIF no se re-escribe
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    return img, formato
+
+
+def _codificar(img, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "jpg":
+        if img.mode == "RGBA":
+            fondo = Image.new("RGB", img.size, (255, 255, 255))
+            fondo.paste(img, mask=img.getchannel("A"))
+            img = fondo
+        img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        img.save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+    return buf.getvalue()
+
+
+def _guardar_original(file_obj, carpeta: str, default_name: str) -> str:
+    # Fallback (no es imagen que Pillow entienda): se guarda como antes
+    try:
+        file_obj.seek(0)
+    except Exception:
+        pass
+    original = getattr(file_obj, "name", default_name)
+    ext = os.path.splitext(original)[1].lower() or ".jpg"
+    saved_rel = default_storage.save(f"{carpeta}/{uuid.uuid4().hex}{ext}", file_obj)
+    return str(saved_rel).replace("\\", "/")
+
+
+def guardar_imagen(file_obj, carpeta: str) -> str:
+    """
+    Genera y guarda todas las variantes en MEDIA/<carpeta>/ y el archivo
+    subido en MEDIA/originales/<carpeta>/.
+    Devuelve la ruta relativa de la variante base ("_full.jpg").
+    """
+    try:
+        img, formato = _abrir(file_obj)
+    except Exception:
+        return _guardar_original(file_obj, carpeta, carpeta)
+
+    nombre = uuid.uuid4().hex
+    # 👈 el original no se descarta (solo los derivados pierden el EXIF)
+    file_obj.seek(0)
+    ext = EXT_ORIGINAL.get(formato, EXT_ORIGINAL_OTRO)
+    default_storage.save(f"{ORIGINALES}/{carpeta}/{nombre}.{ext}", file_obj)
+    base_rel = None
+    for size, lado in VARIANTES.items():
+        copia = img.copy()
+        copia.thumbnail((lado, lado), Image.LANCZOS)
+        for fmt in FORMATOS:
+            saved = default_storage.save(f"{carpeta}/{nombre}_{size}.{fmt}",
+                                         ContentFile(_codificar(copia, fmt)))
+            if size == BASE and fmt == "jpg":
+                base_rel = str(saved).replace("\\", "/")
+    return base_rel
+
+
+def borrar_imagen(rel: str | None) -> None:
+    """Borra la imagen, sus derivados y el original (silencioso si falta alguno)."""
+    for path in variantes_de(rel) + originales_de(rel):
+        try:
+            default_storage.delete(path)
+        except Exception:
+            pass
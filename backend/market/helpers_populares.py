@@ -0,0 +1,110 @@
+# market/helpers_populares.py
+"""
+Ranking de títulos populares (tabla titulo_popularidad).
+
+- completar_intercambio suma +1 por cada rol (ofrecido aceptado / deseado),
+  igual que el conteo original de `populares`.
+- repeticiones = copias disponibles con el mismo título; se refresca cuando
+  cambia la disponibilidad o el título de un libro ya presente en el ranking.
+- Reconstrucción completa: `manage.py rebuild_populares`.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .busqueda import normalizar
+from .models import Libro, Intercambio, TituloPopularidad
+
+SIN_TITULO = '(sin título)'
+
+
+def clave_titulo(titulo) -> str:
+    # sin tildes además de casefold: la PK usa la collation por defecto de MySQL
+    # (insensible a acentos), así "Canción" y "Cancion" son la misma clave en ambos lados
+    t = (titulo or '').strip()
+    return normalizar(t)[:255] if t else SIN_TITULO
+
+
+def _contar_disponibles(titulo: str) -> int:
+    # istartswith usa ix_libro_titulo (LIKE 'x%'); clave_titulo al final deja la misma regla que la clave
+    clave = clave_titulo(titulo)
+    return sum(
+        1 for t in (Libro.objects
+                    .filter(titulo__istartswith=(titulo or '').strip(), disponible=True)
+                    .values_list('titulo', flat=True))
+        if clave_titulo(t) == clave
+    )
+
+
+def actualizar_repeticiones(titulos) -> None:
+    """Refresca repeticiones solo para títulos que ya están en el ranking."""
+    claves = {clave_titulo(t) for t in titulos if t is not None}
+    if not claves:
+        return
+    for row in TituloPopularidad.objects.filter(clave__in=claves):
+        n = _contar_disponibles(row.titulo)
+        if n != row.repeticiones:
+            (TituloPopularidad.objects
+                .filter(pk=row.pk)
+                .update(repeticiones=n, actualizado_en=timezone.now()))
+
+
+def registrar_intercambio_completado(titulos) -> None:
+    """+1 por título participante (un título por rol). Llamar dentro de la transacción."""
+    for titulo in titulos:
+        clave = clave_titulo(titulo)
+        display = (titulo or '').strip() or SIN_TITULO
+        row, created = TituloPopularidad.objects.get_or_create(
+            clave=clave,
+            defaults={'titulo': display[:255], 'total_intercambios': 1},
+        )
+        if not created:
+            (TituloPopularidad.objects
+                .filter(pk=clave)
+                .update(total_intercambios=F('total_intercambios') + 1,
+                        actualizado_en=timezone.now()))
+    actualizar_repeticiones(titulos)
+
+
+def top_populares(k: int = 10):
+    return list(
+        TituloPopularidad.objects
+        .filter(total_intercambios__gt=0)
+        .order_by('-total_intercambios', 'titulo')
+        .values('titulo', 'total_intercambios', 'repeticiones')[:k]
+    )
+
+
+def reconstruir_populares() -> int:
+    """Recalcula la tabla completa desde intercambios completados. Devuelve nº de títulos."""
+    # conserva el título visible ya publicado para no "saltar" entre variantes
+    acc, display = {}, dict(TituloPopularidad.objects.values_list('clave', 'titulo'))
+    for campo in ('id_libro_ofrecido_aceptado__titulo', 'id_solicitud__id_libro_deseado__titulo'):
+        for row in (Intercambio.objects
+                    .filter(estado_intercambio='Completado')
+                    .values(title=F(campo))
+                    .annotate(n=Count('id_intercambio'))):
+            k = clave_titulo(row['title'])
+            acc[k] = acc.get(k, 0) + int(row['n'] or 0)
+            display.setdefault(k, (row['title'] or '').strip() or SIN_TITULO)
+
+    disponibles = {}
+    for row in (Libro.objects
+                .filter(disponible=True)
+                .values('titulo')
+                .annotate(n=Count('id_libro'))):
+        k = clave_titulo(row['titulo'])
+        if k in acc:
+            disponibles[k] = disponibles.get(k, 0) + int(row['n'] or 0)
+
+    now = timezone.now()
+    with transaction.atomic():
+        TituloPopularidad.objects.all().delete()
+        TituloPopularidad.objects.bulk_create([
+            TituloPopularidad(
+                clave=k, titulo=display[k][:255], total_intercambios=n,
+                repeticiones=disponibles.get(k, 0), actualizado_en=now,
+            )
+            for k, n in acc.items()
+        ], batch_size=1000)
+    return len(acc)
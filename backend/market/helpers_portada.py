@@ -0,0 +1,37 @@
+# helpers_portada.py
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import Libro, ImagenLibro
+
+# Portada explícita (is_portada) o, si no hay, la primera por orden
+portada_sq = (ImagenLibro.objects
+    .filter(id_libro=OuterRef('pk'), is_portada=True)
+    .order_by('id_imagen')
+    .values_list('url_imagen', flat=True)[:1])
+
+first_by_order_sq = (ImagenLibro.objects
+    .filter(id_libro=OuterRef('pk'))
+    .order_by('orden', 'id_imagen')
+    .values_list('url_imagen', flat=True)[:1])
+
+
+def recalcular_portada(libro_ids) -> int:
+    """
+    Resuelve y guarda libro.portada (ruta relativa en MEDIA) para los libros
+    indicados. Se llama tras subir/editar/borrar imágenes; los listados leen
+    la columna sin consultas extra. Devuelve cuántas filas cambiaron.
+    """
+    ids = {int(x) for x in libro_ids if x}
+    if not ids:
+        return 0
+
+    changed = 0
+    rows = (Libro.objects
+            .filter(pk__in=ids)
+            .annotate(_resuelta=Coalesce(Subquery(portada_sq), Subquery(first_by_order_sq)))
+            .values_list("pk", "portada", "_resuelta"))
+    for pk, actual, resuelta in rows:
+        resuelta = (resuelta or "").replace("\\", "/") or None
+        if actual != resuelta:
+            changed += Libro.objects.filter(pk=pk).update(portada=resuelta)
+    return changed
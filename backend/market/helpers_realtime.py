@@ -0,0 +1,203 @@
+# market/helpers_realtime.py
+"""
+Broker pub/sub para el chat en tiempo real (WebSocket en market/ws_chat.py,
+long-poll en market/views_longpoll.py).
+
+- Canal por conversación: "chat:<id_conversacion>".
+- Canal por usuario: "chat:u:<id_usuario>" (long-poll de la lista de chats).
+- Las vistas (sync) publican con publicar_chat(); los sockets y long-polls
+  (async) se suscriben con broker.suscribir(canal) / esperar_evento(). Un
+  suscriptor ocioso sólo espera en su cola: cero consultas a la BD.
+- Backend en settings.CHAT_BROKER (ruta con puntos):
+    * InMemoryBroker (por defecto): un solo proceso ASGI (dev / 1 worker).
+    * RedisBroker: varios procesos/réplicas; CHAT_BROKER_URL="redis://...".
+      Requiere el paquete `redis` (opcional, no está en requirements).
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+COLA_MAX = 200  # eventos pendientes por socket; si se llena se descarta el más viejo
+
+
+def canal_chat(conversacion_id: int) -> str:
+    return f"chat:{int(conversacion_id)}"
+
+
+def canal_usuario(user_id: int) -> str:
+    # mismo prefijo "chat:" para que RedisBroker lo reciba con un solo PSUBSCRIBE
+    return f"chat:u:{int(user_id)}"
+
+
+def _entregar(cola: asyncio.Queue, mensaje: str) -> None:
+    # corre dentro del loop del suscriptor
+    if cola.full():
+        try:
+            cola.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    cola.put_nowait(mensaje)
+
+
+class InMemoryBroker:
+    """Fan-out en memoria; publish() es thread-safe (las vistas corren en hilos)."""
+
+    def __init__(self):
+        self._subs = {}  # canal -> {cola: loop}
+        self._lock = threading.Lock()
+
+    def suscribir(self, canal: str) -> asyncio.Queue:
+        cola = asyncio.Queue(maxsize=COLA_MAX)
+        with self._lock:
+            self._subs.setdefault(canal, {})[cola] = asyncio.get_running_loop()
+        return cola
+
+    def desuscribir(self, canal: str, cola: asyncio.Queue) -> None:
+        with self._lock:
+            subs = self._subs.get(canal)
+            if subs is not None:
+                subs.pop(cola, None)
+                if not subs:
+                    self._subs.pop(canal, None)
+
+    def publicar_local(self, canal: str, mensaje: str) -> int:
+        with self._lock:
+            destinos = list((self._subs.get(canal) or {}).items())
+        for cola, loop in destinos:
+            try:
+                loop.call_soon_threadsafe(_entregar, cola, mensaje)
+            except RuntimeError:
+                # loop cerrado (socket muerto sin desuscribir)
+                self.desuscribir(canal, cola)
+        return len(destinos)
+
+    def publicar(self, canal: str, mensaje: str) -> int:
+        return self.publicar_local(canal, mensaje)
+
+    def suscriptores(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subs.values())
+
+
+class RedisBroker(InMemoryBroker):
+    """
+    Backend compartido: publish va a Redis y un listener por proceso
+    (PSUBSCRIBE chat:*) reparte localmente con InMemoryBroker.
+    """
+
+    PATRON = "chat:*"
+
+    def __init__(self):
+        super().__init__()
+        try:
+            import redis  # noqa: F401
+        except ImportError:
+            raise ImproperlyConfigured("RedisBroker requiere el paquete 'redis'.")
+        self._url = getattr(settings, "CHAT_BROKER_URL", None) or "redis://localhost:6379/0"
+        self._sync = None
+        self._listener = None
+
+    def publicar(self, canal: str, mensaje: str) -> int:
+        import redis
+        if self._sync is None:
+            self._sync = redis.Redis.from_url(self._url)
+        return int(self._sync.publish(canal, mensaje) or 0)
+
+    def suscribir(self, canal: str) -> asyncio.Queue:
+        cola = super().suscribir(canal)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._escuchar())
+        return cola
+
+    async def _escuchar(self):
+        import redis.asyncio as aioredis
+        cliente = aioredis.Redis.from_url(self._url)
+        pubsub = cliente.pubsub()
+        await pubsub.psubscribe(self.PATRON)
+        try:
+            async for msg in pubsub.listen():
+                if msg.get("type") != "pmessage":
+                    continue
+                canal = msg["channel"].decode() if isinstance(msg["channel"], bytes) else msg["channel"]
+                data = msg["data"].decode() if isinstance(msg["data"], bytes) else msg["data"]
+                self.publicar_local(canal, data)
+        finally:
+            await pubsub.aclose()
+            await cliente.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                ruta = getattr(settings, "CHAT_BROKER", None) or "market.helpers_realtime.InMemoryBroker"
+                _broker = import_string(ruta)()
+    return _broker
+
+
+def _publicar(canales, mensaje: str) -> None:
+    def _do():
+        broker = get_broker()
+        for canal in canales:
+            try:
+                broker.publicar(canal, mensaje)
+            except Exception:
+                # tiempo real es "best effort": el cliente siempre puede re-sincronizar con ?after=
+                pass
+    transaction.on_commit(_do)
+
+
+def publicar_chat(conversacion_id: int, tipo: str, data: dict, usuarios=()) -> None:
+    """
+    Publica un evento a los sockets / long-polls de la conversación al hacer commit.
+    `usuarios`: participantes a avisar también en su canal personal (lista de chats).
+    """
+    mensaje = json.dumps({"type": tipo, "id_conversacion": int(conversacion_id), **data},
+                         cls=DjangoJSONEncoder)
+    canales = [canal_chat(conversacion_id)] + [canal_usuario(u) for u in usuarios if u]
+    _publicar(canales, mensaje)
+
+
+def publicar_usuarios(usuarios, tipo: str, data: dict) -> None:
+    """Evento al canal personal de cada usuario (al hacer commit)."""
+    mensaje = json.dumps({"type": tipo, **data}, cls=DjangoJSONEncoder)
+    _publicar([canal_usuario(u) for u in usuarios if u], mensaje)
+
+
+async def esperar_evento(canal: str, timeout: float, tipos=None, listo=None):
+    """
+    Espera (sin consultar la BD) hasta `timeout` s a un evento de `canal`.
+    Se suscribe ANTES de llamar a `listo()` (async, opcional) para no perder
+    eventos entre la comprobación y la espera: si `listo()` ya es verdadero,
+    retorna de inmediato. Devuelve el evento (dict) o None si venció el plazo.
+    """
+    broker = get_broker()
+    cola = broker.suscribir(canal)
+    try:
+        if listo is not None and await listo():
+            return {"type": "listo"}
+        loop = asyncio.get_running_loop()
+        fin = loop.time() + timeout
+        while True:
+            restante = fin - loop.time()
+            if restante <= 0:
+                return None
+            try:
+                evento = json.loads(await asyncio.wait_for(cola.get(), restante))
+            except asyncio.TimeoutError:
+                return None
+            if tipos is None or evento.get("type") in tipos:
+                return evento
+    finally:
+        broker.desuscribir(canal, cola)
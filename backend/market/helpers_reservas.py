@@ -0,0 +1,141 @@
+# market/helpers_reservas.py
+"""
+Ledger de reservas de libros (tabla reserva_libro).
+
+Una fila por cada compromiso vigente de un libro:
+- OFERTA       ofrecido en una solicitud Pendiente          (clave=0, exclusiva)
+- SOLICITUD    deseado en una solicitud Pendiente            (clave=id del solicitante)
+- INTERCAMBIO  deseado u ofrecido en un intercambio activo   (clave=0, exclusiva)
+
+UNIQUE(id_libro, rol, clave): crear/aceptar deciden los conflictos con UNA
+lectura (reservas_de) y toman la reserva con un INSERT que falla si otro
+request se adelantó (reservar) -> sin ventanas entre chequeos.
+
+Mantenimiento: cada transición escribe sus filas dentro de su transacción:
+crear -> reservar(OFERTA/SOLICITUD); aceptar -> liberar(OFERTA/SOLICITUD de la
+solicitud) + reservar(INTERCAMBIO); rechazar / cancelar / completar / bajas
+-> liberar(solicitudes). sincronizar_reservas(libro_ids) recalcula desde las
+tablas fuente y sólo lo usa `reconcile_negociacion` (backfill / deriva).
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .constants import INTERCAMBIO_ESTADO, RESERVA_ROL, SOLICITUD_ESTADO
+from .models import Intercambio, ReservaLibro, SolicitudIntercambio, SolicitudOferta
+
+OFERTA = RESERVA_ROL["OFERTA"]
+SOLICITUD = RESERVA_ROL["SOLICITUD"]
+INTERCAMBIO = RESERVA_ROL["INTERCAMBIO"]
+
+
+def _ids(libro_ids) -> set:
+    return {int(x) for x in libro_ids or [] if x}
+
+
+# =========================
+# Lectura / toma (caminos calientes)
+# =========================
+
+def reservas_de(libro_ids) -> dict:
+    """{id_libro: [(rol, clave, id_solicitud), ...]} en una sola consulta."""
+    out = {}
+    for libro, rol, clave, sol in (ReservaLibro.objects
+                                   .filter(id_libro_id__in=_ids(libro_ids))
+                                   .values_list("id_libro_id", "rol", "clave", "id_solicitud")):
+        out.setdefault(libro, []).append((rol, clave, sol))
+    return out
+
+
+def tiene(reservas: dict, libro_id: int, rol: str, clave=None, excepto_solicitud=None) -> bool:
+    return any(
+        r == rol and (clave is None or c == clave) and (excepto_solicitud is None or s != excepto_solicitud)
+        for r, c, s in reservas.get(libro_id, [])
+    )
+
+
+def reservar(filas) -> bool:
+    """
+    filas: [(id_libro, rol, clave, id_solicitud)]. INSERT en un savepoint;
+    False si alguna choca con UNIQUE (otra transacción la tomó primero).
+    """
+    if not filas:
+        return True
+    try:
+        with transaction.atomic():
+            ReservaLibro.objects.bulk_create([
+                ReservaLibro(id_libro_id=libro, rol=rol, clave=clave, id_solicitud=sol)
+                for libro, rol, clave, sol in filas
+            ])
+    except IntegrityError:
+        return False
+    return True
+
+
+def liberar(solicitud_ids, roles=None) -> int:
+    """Borra las reservas de esas solicitudes (ix_reserva_solicitud); roles=None: todas."""
+    ids = [int(x) for x in solicitud_ids or [] if x]
+    if not ids:
+        return 0
+    qs = ReservaLibro.objects.filter(id_solicitud__in=ids)
+    if roles:
+        qs = qs.filter(rol__in=list(roles))
+    return qs.delete()[0]
+
+
+# =========================
+# Recalcular desde las tablas fuente
+# =========================
+
+def _esperadas(ids: set) -> dict:
+    """{(id_libro, rol, clave): id_solicitud} vigentes para esos libros."""
+    out = {}
+    for libro, sol in (SolicitudOferta.objects
+                       .filter(id_libro_ofrecido_id__in=ids,
+                               id_solicitud__estado__iexact=SOLICITUD_ESTADO["PENDIENTE"])
+                       .order_by("id_solicitud_id")
+                       .values_list("id_libro_ofrecido_id", "id_solicitud_id")):
+        out.setdefault((libro, OFERTA, 0), sol)
+
+    for libro, solicitante, sol in (SolicitudIntercambio.objects
+                                    .filter(id_libro_deseado_id__in=ids,
+                                            estado__iexact=SOLICITUD_ESTADO["PENDIENTE"])
+                                    .order_by("id_solicitud")
+                                    .values_list("id_libro_deseado_id", "id_usuario_solicitante_id", "id_solicitud")):
+        out.setdefault((libro, SOLICITUD, solicitante), sol)
+
+    for deseado, ofrecido, sol in (Intercambio.objects
+                                   .filter(Q(id_solicitud__id_libro_deseado_id__in=ids) |
+                                           Q(id_libro_ofrecido_aceptado_id__in=ids))
+                                   .filter(Q(estado_intercambio__iexact=INTERCAMBIO_ESTADO["PENDIENTE"]) |
+                                           Q(estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"]))
+                                   .order_by("id_solicitud_id")
+                                   .values_list("id_solicitud__id_libro_deseado_id",
+                                                "id_libro_ofrecido_aceptado_id", "id_solicitud_id")):
+        for libro in (deseado, ofrecido):
+            if libro in ids:
+                out.setdefault((libro, INTERCAMBIO, 0), sol)
+    return out
+
+
+def sincronizar_reservas(libro_ids) -> int:
+    """Deja el ledger de esos libros igual a las tablas fuente. Devuelve filas cambiadas."""
+    ids = _ids(libro_ids)
+    if not ids:
+        return 0
+    esperadas = _esperadas(ids)
+    actuales = {(libro, rol, clave): (pk, sol) for pk, libro, rol, clave, sol in (
+        ReservaLibro.objects
+        .filter(id_libro_id__in=ids)
+        .values_list("pk", "id_libro_id", "rol", "clave", "id_solicitud"))}
+
+    sobran = [pk for key, (pk, sol) in actuales.items() if esperadas.get(key) != sol]
+    if sobran:
+        ReservaLibro.objects.filter(pk__in=sobran).delete()
+    faltan = [key + (sol,) for key, sol in esperadas.items()
+              if key not in actuales or actuales[key][1] != sol]
+    if faltan:
+        ReservaLibro.objects.bulk_create([
+            ReservaLibro(id_libro_id=libro, rol=rol, clave=clave, id_solicitud=sol)
+            for libro, rol, clave, sol in faltan
+        ], ignore_conflicts=True)
+    return len(sobran) + len(faltan)
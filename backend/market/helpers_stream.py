@@ -0,0 +1,40 @@
+# market/helpers_stream.py
+"""
+Respuestas en streaming que sirven igual bajo WSGI y ASGI.
+
+Bajo ASGI, Django lee un iterador SÍNCRONO de StreamingHttpResponse con
+sync_to_async(list): junta todo en memoria antes de enviar. Bajo WSGI, un
+iterador ASÍNCRONO se consume igual entero. Por eso las vistas arman el
+generador síncrono de siempre y, si la petición llegó por ASGI, lo envuelven
+con como_async(): un salto de hilo por trozo (conviene trozos grandes).
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+_FIN = object()
+
+
+def es_asgi(request) -> bool:
+    """True si la petición (HttpRequest o rest_framework Request) llegó por ASGI."""
+    return isinstance(getattr(request, "_request", request), ASGIRequest)
+
+
+async def como_async(iterable):
+    """Itera `iterable` (síncrono, puede tocar la BD) desde el event loop, trozo a trozo."""
+    it = iter(iterable)
+    siguiente = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            parte = await siguiente(it, _FIN)
+            if parte is _FIN:
+                return
+            yield parte
+    finally:
+        cerrar = getattr(it, "close", None)
+        if cerrar is not None:
+            await sync_to_async(cerrar, thread_sensitive=True)()
+
+
+def contenido(request, iterable):
+    """Iterador para StreamingHttpResponse según el servidor que atiende `request`."""
+    return como_async(iterable) if es_asgi(request) else iterable
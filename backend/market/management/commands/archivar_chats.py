@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from market.helpers_archivo import archivar, candidatas, dias_default
+
+
+class Command(BaseCommand):
+    help = ("Archiva conversaciones de intercambios Completado/Cancelado sin actividad en N días: "
+            "mueve sus mensajes a conversacion_mensaje_archivo y marca a los participantes archivado. "
+            "Programar a diario (cron / scheduler de la plataforma), o como proceso con --cada, p.ej. "
+            "en el Procfile: `archivo: python manage.py archivar_chats --cada 1440`.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dias", type=int, default=None,
+                            help="inactividad mínima (default settings.CHAT_ARCHIVO_DIAS)")
+        parser.add_argument("--limite", type=int, default=None, help="máximo de conversaciones por pasada")
+        parser.add_argument("--cada", type=int, default=0, help="repetir cada N minutos (0 = una pasada)")
+        parser.add_argument("--dry-run", action="store_true", help="sólo lista las candidatas")
+
+    def handle(self, *args, **opts):
+        dias = dias_default() if opts["dias"] is None else max(0, opts["dias"])
+        if opts["dry_run"]:
+            ids = candidatas(dias, opts["limite"])
+            self.stdout.write(f"Candidatas (>{dias} días): {len(ids)} {ids[:50]}")
+            return
+        while True:
+            convs, mensajes = archivar(dias, opts["limite"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Archivadas conversaciones={convs} mensajes={mensajes} (>{dias} días)"))
+            if not opts["cada"]:
+                return
+            close_old_connections()
+            time.sleep(opts["cada"] * 60)
@@ -0,0 +1,170 @@
+import asyncio
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from asgiref.testing import ApplicationCommunicator
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.utils import timezone
+
+from core.models import Usuario
+from market.models import Genero, Libro
+
+MODOS = {"buffer": None, "stream": "1", "ndjson": "ndjson"}
+SERVIDORES = ("wsgi", "asgi")
+SIEMBRA_LOTE = 1000
+RUTA = "/api/libros/catalogo/"
+
+
+def _proc_status(campo: str):
+    """VmRSS / VmHWM en kB desde /proc (Linux); None si no existe."""
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith(campo + ":"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_pico() -> bool:
+    """Reinicia VmHWM (pico de RSS) del proceso; False si el kernel no lo permite."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _pico_kb() -> int:
+    return _proc_status("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _sembrar(n: int, usuario_id: int, genero_id: int, marca: str) -> None:
+    now = timezone.now()
+    for i in range(0, n, SIEMBRA_LOTE):
+        Libro.objects.bulk_create([
+            Libro(titulo=f"bench catálogo #{k}", isbn=marca, anio_publicacion=2000,
+                  autor="Bench", estado="Usado", descripcion="x" * 200, editorial="Bench",
+                  tipo_tapa="Blanda", disponible=True, en_negociacion=False, fecha_subida=now,
+                  id_usuario_id=usuario_id, id_genero_id=genero_id)
+            for k in range(i, min(n, i + SIEMBRA_LOTE))
+        ])
+
+
+def _por_wsgi(params: dict) -> int:
+    """Consume la respuesta como gunicorn sync: WSGIHandler + iterar el cuerpo."""
+    environ = RequestFactory().get(RUTA, params).environ
+    total = 0
+    body = WSGIHandler()(environ, lambda status, headers, exc_info=None: None)
+    try:
+        for chunk in body:
+            total += len(chunk)
+    finally:
+        body.close()
+    return total
+
+
+async def _por_asgi(params: dict) -> int:
+    """Consume la respuesta como uvicorn: ASGIHandler, mensaje http.response.body a mensaje."""
+    qs = "&".join(f"{k}={v}" for k, v in params.items()).encode()
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": RUTA, "raw_path": RUTA.encode(), "query_string": qs,
+             "headers": [(b"host", b"localhost")], "server": ("localhost", 80), "client": ("127.0.0.1", 1)}
+    com = ApplicationCommunicator(ASGIHandler(), scope)
+    await com.send_input({"type": "http.request", "body": b""})
+    await com.receive_output(600)  # http.response.start
+    total = 0
+    while True:
+        msg = await com.receive_output(600)
+        total += len(msg.get("body", b""))
+        if not msg.get("more_body"):
+            break
+    await com.wait(5)
+    return total
+
+
+class Command(BaseCommand):
+    help = ("Benchmark de memoria de GET /api/libros/catalogo/: pico de RSS de la respuesta "
+            "completa (LibroSerializer many=True) vs. ?stream=1 / ?stream=ndjson a medida que crece "
+            "el catálogo, servida por el handler WSGI (gunicorn) y/o ASGI (uvicorn). Cada medición "
+            "corre en un subproceso que siembra N libros sintéticos, consume la respuesta por el "
+            "handler real y los borra al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tamanos", default="1000,5000,20000",
+                            help="libros sintéticos a sumar al catálogo, separados por coma")
+        parser.add_argument("--modo", choices=list(MODOS) + ["todos"], default="todos")
+        parser.add_argument("--servidor", choices=list(SERVIDORES) + ["ambos"], default="ambos")
+        parser.add_argument("--usuario", type=int, default=None, help="dueño de los libros sintéticos")
+        # interno: una medición en este proceso (la usa el proceso padre)
+        parser.add_argument("--medir", nargs=3, metavar=("SERVIDOR", "MODO", "N"), help="(interno)")
+
+    def handle(self, *args, **opts):
+        usuario_id = opts["usuario"] or Usuario.objects.order_by("pk").values_list("pk", flat=True).first()
+        genero_id = Genero.objects.order_by("pk").values_list("pk", flat=True).first()
+        if not usuario_id or not genero_id:
+            raise CommandError("Se necesita al menos un usuario y un género.")
+
+        if opts["medir"]:
+            servidor, modo, n = opts["medir"][0], opts["medir"][1], int(opts["medir"][2])
+            self.stdout.write(json.dumps(self._medir(servidor, modo, n, usuario_id, genero_id)))
+            return
+
+        try:
+            tamanos = [int(x) for x in opts["tamanos"].split(",") if x.strip()]
+        except ValueError:
+            raise CommandError("--tamanos inválido.")
+        modos = list(MODOS) if opts["modo"] == "todos" else [opts["modo"]]
+        servidores = list(SERVIDORES) if opts["servidor"] == "ambos" else [opts["servidor"]]
+        base = Libro.objects.filter(disponible=True, en_negociacion=False).count()
+
+        self.stdout.write(f"{'libros':>8} {'servidor':<8} {'modo':<7} {'pico RSS':>10} {'Δ RSS':>10} "
+                          f"{'bytes':>12} {'tiempo':>8}")
+        for n in tamanos:
+            for servidor in servidores:
+                for modo in modos:
+                    r = self._subproceso(servidor, modo, n, usuario_id)
+                    self.stdout.write(
+                        f"{base + n:>8} {servidor:<8} {modo:<7} {r['pico_kb'] / 1024:>8.1f}MB "
+                        f"{r['delta_kb'] / 1024:>8.1f}MB {r['bytes']:>12} {r['seg']:>7.2f}s"
+                        + ("" if r["pico_reiniciado"] else "  (pico incluye la siembra)"))
+
+    def _subproceso(self, servidor, modo, n, usuario_id) -> dict:
+        cmd = [sys.executable, sys.argv[0], "bench_catalogo", "--medir", servidor, modo, str(n),
+               "--usuario", str(usuario_id)]
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            raise CommandError(f"Falló la medición {servidor}/{modo}/{n}:\n{out.stderr[-2000:]}")
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+    def _medir(self, servidor, modo, n, usuario_id, genero_id) -> dict:
+        if modo not in MODOS or servidor not in SERVIDORES:
+            raise CommandError(f"medición inválida: {servidor}/{modo}")
+        params = {"stream": MODOS[modo]} if MODOS[modo] else {}
+        # Los handlers abren/cierran su conexión por request: la siembra se comitea
+        # (isbn = marca de esta corrida) y se borra al final.
+        marca = f"B{os.getpid():012d}"[:13]
+        try:
+            _sembrar(n, usuario_id, genero_id, marca)
+            gc.collect()
+            reiniciado = _reset_pico()
+            rss0 = _proc_status("VmRSS") or _pico_kb()
+
+            t0 = time.monotonic()
+            total = _por_wsgi(params) if servidor == "wsgi" else asyncio.run(_por_asgi(params))
+            seg = time.monotonic() - t0
+            pico = _pico_kb()
+        finally:
+            Libro.objects.filter(isbn=marca, autor="Bench").delete()
+        return {"pico_kb": pico, "delta_kb": max(0, pico - rss0), "bytes": total,
+                "seg": seg, "pico_reiniciado": reiniciado}
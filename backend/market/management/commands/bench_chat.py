@@ -0,0 +1,124 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from market.helpers_bandeja import bandeja_mensaje, sincronizar_bandeja
+from market.helpers_chat import ESTADOS_ESCRIBIBLES, insertar_mensaje
+from market.models import Conversacion, ConversacionMensaje, ConversacionParticipante, SolicitudIntercambio
+
+
+def _antes(conv_id, solicitud_id, emisor_id, cuerpo):
+    """Camino previo de enviar_mensaje: select_for_update de la solicitud + INSERT + UPDATE."""
+    with transaction.atomic():
+        ok = (SolicitudIntercambio.objects
+              .select_for_update()
+              .filter(pk=solicitud_id, estado__in=ESTADOS_ESCRIBIBLES)
+              .exists())
+    if not ok:
+        return None
+    with transaction.atomic():
+        now = timezone.now()
+        m = ConversacionMensaje.objects.create(
+            id_conversacion_id=conv_id, id_usuario_emisor_id=emisor_id, cuerpo=cuerpo, enviado_en=now)
+        Conversacion.objects.filter(pk=conv_id).update(actualizado_en=now, ultimo_id_mensaje=m.id_mensaje)
+        bandeja_mensaje(conv_id, m, now)
+    return m
+
+
+def _ahora(conv_id, solicitud_id, emisor_id, cuerpo):
+    """Camino actual: INSERT + UPDATE condicional sobre conversacion.escribible."""
+    with transaction.atomic():
+        now = timezone.now()
+        m = insertar_mensaje(conv_id, emisor_id, cuerpo, now)
+        if m is not None:
+            bandeja_mensaje(conv_id, m, now)
+    return m
+
+
+MODOS = {"antes": _antes, "ahora": _ahora}
+
+
+class Command(BaseCommand):
+    help = ("Benchmark de envío de mensajes concurrente (mensajes/s): camino con "
+            "select_for_update de la solicitud vs. caché conversacion.escribible. "
+            "Usar contra MySQL; en SQLite las escrituras se serializan igual.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversacion", type=int, required=True)
+        parser.add_argument("--hilos", type=int, default=8)
+        parser.add_argument("--mensajes", type=int, default=400, help="mensajes por modo")
+        parser.add_argument("--modo", choices=["antes", "ahora", "ambos"], default="ambos")
+        parser.add_argument("--conservar", action="store_true", help="no borra los mensajes de prueba")
+
+    def handle(self, *args, **opts):
+        conv_id = opts["conversacion"]
+        conv = (Conversacion.objects
+                .filter(pk=conv_id)
+                .values("escribible", "ultimo_id_mensaje", "actualizado_en", "id_intercambio__id_solicitud_id")
+                .first())
+        if not conv:
+            raise CommandError("Conversación no existe.")
+        if not conv["escribible"]:
+            raise CommandError("La conversación no es escribible (¿rebuild_bandeja?).")
+        emisores = list(ConversacionParticipante.objects
+                        .filter(id_conversacion_id=conv_id)
+                        .values_list("id_usuario_id", flat=True))
+        if not emisores:
+            raise CommandError("La conversación no tiene participantes.")
+        if connection.vendor == "sqlite":
+            self.stdout.write(self.style.WARNING("SQLite: resultados sólo orientativos."))
+
+        hilos, total = max(1, opts["hilos"]), max(1, opts["mensajes"])
+        modos = ["antes", "ahora"] if opts["modo"] == "ambos" else [opts["modo"]]
+        creados, tasas = [], {}
+        try:
+            for modo in modos:
+                ids, errores, seg = self._correr(MODOS[modo], conv_id, conv["id_intercambio__id_solicitud_id"],
+                                                 emisores, hilos, total)
+                creados += ids
+                tasas[modo] = len(ids) / seg if seg else 0.0
+                self.stdout.write(f"{modo:<6} hilos={hilos} mensajes={len(ids)} errores={errores} "
+                                  f"tiempo={seg:.3f}s -> {tasas[modo]:.1f} msg/s")
+        finally:
+            if creados and not opts["conservar"]:
+                self._limpiar(conv_id, conv, creados)
+
+        if len(tasas) == 2 and tasas["antes"]:
+            self.stdout.write(self.style.SUCCESS(f"Mejora: x{tasas['ahora'] / tasas['antes']:.2f}"))
+
+    def _correr(self, fn, conv_id, solicitud_id, emisores, hilos, total):
+        def trabajador(k):
+            ids, errores = [], 0
+            try:
+                for i in range(k, total, hilos):
+                    try:
+                        m = fn(conv_id, solicitud_id, emisores[i % len(emisores)], f"bench #{i}")
+                    except Exception:
+                        errores += 1
+                        continue
+                    if m is None:
+                        errores += 1
+                    else:
+                        ids.append(m.id_mensaje)
+            finally:
+                # cada hilo abre su propia conexión
+                close_old_connections()
+                connection.close()
+            return ids, errores
+
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            res = list(pool.map(trabajador, range(hilos)))
+        seg = time.monotonic() - t0
+        return [i for ids, _ in res for i in ids], sum(e for _, e in res), seg
+
+    def _limpiar(self, conv_id, conv, ids):
+        with transaction.atomic():
+            ConversacionMensaje.objects.filter(pk__in=ids).delete()
+            Conversacion.objects.filter(pk=conv_id).update(
+                ultimo_id_mensaje=conv["ultimo_id_mensaje"], actualizado_en=conv["actualizado_en"])
+            sincronizar_bandeja([conv_id])
+        self.stdout.write(f"Borrados {len(ids)} mensajes de prueba.")
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import Usuario
+from market.helpers_realtime import canal_chat, get_broker
+from market.models import ConversacionParticipante
+from market.ws_chat import chat_websocket
+
+
+class Command(BaseCommand):
+    help = ("Prueba de carga del chat WebSocket en proceso: abre N sockets a una conversación, "
+            "los deja ociosos y publica un evento, contando consultas SQL por fase.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversacion", type=int, required=True)
+        parser.add_argument("--usuario", type=int, required=True, help="participante de la conversación")
+        parser.add_argument("--conexiones", type=int, default=100)
+        parser.add_argument("--segundos", type=float, default=5.0, help="tiempo ocioso")
+
+    def handle(self, *args, **opts):
+        conv_id, uid = opts["conversacion"], opts["usuario"]
+        if not ConversacionParticipante.objects.filter(id_conversacion_id=conv_id, id_usuario_id=uid).exists():
+            raise CommandError("El usuario no participa en la conversación.")
+        user = Usuario.objects.get(pk=uid)
+        token = AccessToken.for_user(user)
+        token["tv"] = getattr(user, "token_version", 0)
+
+        consultas = {"n": 0}
+
+        def contar(execute, sql, params, many, context):
+            consultas["n"] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            res = async_to_sync(self._carga)(conv_id, str(token), opts["conexiones"], opts["segundos"], consultas)
+
+        for fase, (n_sql, seg) in res.items():
+            self.stdout.write(f"{fase:<10} consultas={n_sql:<6} tiempo={seg:.3f}s")
+        ok = res["ocioso"][0] == 0 and res["fan-out"][0] == 0
+        msg = "Sockets ociosos sin consultas a la BD" if ok else "Hubo consultas fuera de la conexión"
+        self.stdout.write((self.style.SUCCESS if ok else self.style.ERROR)(msg))
+
+    async def _carga(self, conv_id, token, n, segundos, consultas):
+        res = {}
+        scope = {
+            "type": "websocket", "path": f"/ws/chat/{conv_id}/",
+            "query_string": f"token={token}".encode(), "headers": [],
+        }
+
+        # 1) conexión
+        base, t0 = consultas["n"], time.monotonic()
+        socks = []
+        for _ in range(n):
+            c = ApplicationCommunicator(chat_websocket, dict(scope))
+            await c.send_input({"type": "websocket.connect"})
+            out = await c.receive_output(5)
+            if out["type"] != "websocket.accept":
+                raise CommandError(f"Conexión rechazada: {out}")
+            await c.receive_output(5)  # "hola"
+            socks.append(c)
+        res["conexion"] = (consultas["n"] - base, time.monotonic() - t0)
+
+        # 2) ocioso
+        base, t0 = consultas["n"], time.monotonic()
+        await asyncio.sleep(segundos)
+        res["ocioso"] = (consultas["n"] - base, time.monotonic() - t0)
+
+        # 3) fan-out de un evento a todos
+        base, t0 = consultas["n"], time.monotonic()
+        get_broker().publicar(canal_chat(conv_id), json.dumps({"type": "carga", "id_conversacion": conv_id}))
+        for c in socks:
+            out = await c.receive_output(5)
+            if json.loads(out["text"]).get("type") != "carga":
+                raise CommandError(f"Evento inesperado: {out}")
+        res["fan-out"] = (consultas["n"] - base, time.monotonic() - t0)
+
+        for c in socks:
+            await c.send_input({"type": "websocket.disconnect", "code": 1000})
+            await c.wait(5)
+        return res
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from market.models import PuntoEncuentro  # ajusta el import al app correcto
+from market.helpers_cache import bump_version, PUNTOS
 import csv, os
 
 HEADERS = {
@@ -52,6 +53,8 @@ class Command(BaseCommand):
                     tot += 1
                     if created: crt += 1
                     else: upd += 1
+        if tot:
+            bump_version(PUNTOS)
         self.stdout.write(self.style.SUCCESS(
             f"Procesados={tot}  creados={crt}  actualizados={upd}  omitidos={sk}"
         ))
\ No newline at end of file
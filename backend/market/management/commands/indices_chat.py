@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+TABLA = "conversacion_mensaje"
+INDICE = "ix_cmsg_conv_mensaje"
+COLUMNAS = ["id_conversacion", "id_mensaje"]
+
+# consulta de la página "before_id" (la más exigente: ORDER BY DESC + LIMIT)
+CONSULTA = (f"SELECT id_mensaje FROM {TABLA} "
+            f"WHERE id_conversacion = %s AND id_mensaje < %s ORDER BY id_mensaje DESC LIMIT 51")
+
+
+class Command(BaseCommand):
+    help = ("Crea (si falta) y verifica el índice (id_conversacion, id_mensaje) de "
+            "conversacion_mensaje, usado por la paginación keyset del chat.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--solo-verificar", action="store_true",
+                            help="No crea el índice; sólo informa (exit 1 si falta).")
+
+    def _indice_existente(self):
+        with connection.cursor() as cur:
+            constraints = connection.introspection.get_constraints(cur, TABLA)
+        for nombre, info in constraints.items():
+            if info.get("index") and not info.get("primary_key") and info.get("columns") == COLUMNAS:
+                return nombre
+        return None
+
+    def _plan(self):
+        with connection.cursor() as cur:
+            if connection.vendor == "mysql":
+                cur.execute("EXPLAIN " + CONSULTA, [0, 2 ** 31 - 1])
+                cols = [c[0] for c in cur.description]
+                fila = dict(zip(cols, cur.fetchone()))
+                return f"key={fila.get('key')} type={fila.get('type')} extra={fila.get('Extra')}"
+            if connection.vendor == "sqlite":
+                cur.execute("EXPLAIN QUERY PLAN " + CONSULTA, [0, 2 ** 31 - 1])
+                return " | ".join(str(r[-1]) for r in cur.fetchall())
+        return "(EXPLAIN no soportado en este motor)"
+
+    def handle(self, *args, **opts):
+        nombre = self._indice_existente()
+        if nombre:
+            self.stdout.write(f"Índice presente: {nombre} ({', '.join(COLUMNAS)})")
+        elif opts["solo_verificar"]:
+            raise CommandError(f"Falta índice ({', '.join(COLUMNAS)}) en {TABLA}.")
+        else:
+            qn = connection.ops.quote_name
+            with connection.cursor() as cur:
+                cur.execute(f"CREATE INDEX {qn(INDICE)} ON {qn(TABLA)} ({', '.join(qn(c) for c in COLUMNAS)})")
+            nombre = self._indice_existente()
+            if not nombre:
+                raise CommandError("No se pudo verificar el índice recién creado.")
+            self.stdout.write(self.style.SUCCESS(f"Índice creado: {nombre}"))
+
+        plan = self._plan()
+        self.stdout.write(f"Plan paginación: {plan}")
+        if nombre not in plan and connection.vendor in ("mysql", "sqlite"):
+            self.stdout.write(self.style.WARNING(
+                "El plan no usa el índice (tabla pequeña o estadísticas viejas: ANALYZE TABLE)."))
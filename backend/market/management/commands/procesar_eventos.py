@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from market.helpers_eventos import LOTE_DEFAULT, consumidores, pendientes, procesar
+
+
+class Command(BaseCommand):
+    help = ("Procesa la bitácora evento_intercambio con los consumidores registrados "
+            "(helpers_eventos), por lotes y con checkpoint. Una pasada, o como proceso con --cada, "
+            "p.ej. el proceso `eventos` del Procfile.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumidor", action="append", default=None,
+                            help="nombre del consumidor (repetible; default: todos)")
+        parser.add_argument("--lote", type=int, default=LOTE_DEFAULT, help="eventos por lote")
+        parser.add_argument("--cada", type=int, default=0, help="repetir cada N segundos (0 = una pasada)")
+        parser.add_argument("--estado", action="store_true", help="sólo muestra eventos pendientes por consumidor")
+
+    def handle(self, *args, **opts):
+        nombres = opts["consumidor"] or consumidores()
+        desconocidos = set(nombres) - set(consumidores())
+        if desconocidos:
+            raise CommandError(f"Consumidores desconocidos: {sorted(desconocidos)}")
+        if opts["estado"]:
+            for n in nombres:
+                self.stdout.write(f"{n}: pendientes={pendientes(n)}")
+            return
+        while True:
+            for n in nombres:
+                total = 0
+                try:
+                    # vaciar el atraso en lotes antes de dormir
+                    while True:
+                        hechos = procesar(n, opts["lote"])
+                        total += hechos
+                        if not hechos:
+                            break
+                except Exception as e:
+                    self.stderr.write(f"{n}: error, el lote se reintenta: {e}")
+                if total or not opts["cada"]:
+                    self.stdout.write(self.style.SUCCESS(f"{n}: eventos={total}"))
+            if not opts["cada"]:
+                return
+            close_old_connections()
+            time.sleep(opts["cada"])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from market.models import Conversacion
+from market.helpers_bandeja import sincronizar_bandeja
+
+
+class Command(BaseCommand):
+    help = ("Reconstruye la bandeja de chats desnormalizada (bandeja_chat) y la caché "
+            "conversacion.escribible desde las tablas fuente.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=500, help="conversaciones por lote")
+
+    def handle(self, *args, **opts):
+        lote = max(1, opts["lote"])
+        ids = list(Conversacion.objects.order_by("id_conversacion").values_list("id_conversacion", flat=True))
+        filas = 0
+        for i in range(0, len(ids), lote):
+            filas += sincronizar_bandeja(ids[i:i + lote])
+        self.stdout.write(self.style.SUCCESS(f"Conversaciones={len(ids)} filas_bandeja={filas}"))
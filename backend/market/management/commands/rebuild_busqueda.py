@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from market.models import Libro
+from market.busqueda import indexar_libro
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de libros (libro_busqueda / libro_termino)."
+
+    def handle(self, *args, **opts):
+        n = 0
+        for libro_id in Libro.objects.order_by('id_libro').values_list('id_libro', flat=True).iterator():
+            indexar_libro(libro_id)
+            n += 1
+        self.stdout.write(self.style.SUCCESS(f"Libros indexados={n}"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from market.busqueda_chat import reindexar_conversacion
+from market.models import Conversacion
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de mensajes del chat (mensaje_termino)."
+
+    def handle(self, *args, **opts):
+        convs = filas = 0
+        for conv_id in Conversacion.objects.order_by("id_conversacion").values_list("id_conversacion", flat=True):
+            with transaction.atomic():
+                filas += reindexar_conversacion(conv_id)
+            convs += 1
+        self.stdout.write(self.style.SUCCESS(f"Conversaciones={convs} términos={filas}"))
@@ -0,0 +1,72 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Usuario
+from market.models import ImagenLibro
+from market.helpers_imagenes import guardar_imagen, variante
+from market.helpers_portada import recalcular_portada
+from market.helpers_cache import bump_version, LIBROS
+
+# Imágenes por defecto referenciadas por nombre en el código: no se tocan
+POR_DEFECTO = {"books/librodefecto.png", "avatars/avatardefecto.jpg"}
+
+
+class Command(BaseCommand):
+    help = "Genera derivados (thumb/card/full, JPEG+WebP) para imágenes subidas antes del pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--borrar-originales', action='store_true',
+                            help='Borra el archivo antiguo después de convertirlo (queda copia en originales/)')
+
+    def _convertir(self, rel, carpeta):
+        rel = (rel or "").replace("\\", "/")
+        if not rel or rel in POR_DEFECTO or rel.startswith(("http://", "https://")):
+            return None
+        if variante(rel, "thumb") != rel:
+            return None  # ya tiene derivados
+        if not default_storage.exists(rel):
+            return None
+        with default_storage.open(rel, "rb") as fh:
+            nuevo = guardar_imagen(fh, carpeta)
+        if variante(nuevo, "thumb") == nuevo:
+            # Pillow no la pudo abrir: guardar_imagen dejó una copia cruda, se descarta
+            default_storage.delete(nuevo)
+            return None
+        return nuevo
+
+    def handle(self, *args, **opts):
+        libros = imgs = avatars = omitidas = 0
+        viejos = []
+
+        for im in ImagenLibro.objects.order_by('id_imagen').iterator():
+            nuevo = self._convertir(im.url_imagen, "books")
+            if not nuevo:
+                omitidas += 1
+                continue
+            with transaction.atomic():
+                viejos.append(im.url_imagen)
+                ImagenLibro.objects.filter(pk=im.pk).update(url_imagen=nuevo)
+                libros += recalcular_portada([im.id_libro_id])
+            imgs += 1
+
+        for u in Usuario.objects.exclude(imagen_perfil__isnull=True).only('id_usuario', 'imagen_perfil').iterator():
+            nuevo = self._convertir(u.imagen_perfil, "avatars")
+            if not nuevo:
+                continue
+            viejos.append(u.imagen_perfil)
+            Usuario.objects.filter(pk=u.pk).update(imagen_perfil=nuevo)
+            avatars += 1
+
+        if imgs:
+            bump_version(LIBROS)
+
+        if opts['borrar_originales']:
+            for rel in viejos:
+                try:
+                    default_storage.delete(rel)
+                except Exception:
+                    pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imágenes convertidas={imgs}  portadas actualizadas={libros}  avatars={avatars}  omitidas={omitidas}"
+        ))
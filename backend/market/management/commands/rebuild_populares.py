@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from market.helpers_populares import reconstruir_populares
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el ranking de títulos populares (titulo_popularidad)."
+
+    def handle(self, *args, **opts):
+        n = reconstruir_populares()
+        self.stdout.write(self.style.SUCCESS(f"Títulos en ranking={n}"))
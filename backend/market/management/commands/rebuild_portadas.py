@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from market.models import Libro
+from market.helpers_portada import recalcular_portada
+
+
+class Command(BaseCommand):
+    help = "Reconstruye libro.portada desde imagen_libro."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Libros por lote')
+
+    def handle(self, *args, **opts):
+        chunk = max(1, opts['chunk'])
+        ids = list(Libro.objects.order_by('id_libro').values_list('id_libro', flat=True))
+        cambiados = 0
+        for i in range(0, len(ids), chunk):
+            cambiados += recalcular_portada(ids[i:i + chunk])
+        self.stdout.write(self.style.SUCCESS(
+            f"Libros revisados={len(ids)}  corregidos={cambiados}"
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Usuario
+from market.models import ContadorUsuario
+from market.helpers_badges import recontar
+
+
+class Command(BaseCommand):
+    help = "Recalcula usuario_contadores (badges de chat y solicitudes) y reporta la deriva corregida."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Usuarios por lote')
+
+    def handle(self, *args, **opts):
+        chunk = max(1, opts['chunk'])
+        ids = list(Usuario.objects.order_by('id_usuario').values_list('id_usuario', flat=True))
+        corregidos = 0
+        for i in range(0, len(ids), chunk):
+            lote = ids[i:i + chunk]
+            with transaction.atomic():
+                antes = {pk: (c, s) for pk, c, s in (ContadorUsuario.objects
+                                                     .select_for_update()
+                                                     .filter(pk__in=lote)
+                                                     .values_list('pk', 'chat_no_leidos', 'solicitudes_no_vistas'))}
+                despues = recontar(lote)
+                corregidos += sum(1 for u, v in despues.items() if antes.get(u, (0, 0)) != v)
+        self.stdout.write(self.style.SUCCESS(f"Usuarios revisados={len(ids)}  corregidos={corregidos}"))
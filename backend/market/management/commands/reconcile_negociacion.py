@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from market.models import Libro
+from market.helpers_estado import recalcular_negociacion, recalcular_actividad
+from market.helpers_reservas import sincronizar_reservas
+
+
+class Command(BaseCommand):
+    help = ("Reconstruye libro.en_negociacion, libro.ultima_actividad_id y el ledger reserva_libro "
+            "desde intercambios y solicitudes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Libros por lote')
+
+    def handle(self, *args, **opts):
+        chunk = max(1, opts['chunk'])
+        ids = list(Libro.objects.order_by('id_libro').values_list('id_libro', flat=True))
+        cambiados = actividad = reservas = 0
+        for i in range(0, len(ids), chunk):
+            with transaction.atomic():
+                reservas += sincronizar_reservas(ids[i:i + chunk])
+                cambiados += recalcular_negociacion(ids[i:i + chunk])
+                actividad += recalcular_actividad(ids[i:i + chunk])
+        self.stdout.write(self.style.SUCCESS(
+            f"Libros revisados={len(ids)}  corregidos={cambiados}  actividad_corregida={actividad}  "
+            f"reservas_corregidas={reservas}"
+        ))
@@ -0,0 +1,37 @@
+# market/migrations/0013_libro_en_negociacion.py
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0012_alter_propuestaencuentro_table_and_more'),
+    ]
+
+    # libro es managed=False: la columna y el índice se crean a mano, con relleno
+    # inicial (mismas reglas que helpers_estado.recalcular_negociacion).
+    # `python manage.py reconcile_negociacion` también la corrige.
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE libro ADD COLUMN en_negociacion TINYINT(1) NOT NULL DEFAULT 0",
+                "CREATE INDEX ix_libro_catalogo ON libro (disponible, en_negociacion, fecha_subida)",
+                """
+                UPDATE libro l SET l.en_negociacion = 1
+                WHERE EXISTS (SELECT 1 FROM intercambio i
+                              JOIN solicitud_intercambio s ON s.id_solicitud = i.id_solicitud
+                              WHERE (i.id_libro_ofrecido_aceptado = l.id_libro OR s.id_libro_deseado = l.id_libro)
+                                AND i.estado_intercambio IN ('Pendiente', 'Aceptado'))
+                   OR EXISTS (SELECT 1 FROM solicitud_oferta o
+                              JOIN solicitud_intercambio s ON s.id_solicitud = o.id_solicitud
+                              WHERE o.id_libro_ofrecido = l.id_libro
+                                AND s.id_usuario_solicitante = l.id_usuario
+                                AND s.estado = 'Pendiente')
+                """,
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_libro_catalogo ON libro",
+                "ALTER TABLE libro DROP COLUMN en_negociacion",
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# market/migrations/0014_libro_portada.py
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0013_libro_en_negociacion'),
+    ]
+
+    # libro es managed=False: columna a mano + relleno inicial con la misma
+    # regla que helpers_portada.recalcular_portada (is_portada, si no la primera
+    # por orden). `python manage.py rebuild_portadas` también la recalcula.
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE libro ADD COLUMN portada VARCHAR(255) NULL",
+                r"""
+                UPDATE libro l SET l.portada = NULLIF(REPLACE(COALESCE(
+                  (SELECT im.url_imagen FROM imagen_libro im
+                   WHERE im.id_libro = l.id_libro AND im.is_portada = 1
+                   ORDER BY im.id_imagen LIMIT 1),
+                  (SELECT im.url_imagen FROM imagen_libro im
+                   WHERE im.id_libro = l.id_libro
+                   ORDER BY im.orden, im.id_imagen LIMIT 1)
+                ), '\\', '/'), '')
+                """,
+            ],
+            reverse_sql=[
+                "ALTER TABLE libro DROP COLUMN portada",
+            ],
+        ),
+    ]
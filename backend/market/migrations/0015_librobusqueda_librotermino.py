@@ -0,0 +1,83 @@
+# market/migrations/0015_librobusqueda_librotermino.py
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def crear_fulltext(apps, schema_editor):
+    # Solo MySQL: el backend de búsqueda usa MATCH ... AGAINST sobre libro_busqueda.texto
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute("CREATE FULLTEXT INDEX ft_libro_busqueda ON libro_busqueda (texto)")
+
+
+def poblar_indice(apps, schema_editor):
+    # Relleno inicial (mismas reglas que busqueda.indexar_libro); antes la búsqueda
+    # quedaba vacía hasta correr `manage.py rebuild_busqueda`.
+    from market.busqueda import PESOS, normalizar, tokenizar
+
+    Libro = apps.get_model('market', 'Libro')
+    LibroBusqueda = apps.get_model('market', 'LibroBusqueda')
+    LibroTermino = apps.get_model('market', 'LibroTermino')
+    ahora = timezone.now()
+    filas = (Libro.objects
+             .order_by('id_libro')
+             .values_list('id_libro', 'titulo', 'autor', 'editorial', 'id_genero__nombre'))
+    busqueda, terminos = [], []
+    for pk, *valores in filas.iterator():
+        campos = dict(zip(("titulo", "autor", "editorial", "genero"), valores))
+        pesos = {}
+        for campo, valor in campos.items():
+            for tok in tokenizar(valor):
+                pesos[tok] = max(pesos.get(tok, 0), PESOS[campo])
+        busqueda.append(LibroBusqueda(
+            id_libro_id=pk, texto=" ".join(normalizar(v) for v in campos.values() if v), actualizado_en=ahora))
+        terminos += [LibroTermino(id_libro_id=pk, termino=tok, peso=peso) for tok, peso in pesos.items()]
+        if len(busqueda) >= 500:
+            LibroBusqueda.objects.bulk_create(busqueda)
+            LibroTermino.objects.bulk_create(terminos)
+            busqueda, terminos = [], []
+    LibroBusqueda.objects.bulk_create(busqueda)
+    LibroTermino.objects.bulk_create(terminos)
+
+
+def borrar_fulltext(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute("DROP INDEX ft_libro_busqueda ON libro_busqueda")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0014_libro_portada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibroBusqueda',
+            fields=[
+                ('id_libro', models.OneToOneField(db_column='id_libro', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='busqueda', serialize=False, to='market.libro')),
+                ('texto', models.TextField()),
+                ('actualizado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'libro_busqueda',
+            },
+        ),
+        migrations.CreateModel(
+            name='LibroTermino',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('termino', models.CharField(max_length=64)),
+                ('peso', models.PositiveSmallIntegerField(default=1)),
+                ('id_libro', models.ForeignKey(db_column='id_libro', on_delete=django.db.models.deletion.CASCADE, related_name='terminos', to='market.libro')),
+            ],
+            options={
+                'db_table': 'libro_termino',
+                'indexes': [models.Index(fields=['id_libro'], name='ix_libro_termino_libro')],
+                'constraints': [models.UniqueConstraint(fields=('termino', 'id_libro'), name='uq_libro_termino')],
+            },
+        ),
+        migrations.RunPython(crear_fulltext, borrar_fulltext),
+        migrations.RunPython(poblar_indice, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# market/migrations/0016_titulopopularidad.py
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, F
+from django.utils import timezone
+
+
+def poblar_populares(apps, schema_editor):
+    # Relleno inicial (mismas reglas que helpers_populares.reconstruir_populares);
+    # antes `populares` devolvía [] hasta correr `manage.py rebuild_populares`.
+    from market.helpers_populares import SIN_TITULO, clave_titulo
+
+    Intercambio = apps.get_model('market', 'Intercambio')
+    Libro = apps.get_model('market', 'Libro')
+    TituloPopularidad = apps.get_model('market', 'TituloPopularidad')
+
+    acc, display = {}, {}
+    for campo in ('id_libro_ofrecido_aceptado__titulo', 'id_solicitud__id_libro_deseado__titulo'):
+        for row in (Intercambio.objects
+                    .filter(estado_intercambio='Completado')
+                    .values(title=F(campo))
+                    .annotate(n=Count('id_intercambio'))):
+            k = clave_titulo(row['title'])
+            acc[k] = acc.get(k, 0) + int(row['n'] or 0)
+            display.setdefault(k, (row['title'] or '').strip() or SIN_TITULO)
+
+    disponibles = {}
+    for row in Libro.objects.filter(disponible=True).values('titulo').annotate(n=Count('id_libro')):
+        k = clave_titulo(row['titulo'])
+        if k in acc:
+            disponibles[k] = disponibles.get(k, 0) + int(row['n'] or 0)
+
+    now = timezone.now()
+    TituloPopularidad.objects.bulk_create([
+        TituloPopularidad(clave=k, titulo=display[k][:255], total_intercambios=n,
+                          repeticiones=disponibles.get(k, 0), actualizado_en=now)
+        for k, n in acc.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0015_librobusqueda_librotermino'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TituloPopularidad',
+            fields=[
+                ('clave', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('titulo', models.CharField(max_length=255)),
+                ('total_intercambios', models.PositiveIntegerField(default=0)),
+                ('repeticiones', models.PositiveIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'titulo_popularidad',
+                'indexes': [models.Index(fields=['-total_intercambios', 'titulo'], name='ix_titulo_popularidad_top')],
+            },
+        ),
+        # libro es managed=False: índice para contar copias por título (titulo__iexact)
+        migrations.RunSQL(
+            sql="CREATE INDEX ix_libro_titulo ON libro (titulo);",
+            reverse_sql="DROP INDEX ix_libro_titulo ON libro;",
+        ),
+        migrations.RunPython(poblar_populares, migrations.RunPython.noop),
+    ]
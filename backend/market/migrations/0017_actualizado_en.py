@@ -0,0 +1,28 @@
+# market/migrations/0017_actualizado_en.py
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0016_titulopopularidad'),
+    ]
+
+    # libro / intercambio son managed=False: columnas a mano.
+    # ON UPDATE hace que también los .update() masivos muevan la marca (validadores ETag).
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE libro ADD COLUMN actualizado_en DATETIME(6) NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+                "CREATE INDEX ix_libro_publico ON libro (disponible, en_negociacion, actualizado_en)",
+                "ALTER TABLE intercambio ADD COLUMN actualizado_en DATETIME(6) NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+            ],
+            reverse_sql=[
+                "ALTER TABLE intercambio DROP COLUMN actualizado_en",
+                "DROP INDEX ix_libro_publico ON libro",
+                "ALTER TABLE libro DROP COLUMN actualizado_en",
+            ],
+        ),
+    ]
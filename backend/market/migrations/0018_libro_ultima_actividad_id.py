@@ -0,0 +1,34 @@
+# market/migrations/0018_libro_ultima_actividad_id.py
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0017_actualizado_en'),
+    ]
+
+    # libro es managed=False: columna a mano + relleno inicial con la misma
+    # marca compuesta que calculaba my_books (GREATEST de los tres MAX).
+    # `python manage.py reconcile_negociacion` también la corrige.
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE libro ADD COLUMN ultima_actividad_id INT NOT NULL DEFAULT 0",
+                """
+                UPDATE libro l SET l.ultima_actividad_id = GREATEST(
+                  COALESCE((SELECT MAX(i.id_intercambio) FROM intercambio i
+                            WHERE i.id_libro_ofrecido_aceptado = l.id_libro), 0),
+                  COALESCE((SELECT MAX(i.id_intercambio) FROM intercambio i
+                            JOIN solicitud_intercambio s ON s.id_solicitud = i.id_solicitud
+                            WHERE s.id_libro_deseado = l.id_libro), 0),
+                  COALESCE((SELECT MAX(s.id_solicitud) FROM solicitud_intercambio s
+                            WHERE s.id_libro_deseado = l.id_libro), 0)
+                )
+                """,
+            ],
+            reverse_sql=[
+                "ALTER TABLE libro DROP COLUMN ultima_actividad_id",
+            ],
+        ),
+    ]
@@ -0,0 +1,83 @@
+# market/migrations/0019_bandejachat.py
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_passwordresettoken_options_and_more'),
+        ('market', '0018_libro_ultima_actividad_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BandejaChat',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('rol', models.CharField(blank=True, max_length=20, null=True)),
+                ('archivado', models.BooleanField(default=False)),
+                ('otro_usuario_id', models.IntegerField(blank=True, null=True)),
+                ('otro_nombre_usuario', models.CharField(blank=True, max_length=255, null=True)),
+                ('otro_nombres', models.CharField(blank=True, max_length=255, null=True)),
+                ('otro_imagen_perfil', models.CharField(blank=True, max_length=255, null=True)),
+                ('id_intercambio', models.IntegerField(blank=True, null=True)),
+                ('intercambio_estado', models.CharField(blank=True, max_length=20, null=True)),
+                ('libro_solicitado_titulo', models.CharField(blank=True, max_length=255, null=True)),
+                ('libro_ofrecido_titulo', models.CharField(blank=True, max_length=255, null=True)),
+                ('ultimo_id_mensaje', models.IntegerField(default=0)),
+                ('ultimo_mensaje', models.CharField(blank=True, max_length=255, null=True)),
+                ('ultimo_enviado_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('no_leidos', models.PositiveIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('id_conversacion', models.ForeignKey(db_column='id_conversacion', on_delete=django.db.models.deletion.CASCADE, related_name='bandeja', to='market.conversacion')),
+                ('id_usuario', models.ForeignKey(db_column='id_usuario', on_delete=django.db.models.deletion.CASCADE, related_name='bandeja_chats', to='core.usuario')),
+            ],
+            options={
+                'db_table': 'bandeja_chat',
+                'constraints': [models.UniqueConstraint(fields=('id_usuario', 'id_conversacion'), name='uq_bandeja_usuario_conv')],
+                'indexes': [models.Index(fields=['id_usuario', 'archivado', '-ultimo_enviado_en', '-id_conversacion'], name='ix_bandeja_usuario')],
+            },
+        ),
+        # Relleno inicial: una fila por participante, con la misma regla que
+        # helpers_bandeja._filas (el "otro" = primer participante distinto).
+        # `python manage.py rebuild_bandeja` también la recalcula.
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT IGNORE INTO bandeja_chat (
+                  id_usuario, id_conversacion, rol, archivado,
+                  otro_usuario_id, otro_nombre_usuario, otro_nombres, otro_imagen_perfil,
+                  id_intercambio, intercambio_estado, libro_solicitado_titulo, libro_ofrecido_titulo,
+                  ultimo_id_mensaje, ultimo_mensaje, ultimo_enviado_en, no_leidos, actualizado_en
+                )
+                SELECT
+                  p.id_usuario, p.id_conversacion, p.rol, p.archivado,
+                  u.id_usuario, u.nombre_usuario, u.nombres, u.imagen_perfil,
+                  i.id_intercambio,
+                  COALESCE(NULLIF(TRIM(i.estado_intercambio), ''), NULLIF(TRIM(s.estado), '')),
+                  ls.titulo, lo.titulo,
+                  COALESCE(c.ultimo_id_mensaje, 0), LEFT(m.cuerpo, 255),
+                  COALESCE(c.actualizado_en, NOW(6)),
+                  (SELECT COUNT(*) FROM conversacion_mensaje mn
+                   WHERE mn.id_conversacion = p.id_conversacion
+                     AND mn.id_mensaje > p.ultimo_visto_id_mensaje
+                     AND mn.id_usuario_emisor <> p.id_usuario),
+                  NOW(6)
+                FROM conversacion_participante p
+                JOIN conversacion c ON c.id_conversacion = p.id_conversacion
+                LEFT JOIN usuario u ON u.id_usuario = (
+                  SELECT o.id_usuario FROM conversacion_participante o
+                  WHERE o.id_conversacion = p.id_conversacion AND o.id_usuario <> p.id_usuario
+                  ORDER BY o.id LIMIT 1)
+                LEFT JOIN intercambio i ON i.id_intercambio = c.id_intercambio
+                LEFT JOIN solicitud_intercambio s ON s.id_solicitud = i.id_solicitud
+                LEFT JOIN libro ls ON ls.id_libro = s.id_libro_deseado
+                LEFT JOIN libro lo ON lo.id_libro = i.id_libro_ofrecido_aceptado
+                LEFT JOIN conversacion_mensaje m ON m.id_mensaje = c.ultimo_id_mensaje
+                """,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,27 @@
+# market/migrations/0020_contadorusuario.py
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_passwordresettoken_options_and_more'),
+        ('market', '0019_bandejachat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorUsuario',
+            fields=[
+                ('id_usuario', models.OneToOneField(db_column='id_usuario', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='contadores', serialize=False, to='core.usuario')),
+                ('chat_no_leidos', models.PositiveIntegerField(default=0)),
+                ('solicitudes_no_vistas', models.PositiveIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'usuario_contadores',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# market/migrations/0021_conversacion_escribible.py
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0020_contadorusuario'),
+    ]
+
+    # conversacion es managed=False: columnas a mano + relleno inicial con la
+    # misma regla que usaba enviar_mensaje (solicitud Pendiente/Aceptada).
+    # `python manage.py rebuild_bandeja` también la corrige.
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE conversacion ADD COLUMN escribible TINYINT(1) NOT NULL DEFAULT 0",
+                "ALTER TABLE conversacion ADD COLUMN escritura_version INT NOT NULL DEFAULT 0",
+                """
+                UPDATE conversacion c
+                JOIN intercambio i ON i.id_intercambio = c.id_intercambio
+                JOIN solicitud_intercambio s ON s.id_solicitud = i.id_solicitud
+                SET c.escribible = (s.estado IN ('Pendiente', 'Aceptada')),
+                    c.escritura_version = 1
+                """,
+            ],
+            reverse_sql=[
+                "ALTER TABLE conversacion DROP COLUMN escritura_version",
+                "ALTER TABLE conversacion DROP COLUMN escribible",
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# market/migrations/0022_mensaje_id_cliente.py
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0021_conversacion_escribible'),
+    ]
+
+    # conversacion_mensaje es managed=False: columna + único (emisor, id_cliente)
+    # para la sincronización por lotes (NULL se repite sin problema).
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE conversacion_mensaje ADD COLUMN id_cliente VARCHAR(64) NULL",
+                "CREATE UNIQUE INDEX ux_cmsg_emisor_cliente ON conversacion_mensaje (id_usuario_emisor, id_cliente)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ux_cmsg_emisor_cliente ON conversacion_mensaje",
+                "ALTER TABLE conversacion_mensaje DROP COLUMN id_cliente",
+            ],
+        ),
+    ]
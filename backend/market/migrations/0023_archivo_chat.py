@@ -0,0 +1,38 @@
+# market/migrations/0023_archivo_chat.py
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_passwordresettoken_options_and_more'),
+        ('market', '0022_mensaje_id_cliente'),
+    ]
+
+    operations = [
+        # conversacion es managed=False: columna a mano
+        migrations.RunSQL(
+            sql=["ALTER TABLE conversacion ADD COLUMN archivada_en DATETIME(6) NULL"],
+            reverse_sql=["ALTER TABLE conversacion DROP COLUMN archivada_en"],
+        ),
+        migrations.CreateModel(
+            name='ConversacionMensajeArchivo',
+            fields=[
+                ('id_mensaje', models.IntegerField(db_column='id_mensaje', primary_key=True, serialize=False)),
+                ('cuerpo', models.TextField(db_column='cuerpo')),
+                ('enviado_en', models.DateTimeField(db_column='enviado_en')),
+                ('editado_en', models.DateTimeField(blank=True, db_column='editado_en', null=True)),
+                ('eliminado', models.BooleanField(default=False)),
+                ('id_cliente', models.CharField(blank=True, max_length=64, null=True)),
+                ('archivado_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('id_conversacion', models.ForeignKey(db_column='id_conversacion', on_delete=django.db.models.deletion.CASCADE, related_name='mensajes_archivados', to='market.conversacion')),
+                ('id_usuario_emisor', models.ForeignKey(db_column='id_usuario_emisor', on_delete=django.db.models.deletion.DO_NOTHING, related_name='mensajes_chat_archivados', to='core.usuario')),
+            ],
+            options={
+                'db_table': 'conversacion_mensaje_archivo',
+                'indexes': [models.Index(fields=['id_conversacion', 'id_mensaje'], name='ix_cmsg_arch_conv_mensaje')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# market/migrations/0024_mensajetermino.py
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_passwordresettoken_options_and_more'),
+        ('market', '0023_archivo_chat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensajeTermino',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('termino', models.CharField(max_length=64)),
+                ('id_mensaje', models.IntegerField()),
+                ('id_conversacion', models.IntegerField()),
+                ('id_usuario', models.ForeignKey(db_column='id_usuario', on_delete=django.db.models.deletion.CASCADE, related_name='terminos_chat', to='core.usuario')),
+            ],
+            options={
+                'db_table': 'mensaje_termino',
+                'indexes': [models.Index(fields=['id_conversacion'], name='ix_mensaje_termino_conv')],
+                'constraints': [models.UniqueConstraint(fields=('id_usuario', 'termino', 'id_mensaje'), name='uq_mensaje_termino')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# market/migrations/0025_reservalibro.py
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0024_mensajetermino'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaLibro',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('rol', models.CharField(max_length=12)),
+                ('clave', models.IntegerField(default=0)),
+                ('id_solicitud', models.IntegerField()),
+                ('creado_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('id_libro', models.ForeignKey(db_column='id_libro', on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='market.libro')),
+            ],
+            options={
+                'db_table': 'reserva_libro',
+                'indexes': [models.Index(fields=['id_solicitud'], name='ix_reserva_solicitud')],
+                'constraints': [models.UniqueConstraint(fields=('id_libro', 'rol', 'clave'), name='uq_reserva_libro_rol')],
+            },
+        ),
+        # relleno inicial (mismas reglas que helpers_reservas._esperadas);
+        # `python manage.py reconcile_negociacion` también lo recalcula.
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT IGNORE INTO reserva_libro (id_libro, rol, clave, id_solicitud, creado_en)
+                SELECT o.id_libro_ofrecido, 'OFERTA', 0, s.id_solicitud, NOW(6)
+                FROM solicitud_oferta o
+                JOIN solicitud_intercambio s ON s.id_solicitud = o.id_solicitud
+                WHERE s.estado = 'Pendiente'
+                """,
+                """
+                INSERT IGNORE INTO reserva_libro (id_libro, rol, clave, id_solicitud, creado_en)
+                SELECT s.id_libro_deseado, 'SOLICITUD', s.id_usuario_solicitante, s.id_solicitud, NOW(6)
+                FROM solicitud_intercambio s
+                WHERE s.estado = 'Pendiente'
+                """,
+                """
+                INSERT IGNORE INTO reserva_libro (id_libro, rol, clave, id_solicitud, creado_en)
+                SELECT s.id_libro_deseado, 'INTERCAMBIO', 0, s.id_solicitud, NOW(6)
+                FROM intercambio i
+                JOIN solicitud_intercambio s ON s.id_solicitud = i.id_solicitud
+                WHERE i.estado_intercambio IN ('Pendiente', 'Aceptado')
+                """,
+                """
+                INSERT IGNORE INTO reserva_libro (id_libro, rol, clave, id_solicitud, creado_en)
+                SELECT i.id_libro_ofrecido_aceptado, 'INTERCAMBIO', 0, i.id_solicitud, NOW(6)
+                FROM intercambio i
+                WHERE i.estado_intercambio IN ('Pendiente', 'Aceptado')
+                  AND i.id_libro_ofrecido_aceptado IS NOT NULL
+                """,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
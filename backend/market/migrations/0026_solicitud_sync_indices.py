@@ -0,0 +1,26 @@
+# market/migrations/0026_solicitud_sync_indices.py
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0025_reservalibro'),
+    ]
+
+    # solicitud_intercambio es managed=False: índices a mano.
+    # Sirven al modo ?since= de los listados (lápidas por usuario + actualizada_en).
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE INDEX ix_solicitud_receptor_act ON solicitud_intercambio "
+                "(id_usuario_receptor, actualizada_en)",
+                "CREATE INDEX ix_solicitud_solicitante_act ON solicitud_intercambio "
+                "(id_usuario_solicitante, actualizada_en)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_solicitud_solicitante_act ON solicitud_intercambio",
+                "DROP INDEX ix_solicitud_receptor_act ON solicitud_intercambio",
+            ],
+        ),
+    ]
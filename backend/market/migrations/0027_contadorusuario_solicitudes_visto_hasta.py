@@ -0,0 +1,19 @@
+# market/migrations/0027_contadorusuario_solicitudes_visto_hasta.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0026_solicitud_sync_indices'),
+    ]
+
+    # Sin backfill: lo ya marcado conserva visto_por_receptor=1 y sigue excluido
+    # del conteo (helpers_badges.contar_solicitudes).
+    operations = [
+        migrations.AddField(
+            model_name='contadorusuario',
+            name='solicitudes_visto_hasta',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
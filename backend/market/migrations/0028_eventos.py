@@ -0,0 +1,41 @@
+# market/migrations/0028_eventos.py
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0027_contadorusuario_solicitudes_visto_hasta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoIntercambio',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(max_length=32)),
+                ('id_solicitud', models.IntegerField(blank=True, null=True)),
+                ('id_intercambio', models.IntegerField(blank=True, null=True)),
+                ('id_actor', models.IntegerField(blank=True, null=True)),
+                ('datos', models.JSONField(blank=True, default=dict)),
+                ('creado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'evento_intercambio',
+                'indexes': [models.Index(fields=['id_solicitud'], name='ix_evento_solicitud')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ConsumidorEventos',
+            fields=[
+                ('nombre', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('procesados', models.BigIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'evento_consumidor',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# market/migrations/0029_bandejachat_titulo.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0028_eventos'),
+    ]
+
+    # conversacion.titulo ya existe (tabla managed=False); la bandeja lo copia
+    # para que display_title vuelva a caer en él. Relleno inicial con SQL;
+    # `python manage.py rebuild_bandeja` también lo recalcula.
+    operations = [
+        migrations.AddField(
+            model_name='bandejachat',
+            name='titulo',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.RunSQL(
+            sql=[
+                """
+                UPDATE bandeja_chat b
+                JOIN conversacion c ON c.id_conversacion = b.id_conversacion
+                SET b.titulo = c.titulo
+                WHERE c.titulo IS NOT NULL
+                """,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
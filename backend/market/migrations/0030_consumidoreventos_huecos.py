@@ -0,0 +1,17 @@
+# market/migrations/0030_consumidoreventos_huecos.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0029_bandejachat_titulo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consumidoreventos',
+            name='huecos',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# market/migrations/0031_contadorusuario_solicitudes_version.py
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0030_consumidoreventos_huecos'),
+    ]
+
+    # Sin backfill: el primer ETag de cada usuario se calcula con 0.
+    operations = [
+        migrations.AddField(
+            model_name='contadorusuario',
+            name='solicitudes_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# market/migrations/0032_poblar_mensaje_termino.py
+from django.db import migrations
+
+LOTE = 1000
+
+
+def poblar_terminos(apps, schema_editor):
+    # Relleno inicial de mensaje_termino (mismas reglas que busqueda_chat.indexar_mensajes);
+    # 0024 creó la tabla vacía y la búsqueda no encontraba mensajes anteriores al deploy.
+    # Por lotes de id_mensaje (keyset) sobre vivos y archivados; idempotente (uq_mensaje_termino).
+    from market.busqueda import tokenizar
+    from market.busqueda_chat import MAX_TERMINOS_MENSAJE
+
+    ConversacionParticipante = apps.get_model('market', 'ConversacionParticipante')
+    MensajeTermino = apps.get_model('market', 'MensajeTermino')
+    for nombre in ('ConversacionMensaje', 'ConversacionMensajeArchivo'):
+        Mensaje = apps.get_model('market', nombre)
+        ultimo = 0
+        while True:
+            lote = list(Mensaje.objects
+                        .filter(id_mensaje__gt=ultimo)
+                        .order_by('id_mensaje')
+                        .values_list('id_mensaje', 'id_conversacion_id', 'cuerpo')[:LOTE])
+            if not lote:
+                break
+            ultimo = lote[-1][0]
+            usuarios = {}
+            for cid, uid in (ConversacionParticipante.objects
+                             .filter(id_conversacion_id__in={cid for _, cid, _ in lote})
+                             .values_list('id_conversacion_id', 'id_usuario_id')):
+                usuarios.setdefault(cid, []).append(uid)
+            MensajeTermino.objects.bulk_create([
+                MensajeTermino(id_usuario_id=uid, termino=tok, id_mensaje=mid, id_conversacion=cid)
+                for mid, cid, cuerpo in lote
+                for tok in tokenizar(cuerpo)[:MAX_TERMINOS_MENSAJE]
+                for uid in usuarios.get(cid, [])
+            ], ignore_conflicts=True, batch_size=LOTE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0031_contadorusuario_solicitudes_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(poblar_terminos, migrations.RunPython.noop),
+    ]
@@ -43,6 +43,15 @@ class Libro(models.Model):
         help_text=_("OWNER | BAJA | COMPLETADO (o NULL si disponible)")
     )
 
+    # Mantenido por las transiciones de solicitud/intercambio (ver helpers_estado.recalcular_negociacion)
+    en_negociacion = models.BooleanField(default=False, db_column='en_negociacion')
+    # Ruta relativa de la portada resuelta (ver helpers_portada.recalcular_portada)
+    portada = models.CharField(max_length=255, null=True, blank=True, db_column='portada')
+    # Mayor id de solicitud/intercambio del libro (ver helpers_estado.registrar_actividad)
+    ultima_actividad_id = models.IntegerField(default=0, db_column='ultima_actividad_id')
+    # ON UPDATE CURRENT_TIMESTAMP en MySQL (validadores ETag, ver helpers_etag.py)
+    actualizado_en = models.DateTimeField(auto_now=True, db_column='actualizado_en')
+
     id_usuario = models.ForeignKey(
         'core.Usuario', db_column='id_usuario',
         on_delete=models.DO_NOTHING, related_name='libros'
@@ -194,6 +203,13 @@ class Conversacion(models.Model):
     creado_en = models.DateTimeField(default=timezone.now)
     actualizado_en = models.DateTimeField(default=timezone.now)
     ultimo_id_mensaje = models.IntegerField(default=0, db_column='ultimo_id_mensaje')
+    titulo = models.CharField(max_length=255, null=True, blank=True)
+    # 👈 caché de "se puede escribir" (solicitud Pendiente/Aceptada); la mantienen
+    # las transiciones vía helpers_chat.actualizar_escribible()
+    escribible = models.BooleanField(default=False)
+    escritura_version = models.IntegerField(default=0)
+    # 👈 no nulo = mensajes movidos a conversacion_mensaje_archivo (helpers_archivo)
+    archivada_en = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'conversacion'
@@ -255,12 +271,43 @@ class ConversacionMensaje(models.Model):
     enviado_en = models.DateTimeField(db_column='enviado_en')
     editado_en = models.DateTimeField(db_column='editado_en', null=True, blank=True)
     eliminado = models.BooleanField(default=False)
+    # 👈 id generado por la app (cola offline): único por emisor -> reenvíos idempotentes
+    id_cliente = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         db_table = 'conversacion_mensaje'
         managed = False
 
 
+class ConversacionMensajeArchivo(models.Model):
+    """
+    Mensajes de conversaciones archivadas (intercambio Completado/Cancelado e
+    inactivo N días). Mismas columnas e ids que conversacion_mensaje para que
+    la paginación keyset lea una u otra tabla sin cambios (helpers_archivo.py).
+    """
+    id_mensaje = models.IntegerField(primary_key=True, db_column='id_mensaje')
+    id_conversacion = models.ForeignKey(
+        'market.Conversacion', db_column='id_conversacion',
+        on_delete=models.CASCADE, related_name='mensajes_archivados'
+    )
+    id_usuario_emisor = models.ForeignKey(
+        'core.Usuario', db_column='id_usuario_emisor',
+        on_delete=models.DO_NOTHING, related_name='mensajes_chat_archivados'
+    )
+    cuerpo = models.TextField(db_column='cuerpo')
+    enviado_en = models.DateTimeField(db_column='enviado_en')
+    editado_en = models.DateTimeField(db_column='editado_en', null=True, blank=True)
+    eliminado = models.BooleanField(default=False)
+    id_cliente = models.CharField(max_length=64, null=True, blank=True)
+    archivado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'conversacion_mensaje_archivo'
+        indexes = [
+            models.Index(fields=['id_conversacion', 'id_mensaje'], name='ix_cmsg_arch_conv_mensaje'),
+        ]
+
+
 class SolicitudIntercambio(models.Model):
     id_solicitud = models.AutoField(primary_key=True)
     id_usuario_solicitante = models.ForeignKey(
@@ -335,6 +382,8 @@ class Intercambio(models.Model):
         choices=[(v, v) for v in INTERCAMBIO_ESTADO.values()],
     )
     fecha_completado = models.DateTimeField(null=True, blank=True)
+    # ON UPDATE CURRENT_TIMESTAMP en MySQL (validadores ETag, ver helpers_etag.py)
+    actualizado_en = models.DateTimeField(auto_now=True, db_column='actualizado_en')
 
     class Meta:
         db_table = 'intercambio'
@@ -475,4 +524,214 @@ class ReportePublicacion(models.Model):
         db_table = 'reporte_publicacion'
 
     def __str__(self):
-        return f"Reporte #{self.id_reporte} sobre libro {self.id_libro_id} ({self.estado})"
\ No newline at end of file
+        return f"Reporte #{self.id_reporte} sobre libro {self.id_libro_id} ({self.estado})"
+
+class LibroBusqueda(models.Model):
+    """
+    Texto normalizado (sin tildes, minúsculas) de título/autor/editorial/género.
+    En MySQL lleva un índice FULLTEXT (ver migración 0015).
+    """
+    id_libro = models.OneToOneField(
+        'market.Libro', db_column='id_libro',
+        on_delete=models.CASCADE, primary_key=True, related_name='busqueda'
+    )
+    texto = models.TextField()
+    actualizado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'libro_busqueda'
+
+
+class LibroTermino(models.Model):
+    """
+    Índice invertido: un término normalizado por libro con su peso
+    (título > autor > editorial/género). Backend portable (SQLite/MySQL).
+    """
+    id = models.BigAutoField(primary_key=True)
+    termino = models.CharField(max_length=64)
+    id_libro = models.ForeignKey(
+        'market.Libro', db_column='id_libro',
+        on_delete=models.CASCADE, related_name='terminos'
+    )
+    peso = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        db_table = 'libro_termino'
+        constraints = [
+            models.UniqueConstraint(fields=['termino', 'id_libro'], name='uq_libro_termino'),
+        ]
+        indexes = [models.Index(fields=['id_libro'], name='ix_libro_termino_libro')]
+
+
+class MensajeTermino(models.Model):
+    """
+    Índice invertido del chat: (usuario, término, mensaje) por cada participante
+    de la conversación, así la búsqueda sólo recorre los términos del usuario
+    (ver busqueda_chat.py). id_mensaje sin FK: el mensaje puede estar archivado.
+    """
+    id = models.BigAutoField(primary_key=True)
+    id_usuario = models.ForeignKey(
+        'core.Usuario', db_column='id_usuario',
+        on_delete=models.CASCADE, related_name='terminos_chat'
+    )
+    termino = models.CharField(max_length=64)
+    id_mensaje = models.IntegerField()
+    id_conversacion = models.IntegerField()
+
+    class Meta:
+        db_table = 'mensaje_termino'
+        constraints = [
+            models.UniqueConstraint(fields=['id_usuario', 'termino', 'id_mensaje'], name='uq_mensaje_termino'),
+        ]
+        indexes = [models.Index(fields=['id_conversacion'], name='ix_mensaje_termino_conv')]
+
+
+class ReservaLibro(models.Model):
+    """
+    Ledger de reservas: qué compromete hoy a cada libro (oferta pendiente,
+    solicitud pendiente, intercambio activo). Único por (libro, rol, clave):
+    clave=0 en los roles exclusivos, id del solicitante en SOLICITUD.
+    Lo escriben las transiciones (helpers_reservas.py); `reconcile_negociacion`
+    lo recalcula.
+    """
+    id = models.BigAutoField(primary_key=True)
+    id_libro = models.ForeignKey(
+        'market.Libro', db_column='id_libro',
+        on_delete=models.CASCADE, related_name='reservas'
+    )
+    rol = models.CharField(max_length=12)
+    clave = models.IntegerField(default=0)
+    id_solicitud = models.IntegerField()
+    creado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'reserva_libro'
+        constraints = [
+            models.UniqueConstraint(fields=['id_libro', 'rol', 'clave'], name='uq_reserva_libro_rol'),
+        ]
+        indexes = [models.Index(fields=['id_solicitud'], name='ix_reserva_solicitud')]
+
+
+class EventoIntercambio(models.Model):
+    """
+    Bitácora append-only (outbox) del ciclo de vida de solicitudes/intercambios.
+    Se escribe en la MISMA transacción que la transición (helpers_eventos.emitir);
+    los consumidores la leen por id con un checkpoint en ConsumidorEventos.
+    """
+    id = models.BigAutoField(primary_key=True)
+    tipo = models.CharField(max_length=32)
+    id_solicitud = models.IntegerField(null=True, blank=True)
+    id_intercambio = models.IntegerField(null=True, blank=True)
+    id_actor = models.IntegerField(null=True, blank=True)
+    datos = models.JSONField(default=dict, blank=True)
+    creado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'evento_intercambio'
+        indexes = [models.Index(fields=['id_solicitud'], name='ix_evento_solicitud')]
+
+
+class ConsumidorEventos(models.Model):
+    """
+    Checkpoint por consumidor: último evento_intercambio.id procesado y los ids
+    menores aún no vistos (huecos: {id: epoch de detección}, ver helpers_eventos).
+    """
+    nombre = models.CharField(max_length=64, primary_key=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    huecos = models.JSONField(default=dict, blank=True)
+    procesados = models.BigIntegerField(default=0)
+    actualizado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'evento_consumidor'
+
+
+class TituloPopularidad(models.Model):
+    """
+    Ranking de títulos más intercambiados (ver helpers_populares.py).
+    - clave: título normalizado (strip + sin tildes + casefold, ver clave_titulo)
+    - total_intercambios: intercambios completados (ambos roles)
+    - repeticiones: copias disponibles con ese título
+    """
+    clave = models.CharField(max_length=255, primary_key=True)
+    titulo = models.CharField(max_length=255)
+    total_intercambios = models.PositiveIntegerField(default=0)
+    repeticiones = models.PositiveIntegerField(default=0)
+    actualizado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'titulo_popularidad'
+        indexes = [
+            models.Index(fields=['-total_intercambios', 'titulo'], name='ix_titulo_popularidad_top'),
+        ]
+
+
+class BandejaChat(models.Model):
+    """
+    Bandeja de chats por (usuario, conversación), desnormalizada para que
+    lista_conversaciones sea un solo scan indexado y paginado.
+    La mantienen enviar_mensaje / marcar_visto / transiciones de la
+    solicitud/intercambio (ver helpers_bandeja.py); `rebuild_bandeja` la recalcula.
+    """
+    id = models.BigAutoField(primary_key=True)
+    id_usuario = models.ForeignKey(
+        'core.Usuario', db_column='id_usuario',
+        on_delete=models.CASCADE, related_name='bandeja_chats'
+    )
+    id_conversacion = models.ForeignKey(
+        'market.Conversacion', db_column='id_conversacion',
+        on_delete=models.CASCADE, related_name='bandeja'
+    )
+    rol = models.CharField(max_length=20, null=True, blank=True)
+    archivado = models.BooleanField(default=False)
+
+    otro_usuario_id = models.IntegerField(null=True, blank=True)
+    otro_nombre_usuario = models.CharField(max_length=255, null=True, blank=True)
+    otro_nombres = models.CharField(max_length=255, null=True, blank=True)
+    otro_imagen_perfil = models.CharField(max_length=255, null=True, blank=True)
+
+    titulo = models.CharField(max_length=255, null=True, blank=True)  # conversacion.titulo
+    id_intercambio = models.IntegerField(null=True, blank=True)
+    intercambio_estado = models.CharField(max_length=20, null=True, blank=True)
+    libro_solicitado_titulo = models.CharField(max_length=255, null=True, blank=True)
+    libro_ofrecido_titulo = models.CharField(max_length=255, null=True, blank=True)
+
+    ultimo_id_mensaje = models.IntegerField(default=0)
+    ultimo_mensaje = models.CharField(max_length=255, null=True, blank=True)
+    ultimo_enviado_en = models.DateTimeField(default=timezone.now)
+    no_leidos = models.PositiveIntegerField(default=0)
+    actualizado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'bandeja_chat'
+        constraints = [
+            models.UniqueConstraint(fields=['id_usuario', 'id_conversacion'], name='uq_bandeja_usuario_conv'),
+        ]
+        indexes = [
+            models.Index(fields=['id_usuario', 'archivado', '-ultimo_enviado_en', '-id_conversacion'],
+                         name='ix_bandeja_usuario'),
+        ]
+
+
+class ContadorUsuario(models.Model):
+    """
+    Contadores por usuario para los badges de la app (GET /api/me/badges/):
+    - chat_no_leidos: suma de bandeja_chat.no_leidos (no archivadas)
+    - solicitudes_no_vistas: recibidas Pendiente/Aceptada con id > solicitudes_visto_hasta
+    - solicitudes_visto_hasta: mayor id_solicitud recibido que el usuario ya vio
+    - solicitudes_version: +1 por cada evento sobre una solicitud suya (validador
+      ETag de los listados de solicitudes, helpers_etag)
+    Mantenidos en helpers_badges.py; `reconcile_badges` corrige deriva.
+    """
+    id_usuario = models.OneToOneField(
+        'core.Usuario', db_column='id_usuario',
+        on_delete=models.CASCADE, primary_key=True, related_name='contadores'
+    )
+    chat_no_leidos = models.PositiveIntegerField(default=0)
+    solicitudes_no_vistas = models.PositiveIntegerField(default=0)
+    solicitudes_visto_hasta = models.PositiveIntegerField(default=0)
+    solicitudes_version = models.PositiveBigIntegerField(default=0)
+    actualizado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'usuario_contadores'
@@ -1,14 +1,14 @@
 from django.conf import settings
-from django.db.models import Q
 from rest_framework import serializers
 from django.conf import settings
 
 from .models import (
     Libro, ImagenLibro, Genero, SolicitudIntercambio, SolicitudOferta,
-    PuntoEncuentro, PropuestaEncuentro, Intercambio, ReportePublicacion
+    PuntoEncuentro, PropuestaEncuentro, ReportePublicacion
 )
 from core.serializers import UsuarioLiteSerializer
 from .constants import SOLICITUD_ESTADO, INTERCAMBIO_ESTADO
+from .helpers_imagenes import variante, size_pedido
 
 
 class GeneroSerializer(serializers.ModelSerializer):
@@ -51,44 +51,21 @@ class LibroSerializer(serializers.ModelSerializer):
     # --- NUEVO ---
     def get_first_image(self, obj):
         """
-        Usa anotación obj.first_image si viene; si no, calcula:
-        1) portada; 2) primera por orden; 3) fallback 'books/librodefecto.png'.
+        Usa anotación obj.first_image si viene; si no, la columna libro.portada
+        (ya resuelta al subir/editar/borrar imágenes). Sin consultas extra.
         Siempre retorna URL absoluta con media_abs().
+        Tamaño: ?img= si viene; si no, context['img_size'] (los listados pasan
+        "card"); sin ninguno, la variante grande (detalle).
         """
         request = self.context.get('request')
-
-        # 0) si viene anotado desde el queryset
-        rel = getattr(obj, 'first_image', None)
-        if rel:
-            return media_abs(request, str(rel).replace('\\', '/'))
-
-        # 1) portada explícita
-        rel = (ImagenLibro.objects
-               .filter(id_libro=obj, is_portada=True)
-               .order_by('id_imagen')
-               .values_list('url_imagen', flat=True)
-               .first())
-
-        # 2) primera por orden
-        if not rel:
-            rel = (ImagenLibro.objects
-                   .filter(id_libro=obj)
-                   .order_by('orden', 'id_imagen')
-                   .values_list('url_imagen', flat=True)
-                   .first())
-
-        return media_abs(request, (rel or '').replace('\\', '/'))
+        rel = getattr(obj, 'first_image', None) or getattr(obj, 'portada', None)
+        size = size_pedido(request, self.context.get('img_size'))
+        return media_abs(request, (rel or '').replace('\\', '/'), size)
 
     # ... (lo demás tal cual)
     def get_en_negociacion(self, obj):
-        v = getattr(obj, 'en_negociacion', None)
-        if v is not None:
-            return bool(v)
-        return Intercambio.objects.filter(
-            Q(id_libro_ofrecido_aceptado_id=obj.id_libro) |
-            Q(id_solicitud__id_libro_deseado_id=obj.id_libro),
-            estado_intercambio__in=['Pendiente', 'Aceptado'],
-        ).exists()
+        # columna libro.en_negociacion (mantenida en las transiciones)
+        return bool(getattr(obj, 'en_negociacion', False))
 
     def get_public_disponible(self, obj):
         v = getattr(obj, 'public_disponible', None)
@@ -178,19 +155,11 @@ class LibroSimpleSerializer(serializers.ModelSerializer):
         fields = ['id_libro', 'titulo', 'autor', 'first_image'] # <-- AÑADIDO 'first_image'
 
     def get_first_image(self, obj):
-        # obj es la instancia de Libro
-        # obj.imagenes.all() usará los datos de prefetch que cargamos en la vista
-        try:
-            # Intenta obtener la primera imagen (ya viene ordenada por el prefetch)
-            primera_imagen = obj.imagenes.all()[0]
-            rel = str(primera_imagen.url_imagen).replace('\\', '/')
-        except (AttributeError, IndexError):
-            # Si no hay imagen en el prefetch o la lista está vacía
-            rel = None # Usará el default
-
+        # obj es la instancia de Libro; la portada ya viene resuelta en libro.portada
+        rel = (getattr(obj, 'portada', None) or '').replace('\\', '/') or None
         request = self.context.get('request')
-        # Llama a la función helper 'media_abs' que está al final de tu serializers.py
-        return media_abs(request, rel)
+        size = self.context.get('img_size') or size_pedido(request, "thumb")
+        return media_abs(request, rel, size)
 
 
 class SolicitudOfertaSerializer(serializers.ModelSerializer):
@@ -346,7 +315,7 @@ class PropuestaEncuentroSerializer(serializers.ModelSerializer):
         model = PropuestaEncuentro
         fields = "__all__"
 
-def media_abs(request, rel: str | None = None) -> str:
+def media_abs(request, rel: str | None = None, size: str | None = None) -> str:
     rel = (rel or "books/librodefecto.png").strip()
     if rel.startswith(("http://", "https://")):
         return rel
@@ -354,6 +323,7 @@ def media_abs(request, rel: str | None = None) -> str:
     rel = rel.lstrip("/").replace("\\", "/")
     if rel.startswith("media/"):
         rel = rel[len("media/"):]
+    rel = variante(rel, size)  # thumb/card/full si la imagen tiene derivados
     mu = str(getattr(settings, "MEDIA_URL", "/media/")).strip()
 
     # MEDIA_URL absoluto
@@ -1,3 +1,421 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import Comuna, Region, Usuario
+from . import helpers_eventos
+from .busqueda import indexar_libro
+from .helpers_archivo import archivar_conversacion
+from .helpers_bandeja import bandeja_mensaje
+from .helpers_chat import insertar_mensaje
+from .models import (
+    BandejaChat, ConsumidorEventos, Conversacion, ConversacionMensaje, EventoIntercambio, Genero,
+    Intercambio, Libro, ReservaLibro, SolicitudIntercambio,
+)
+
+# Correr con: python manage.py test market --settings=api.settings_test
+
+
+def crear_usuario(n, comuna):
+    return Usuario.objects.create(
+        rut=f"{n}", nombres=f"U{n}", apellido_paterno="P", apellido_materno="M",
+        nombre_usuario=f"u{n}", email=f"u{n}@x.cl", telefono="1", direccion="d", numeracion="1",
+        comuna=comuna, contrasena="x", fecha_registro=timezone.now().date(), activo=True,
+    )
+
+
+def crear_libro(usuario, genero, titulo="Libro"):
+    return Libro.objects.create(
+        titulo=titulo, isbn="1", anio_publicacion=2000, autor="Autor", estado="Usado",
+        descripcion="d", editorial="Ed", tipo_tapa="Blanda", id_usuario=usuario,
+        id_genero=genero, fecha_subida=timezone.now(),
+    )
+
+
+class MyBooksWithHistoryTests(TestCase):
+    """my_books_with_history: consultas constantes y top-N por libro en SQL (user-009)."""
+
+    URL = "/api/books/mine-with-history/"
+    CONSULTAS = 9  # usuario, ids, 2x completados, 2x contadores, historial (2 roles), libros
+
+    @classmethod
+    def setUpTestData(cls):
+        comuna = Comuna.objects.create(nombre="Stgo", id_region=Region.objects.create(nombre="RM"))
+        cls.genero = Genero.objects.create(nombre="Novela")
+        cls.duenio = crear_usuario(1, comuna)
+        cls.otros = [crear_usuario(n, comuna) for n in range(2, 6)]
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def _poblar(self, libros, solicitudes_por_libro):
+        propios = [crear_libro(self.duenio, self.genero, f"Mío {i}") for i in range(libros)]
+        ajenos = [crear_libro(u, self.genero, f"De {u.pk}") for u in self.otros]
+        ahora = timezone.now()
+        for libro in propios:
+            for k in range(solicitudes_por_libro):
+                u = self.otros[k % len(self.otros)]
+                si = SolicitudIntercambio.objects.create(
+                    id_usuario_solicitante=u, id_usuario_receptor=self.duenio, id_libro_deseado=libro,
+                    estado="Rechazada", creada_en=ahora - timezone.timedelta(minutes=k), actualizada_en=ahora,
+                )
+                if k % 3 == 0:
+                    Intercambio.objects.create(id_solicitud=si, id_libro_ofrecido_aceptado=ajenos[k % len(ajenos)],
+                                               estado_intercambio="Completado", fecha_completado=ahora)
+            # también como libro ofrecido aceptado en solicitudes ajenas
+            for k, u in enumerate(self.otros):
+                si = SolicitudIntercambio.objects.create(
+                    id_usuario_solicitante=self.duenio, id_usuario_receptor=u, id_libro_deseado=ajenos[k],
+                    estado="Aceptada", creada_en=ahora, actualizada_en=ahora,
+                )
+                Intercambio.objects.create(id_solicitud=si, id_libro_ofrecido_aceptado=libro,
+                                           estado_intercambio="Aceptado")
+        return propios
+
+    def test_numero_de_consultas_fijo(self):
+        self._poblar(libros=2, solicitudes_por_libro=3)
+        with self.assertNumQueries(self.CONSULTAS):
+            self.client.get(self.URL, {"user_id": self.duenio.pk, "limit": 3})
+
+    def test_consultas_no_crecen_con_el_historial(self):
+        self._poblar(libros=6, solicitudes_por_libro=25)
+        with self.assertNumQueries(self.CONSULTAS):
+            self.client.get(self.URL, {"user_id": self.duenio.pk, "limit": 3})
+
+    def test_filas_acotadas_por_libro(self):
+        limit = 4
+        propios = self._poblar(libros=3, solicitudes_por_libro=20)
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(self.URL, {"user_id": self.duenio.pk, "limit": limit})
+        self.assertEqual(resp.status_code, 200)
+
+        data = resp.json()
+        self.assertEqual(len(data), len(propios))
+        for libro in data:
+            self.assertEqual(len(libro["history"]), limit)
+            # los contadores siguen cubriendo TODO el historial
+            self.assertEqual(libro["counters"]["total"], 20 + len(self.otros))
+
+        # Las consultas de historial (ROW_NUMBER) no traen más de `limit` filas por libro y rol,
+        # aunque cada libro tenga 20 solicitudes + 4 intercambios.
+        ventanas = [q["sql"] for q in ctx.captured_queries if "ROW_NUMBER" in q["sql"].upper()]
+        self.assertEqual(len(ventanas), 2)
+        for sql in ventanas:
+            with connection.cursor() as cur:
+                cur.execute(sql)
+                filas = cur.fetchall()
+            self.assertLessEqual(len(filas), limit * len(propios))
+
+
+class FlujoTestCase(TestCase):
+    """Usuarios y libros de base + atajos a los endpoints de solicitudes y chat."""
+
+    @classmethod
+    def setUpTestData(cls):
+        comuna = Comuna.objects.create(nombre="Stgo", id_region=Region.objects.create(nombre="RM"))
+        cls.genero = Genero.objects.create(nombre="Novela")
+        cls.u1, cls.u2, cls.u3, cls.u4 = [crear_usuario(n, comuna) for n in range(1, 5)]
+
+    def setUp(self):
+        cache.clear()  # caché de respuestas (locmem) compartida entre tests
+        self.client = APIClient()
+
+    def crear(self, solicitante, deseado, ofrecido):
+        return self.client.post("/api/solicitudes/crear/", {
+            "id_usuario_solicitante": solicitante.pk,
+            "id_libro_deseado": deseado.pk,
+            "id_libros_ofrecidos": [ofrecido.pk],
+        }, format="json")
+
+    def aceptar(self, solicitud_id, receptor, libro):
+        return self.client.post(f"/api/solicitudes/{solicitud_id}/aceptar/",
+                                {"user_id": receptor.pk, "id_libro_aceptado": libro.pk}, format="json")
+
+    def conversacion(self, solicitante, receptor, titulo="Libro"):
+        """Solicitud aceptada -> id de su conversación (con la bandeja ya al día)."""
+        deseado = crear_libro(receptor, self.genero, f"{titulo} de {receptor.pk}")
+        ofrecido = crear_libro(solicitante, self.genero, f"{titulo} de {solicitante.pk}")
+        sid = self.crear(solicitante, deseado, ofrecido).json()["id_solicitud"]
+        self.assertEqual(self.aceptar(sid, receptor, ofrecido).status_code, 200)
+        helpers_eventos.procesar_todos()
+        return Conversacion.objects.get(id_intercambio__id_solicitud_id=sid).pk
+
+    def enviar(self, conv_id, emisor, cuerpo):
+        return self.client.post(f"/api/chat/conversacion/{conv_id}/enviar/",
+                                {"id_usuario_emisor": emisor.pk, "cuerpo": cuerpo}, format="json")
+
+
+class KeysetTests(FlujoTestCase):
+    """Bordes de la paginación por cursor: mensajes (before/after) y búsqueda del catálogo."""
+
+    def test_mensajes_before_after(self):
+        conv = self.conversacion(self.u1, self.u2)
+        ids = [self.enviar(conv, self.u1, f"m{i}").json()["id_mensaje"] for i in range(5)]
+        url = f"/api/chat/conversacion/{conv}/mensajes/"
+
+        def pagina(**params):
+            resp = self.client.get(url, params)
+            self.assertEqual(resp.status_code, 200)
+            return [m["id_mensaje"] for m in resp.json()], resp["X-Has-More"]
+
+        self.assertEqual(pagina(limit=2), (ids[3:], "1"))
+        self.assertEqual(pagina(limit=2, before_id=ids[3]), (ids[1:3], "1"))
+        self.assertEqual(pagina(limit=2, before_id=ids[1]), (ids[:1], "0"))
+        self.assertEqual(pagina(limit=2, after=ids[0]), (ids[1:3], "1"))
+        self.assertEqual(pagina(limit=2, after=ids[2]), (ids[3:], "0"))
+        self.assertEqual(pagina(limit=2, after=ids[-1]), ([], "0"))
+        self.assertEqual(pagina(), (ids, "0"))  # sin limit: historial completo
+        self.assertEqual(self.client.get(url, {"before_id": ids[2], "after": ids[0]}).status_code, 400)
+
+    def test_busqueda_recorre_todo_sin_repetir(self):
+        libros = [crear_libro(self.u1, self.genero, f"Dune {i}") for i in range(4)]
+        crear_libro(self.u1, self.genero, "Otro título")
+        for libro in Libro.objects.all():
+            indexar_libro(libro.pk)
+
+        vistos, cursor, paginas = [], None, 0
+        while True:
+            params = {"query": "dune", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            resp = self.client.get("/api/libros/", params)
+            self.assertEqual(resp.status_code, 200)
+            vistos += [b["id_libro"] for b in resp.json()]
+            cursor = resp.get("X-Next-Cursor")
+            paginas += 1
+            if not cursor:
+                break
+        # 4 resultados en páginas de 2: la tercera llega vacía y sin cursor
+        self.assertEqual(paginas, 3)
+        self.assertEqual(sorted(vistos), sorted(b.pk for b in libros))
+
+
+class SinceTests(FlujoTestCase):
+    """?since= de los listados de solicitudes: cambios + lápidas de lo que sale de la ventana."""
+
+    URL = "/api/solicitudes/recibidas/"
+
+    def test_lapidas_y_nuevas(self):
+        deseado = crear_libro(self.u2, self.genero, "Deseado")
+        sid = self.crear(self.u1, deseado, crear_libro(self.u1, self.genero, "Ofrecido")).json()["id_solicitud"]
+        completo = self.client.get(self.URL, {"user_id": self.u2.pk})
+        self.assertEqual([s["id_solicitud"] for s in completo.json()], [sid])
+        cursor = completo["X-Sync-Cursor"]
+
+        self.client.post(f"/api/solicitudes/{sid}/rechazar/", {"user_id": self.u2.pk}, format="json")
+        nueva = self.crear(self.u3, crear_libro(self.u2, self.genero, "Otro"),
+                           crear_libro(self.u3, self.genero, "De u3")).json()["id_solicitud"]
+
+        delta = self.client.get(self.URL, {"user_id": self.u2.pk, "since": cursor}).json()
+        self.assertEqual([s["id_solicitud"] for s in delta["solicitudes"]], [nueva])
+        self.assertEqual(delta["eliminadas"], [{"id_solicitud": sid, "estado": "Rechazada"}])
+        self.assertTrue(delta["cursor"])
+
+    def test_since_invalido(self):
+        resp = self.client.get(self.URL, {"user_id": self.u2.pk, "since": "ayer"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class EtagTests(FlujoTestCase):
+    """ETag de /solicitudes/recibidas/: 304 con el mismo tag, cambia tras una escritura propia."""
+
+    URL = "/api/solicitudes/recibidas/"
+
+    def _get(self, user, etag=None):
+        extra = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(self.URL, {"user_id": user.pk}, **extra)
+
+    def test_304_e_invalidacion(self):
+        primera = self._get(self.u2)
+        self.assertEqual(primera.status_code, 200)
+        etag = primera["ETag"]
+        self.assertEqual(self._get(self.u2, etag).status_code, 304)
+        self.assertEqual(self._get(self.u2, etag.removeprefix("W/")).status_code, 304)
+        self.assertEqual(self._get(self.u2, "*").status_code, 200)
+
+        # escritura ajena (entre u3 y u4): el tag de u2 no cambia
+        self.crear(self.u3, crear_libro(self.u4, self.genero, "X"), crear_libro(self.u3, self.genero, "Y"))
+        self.assertEqual(self._get(self.u2, etag).status_code, 304)
+
+        self.crear(self.u1, crear_libro(self.u2, self.genero, "Deseado"), crear_libro(self.u1, self.genero, "Z"))
+        segunda = self._get(self.u2, etag)
+        self.assertEqual(segunda.status_code, 200)
+        self.assertNotEqual(segunda["ETag"], etag)
+        self.assertEqual(len(segunda.json()), 1)
+
+
+class ReservasTests(FlujoTestCase):
+    """Libro mayor de reservas: el UNIQUE frena un segundo compromiso del mismo libro."""
+
+    def test_doble_aceptar_la_misma_solicitud(self):
+        deseado = crear_libro(self.u2, self.genero, "Deseado")
+        ofrecido = crear_libro(self.u1, self.genero, "Ofrecido")
+        sid = self.crear(self.u1, deseado, ofrecido).json()["id_solicitud"]
+        self.assertEqual(self.aceptar(sid, self.u2, ofrecido).status_code, 200)
+        # reintento del receptor (Aceptada sigue siendo aceptable): sin filas duplicadas
+        self.assertEqual(self.aceptar(sid, self.u2, ofrecido).status_code, 200)
+        self.assertEqual(Intercambio.objects.filter(id_solicitud_id=sid).count(), 1)
+        self.assertEqual(
+            sorted(ReservaLibro.objects.values_list("id_libro_id", "rol", "id_solicitud")),
+            sorted([(deseado.pk, "INTERCAMBIO", sid), (ofrecido.pk, "INTERCAMBIO", sid)]),
+        )
+
+    def test_conflicto_con_aceptacion_concurrente(self):
+        deseado = crear_libro(self.u2, self.genero, "Deseado")
+        ofrecido = crear_libro(self.u1, self.genero, "Ofrecido")
+        sid = self.crear(self.u1, deseado, ofrecido).json()["id_solicitud"]
+        # otra aceptación comiteó antes y ya comprometió el libro ofrecido
+        ReservaLibro.objects.create(id_libro_id=ofrecido.pk, rol="INTERCAMBIO", clave=0, id_solicitud=sid + 1000)
+
+        resp = self.aceptar(sid, self.u2, ofrecido)
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(SolicitudIntercambio.objects.get(pk=sid).estado, "Pendiente")
+        self.assertFalse(Intercambio.objects.filter(id_solicitud_id=sid).exists())
+        # rollback: la solicitud conserva sus reservas de oferta/pedido
+        self.assertEqual(sorted(ReservaLibro.objects.filter(id_solicitud=sid).values_list("rol", flat=True)),
+                         ["OFERTA", "SOLICITUD"])
+
+
+class SyncMensajesTests(FlujoTestCase):
+    """POST /chat/sync/: idempotente por client_id; no leídos = sólo lo creado."""
+
+    URL = "/api/chat/sync/"
+
+    def _sync(self, emisor, mensajes):
+        resp = self.client.post(self.URL, {"id_usuario_emisor": emisor.pk, "mensajes": mensajes}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        return [(r["client_id"], r["estado"], r["id_mensaje"]) for r in resp.json()["resultados"]]
+
+    def test_reenvio_idempotente(self):
+        conv = self.conversacion(self.u1, self.u2)
+        ajena = self.conversacion(self.u3, self.u4)
+        lote = [{"client_id": c, "id_conversacion": conv, "cuerpo": c} for c in ("a", "b")]
+
+        primero = self._sync(self.u1, lote)
+        self.assertEqual([e for _, e, _ in primero], ["creado", "creado"])
+
+        segundo = self._sync(self.u1, lote + [
+            {"client_id": "c", "id_conversacion": conv, "cuerpo": "c"},
+            {"client_id": "d", "id_conversacion": ajena, "cuerpo": "d"},
+        ])
+        self.assertEqual([e for _, e, _ in segundo], ["duplicado", "duplicado", "creado", "rechazado"])
+        self.assertEqual([i for _, _, i in segundo[:2]], [i for _, _, i in primero])
+        self.assertIsNone(segundo[3][2])
+
+        self.assertEqual(ConversacionMensaje.objects.filter(id_conversacion_id=conv).count(), 3)
+        self.assertFalse(ConversacionMensaje.objects.filter(id_conversacion_id=ajena).exists())
+        fila = BandejaChat.objects.get(id_conversacion_id=conv, id_usuario=self.u2)
+        self.assertEqual(fila.no_leidos, 3)
+        self.assertEqual(fila.ultimo_id_mensaje, segundo[2][2])
+
+    def test_emisor_invalido(self):
+        resp = self.client.post(self.URL, {"mensajes": []}, format="json")
+        self.assertEqual(resp.status_code, 400)
+
+
+class ArchivoChatTests(FlujoTestCase):
+    """Conversación archivada: los mensajes se leen desde la tabla de archivo."""
+
+    def test_lectura_transparente(self):
+        conv = self.conversacion(self.u1, self.u2)
+        for i in range(3):
+            self.enviar(conv, self.u1 if i % 2 == 0 else self.u2, f"m{i}")
+        url = f"/api/chat/conversacion/{conv}/mensajes/"
+        antes = self.client.get(url).json()
+
+        Intercambio.objects.filter(conversaciones=conv).update(estado_intercambio="Completado")
+        Conversacion.objects.filter(pk=conv).update(actualizado_en=timezone.now() - timedelta(days=10))
+        self.assertEqual(archivar_conversacion(conv, dias=1), 3)
+        self.assertFalse(ConversacionMensaje.objects.filter(id_conversacion_id=conv).exists())
+
+        self.assertEqual(self.client.get(url).json(), antes)
+        resp = self.client.get(url, {"limit": 2, "before_id": antes[-1]["id_mensaje"]})
+        self.assertEqual([m["id_mensaje"] for m in resp.json()], [m["id_mensaje"] for m in antes[:2]])
+        self.assertEqual(resp["X-Has-More"], "0")
+        self.assertNotEqual(self.enviar(conv, self.u1, "tarde").status_code, 201)
+
+
+class OutboxHuecosTests(TestCase):
+    """Checkpoint de consumidores: ids salteados (aún sin comitear) se entregan al aparecer."""
+
+    NOMBRE = "test_huecos"
+
+    def setUp(self):
+        self.entregados = []
+        helpers_eventos.consumidor(self.NOMBRE)(lambda eventos: self.entregados.extend(e.pk for e in eventos))
+        self.addCleanup(helpers_eventos._CONSUMIDORES.pop, self.NOMBRE, None)
+
+    def _evento(self, pk=None):
+        return EventoIntercambio.objects.create(pk=pk, tipo="SOLICITUD_CREADA", datos={},
+                                                creado_en=timezone.now()).pk
+
+    def _procesar(self):
+        self.entregados.clear()
+        helpers_eventos.procesar(self.NOMBRE)
+        return list(self.entregados)
+
+    def test_hueco_tardio_se_entrega(self):
+        a, b, c = self._evento(), self._evento(), self._evento()
+        EventoIntercambio.objects.filter(pk=b).delete()  # b "sin comitear"
+
+        self.assertEqual(self._procesar(), [a, c])
+        cp = ConsumidorEventos.objects.get(pk=self.NOMBRE)
+        self.assertEqual((cp.ultimo_id, list(cp.huecos)), (c, [str(b)]))
+
+        self._evento(pk=b)  # comitea tarde
+        self.assertEqual(self._procesar(), [b])
+        cp.refresh_from_db()
+        self.assertEqual((cp.ultimo_id, cp.huecos), (c, {}))
+        self.assertEqual(self._procesar(), [])
+
+    def test_hueco_vencido_se_descarta(self):
+        a, b, c = self._evento(), self._evento(), self._evento()
+        EventoIntercambio.objects.filter(pk=b).delete()
+        self.assertEqual(self._procesar(), [a, c])
+
+        vencido = (timezone.now() - helpers_eventos.EVENTOS_VENTANA_HUECOS - timedelta(seconds=1)).timestamp()
+        ConsumidorEventos.objects.filter(pk=self.NOMBRE).update(huecos={str(b): vencido})
+        self._evento(pk=b)
+        self.assertEqual(self._procesar(), [])
+        self.assertEqual(ConsumidorEventos.objects.get(pk=self.NOMBRE).huecos, {})
+
+
+class BandejaTests(FlujoTestCase):
+    """Bandeja por usuario: orden y no leídos aunque los envíos se apliquen fuera de orden."""
+
+    URL = "/api/chat/{}/conversaciones/"
+
+    def _bandeja(self, user):
+        return [(c["id_conversacion"], c["ultimo_mensaje"], c["unread_count"])
+                for c in self.client.get(self.URL.format(user.pk)).json()]
+
+    def test_envios_fuera_de_orden(self):
+        c2 = self.conversacion(self.u1, self.u2, "A")
+        c3 = self.conversacion(self.u1, self.u3, "B")
+        t0 = timezone.now()
+        m1 = insertar_mensaje(c2, self.u2.pk, "uno", t0)
+        m2 = insertar_mensaje(c3, self.u3.pk, "dos", t0 + timedelta(seconds=1))
+        m3 = insertar_mensaje(c2, self.u2.pk, "tres", t0 + timedelta(seconds=2))
+        # el más nuevo de c2 comitea antes que el viejo
+        bandeja_mensaje(c2, m3, m3.enviado_en)
+        bandeja_mensaje(c3, m2, m2.enviado_en)
+        bandeja_mensaje(c2, m1, m1.enviado_en)
+
+        self.assertEqual(self._bandeja(self.u1), [(c2, "tres", 2), (c3, "dos", 1)])
+        self.assertEqual(self._bandeja(self.u2), [(c2, "tres", 0)])
+
+        self.client.post(f"/api/chat/conversacion/{c2}/visto/", {"id_usuario": self.u1.pk}, format="json")
+        self.assertEqual(self._bandeja(self.u1), [(c2, "tres", 0), (c3, "dos", 1)])
 
-# Create your tests here.
+    def test_enviar_valida_emisor(self):
+        conv = self.conversacion(self.u1, self.u2)
+        url = f"/api/chat/conversacion/{conv}/enviar/"
+        self.assertEqual(self.client.post(url, {"cuerpo": "x"}, format="json").status_code, 400)
+        self.assertEqual(self.enviar(conv, self.u3, "x").status_code, 403)
+        self.assertEqual(self.enviar(conv, self.u1, "x").status_code, 201)
+        self.assertEqual(self._bandeja(self.u2)[0][2], 1)
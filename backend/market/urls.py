@@ -3,6 +3,7 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from . import views
+from . import views_longpoll
 from market import views as market_views
 from .views import (
     # ViewSet
@@ -20,7 +21,7 @@ from .views import (
 
     # Solicitudes / Intercambios
     crear_solicitud_intercambio, listar_solicitudes_recibidas, listar_solicitudes_enviadas,
-    aceptar_solicitud, rechazar_solicitud, cancelar_solicitud,
+    aceptar_solicitud, rechazar_solicitud, cancelar_solicitud, solicitudes_bulk,
     libros_ofrecidos_ocupados,
     proponer_encuentro, confirmar_encuentro, propuesta_actual,
     generar_codigo, completar_intercambio, cancelar_intercambio,
@@ -30,7 +31,8 @@ from .views import (
     puntos_encuentro,
 
     # Chat
-    lista_conversaciones, mensajes_de_conversacion, enviar_mensaje, marcar_visto,
+    lista_conversaciones, mensajes_de_conversacion, enviar_mensaje, marcar_visto, sincronizar_mensajes,
+    buscar_en_chats,
 
     admin_dar_baja_libro,
 )
@@ -79,6 +81,7 @@ urlpatterns = [
     path('solicitudes/<int:solicitud_id>/rechazar/', rechazar_solicitud, name='solicitud_rechazar'),
     path('solicitudes/<int:solicitud_id>/cancelar/', cancelar_solicitud, name='solicitud_cancelar'),
     path('solicitudes/ofertas-ocupadas/', libros_ofrecidos_ocupados, name='libros_ofrecidos_ocupados'),
+    path('solicitudes/bulk/', solicitudes_bulk, name='solicitudes_bulk'),
 
     # ===== Intercambios (propuestas, código, completar, cancelar, calificación) =====
     path('intercambios/<int:intercambio_id>/proponer/', proponer_encuentro, name='proponer_encuentro'),
@@ -91,15 +94,21 @@ urlpatterns = [
     path('intercambios/<int:intercambio_id>/mi-calificacion/', mi_calificacion, name='mi_calificacion'),
     path("solicitudes/resumen/", views.resumen_solicitudes, name="solicitudes-resumen"),
     path("solicitudes/marcar-listado-visto/", views.marcar_listado_solicitudes_visto, name="solicitudes-marcar-visto"),
+    path("me/badges/", views.me_badges, name="me-badges"),
 
     # ===== Puntos de encuentro =====
     path('puntos-encuentro/', puntos_encuentro, name='puntos_encuentro'),
 
     # ===== Chat =====
     path('chat/<int:user_id>/conversaciones/', lista_conversaciones, name='lista_conversaciones'),
+    path('chat/<int:user_id>/buscar/', buscar_en_chats, name='buscar_en_chats'),
     path('chat/conversacion/<int:conversacion_id>/mensajes/', mensajes_de_conversacion, name='mensajes_de_conversacion'),
     path('chat/conversacion/<int:conversacion_id>/enviar/', enviar_mensaje, name='enviar_mensaje'),
     path('chat/conversacion/<int:conversacion_id>/visto/', marcar_visto, name='marcar_visto'),
+    path('chat/sync/', sincronizar_mensajes, name='sincronizar_mensajes'),  # cola offline (lotes)
+    # long-poll (clientes sin WebSocket)
+    path('chat/<int:user_id>/conversaciones/espera/', views_longpoll.conversaciones_espera, name='conversaciones_espera'),
+    path('chat/conversacion/<int:conversacion_id>/mensajes/espera/', views_longpoll.mensajes_espera, name='mensajes_espera'),
 
     path('libros/por-genero/', views.libros_por_genero, name='libros_por_genero'),
     path('libros/catalogo/', views.catalogo_completo, name='catalogo-completo'),
@@ -112,6 +121,7 @@ urlpatterns = [
     path("admin/reportes-publicacion/<int:reporte_id>/resolver/",market_views.admin_resolver_reporte_publicacion,name="admin_resolver_reporte_publicacion"),
     path( "libros/<int:libro_id>/reportar/", market_views.reportar_publicacion, name="reportar_publicacion",),
      path("admin/libros/<int:libro_id>/dar-baja/",admin_dar_baja_libro, name="admin_dar_baja_libro",),
+    path("admin/cache/stats/", market_views.admin_cache_stats, name="admin_cache_stats"),
 ]
 
 # DRF router (ViewSet /libros/…)
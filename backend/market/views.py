@@ -1,19 +1,16 @@
 
 #market/views.py
-import os
-import uuid
 from collections import defaultdict
-from datetime import date
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from typing import Optional
 
 from django.conf import settings
-from django.core.files.storage import default_storage
 from django.db import connection, transaction, IntegrityError
 from django.db.models import (
     Q, F, Value, Count, Exists, Subquery, OuterRef, Max, Avg,
-    BooleanField, Case, When
+    BooleanField, Case, When, IntegerField, Window
 )
-from django.db.models.functions import Coalesce, Greatest
+from django.db.models.functions import Coalesce, RowNumber
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.dateparse import parse_datetime
@@ -24,6 +21,8 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
 from core.permissions import IsAdminUser as IsCambiotecaAdmin
 
 from .models import (
@@ -39,8 +38,36 @@ from .serializers import (
     ReportePublicacionSerializer, AdminReportePublicacionSerializer,
 )
 from .serializers import ReportePublicacionSerializer
-from .constants import SOLICITUD_ESTADO, INTERCAMBIO_ESTADO, MEETING_METHOD, PROPOSAL_STATE, PUNTO_TIPO,STATUS_REASON
-from .helpers_estado import set_owner_unavailable
+from .constants import SOLICITUD_ESTADO, INTERCAMBIO_ESTADO, MEETING_METHOD, PROPOSAL_STATE, PUNTO_TIPO,STATUS_REASON, RESERVA_ROL, EVENTO_TIPO
+from .helpers_imagenes import guardar_imagen, borrar_imagen, variante, size_pedido
+from .helpers_estado import (
+    set_owner_unavailable, libros_de_solicitudes, recalcular_negociacion, registrar_actividad,
+    solicitudes_activas_de_libro,
+)
+from .helpers_portada import recalcular_portada
+from .helpers_reservas import reservas_de, reservar, tiene, liberar
+from .helpers_eventos import emitir
+from .busqueda import buscar_libros, parse_cursor, indexar_libro, desindexar_libro
+from .busqueda_chat import buscar_mensajes, indexar_mensajes
+from .helpers_populares import top_populares
+from .helpers_realtime import publicar_chat
+from .helpers_badges import (
+    badges, contar_solicitudes, marcar_solicitudes_vistas_hasta,
+)
+from .helpers_bandeja import (
+    bandeja_mensaje, bandeja_visto,
+    conversaciones_de_solicitudes, conversaciones_de_libro, pagina_bandeja, BANDEJA_PAGE_SIZE,
+)
+from .helpers_stream import contenido
+from .helpers_chat import (
+    insertar_mensaje, insertar_lote, mensaje_dict, pagina_mensajes, parse_limit, actualizar_escribible,
+    SYNC_MAX_LOTE, ID_CLIENTE_MAX,
+)
+from .helpers_cache import cached_response, stats as cache_stats, LIBROS, CATALOGO, PUNTOS
+from .helpers_etag import (
+    con_etag, v_libros_publicos, v_catalogo, v_populares,
+    v_solicitudes_recibidas, v_solicitudes_enviadas, v_conversaciones, v_favoritos,
+)
 
 
 
@@ -73,6 +100,17 @@ def _aplicar_baja_por_moderacion(libro_id: int):
 
     now = timezone.now()
 
+    # Libros a recalcular (en_negociacion) antes de tocar estados
+    sol_ids = (SolicitudIntercambio.objects
+               .filter(
+                   Q(id_libro_deseado_id=libro_id) |
+                   Q(ofertas__id_libro_ofrecido_id=libro_id) |
+                   Q(intercambio__id_libro_ofrecido_aceptado_id=libro_id),
+               )
+               .values_list("id_solicitud", flat=True)
+               .distinct())
+    afectados = libros_de_solicitudes(sol_ids) | {libro_id}
+
     # Cancelar intercambios activos donde participa este libro (excepto Completado)
     (Intercambio.objects
         .filter(
@@ -83,26 +121,24 @@ def _aplicar_baja_por_moderacion(libro_id: int):
         .update(estado_intercambio=INTERCAMBIO_ESTADO["CANCELADO"]))
 
     # Cancelar solicitudes donde este libro es deseado o fue ofrecido
+    canceladas = list(SolicitudIntercambio.objects
+                      .filter(
+                          Q(id_libro_deseado_id=libro_id) |
+                          Q(ofertas__id_libro_ofrecido_id=libro_id),
+                      )
+                      .exclude(estado__in=[SOLICITUD_ESTADO["RECHAZADA"], SOLICITUD_ESTADO["CANCELADA"]])
+                      .values_list("id_solicitud", flat=True)
+                      .distinct())
     (SolicitudIntercambio.objects
-        .filter(
-            Q(id_libro_deseado_id=libro_id) |
-            Q(ofertas__id_libro_ofrecido_id=libro_id),
-        )
-        .exclude(estado__in=[SOLICITUD_ESTADO["RECHAZADA"], SOLICITUD_ESTADO["CANCELADA"]])
+        .filter(pk__in=canceladas)
         .update(estado=SOLICITUD_ESTADO["CANCELADA"], actualizada_en=now))
-    
-
-
 
-portada_sq = (ImagenLibro.objects
-    .filter(id_libro=OuterRef('pk'), is_portada=True)
-    .order_by('id_imagen')
-    .values_list('url_imagen', flat=True)[:1])
+    liberar(sol_ids)
+    recalcular_negociacion(afectados)
+    actualizar_escribible(conversaciones_de_solicitudes(sol_ids))
+    # 🔔 bandeja, badges, caché y populares: consumidores de helpers_eventos
+    emitir(EVENTO_TIPO["LIBRO_BAJA"], canceladas, id_libro=libro_id, titulos=[libro.titulo])
 
-first_by_order_sq = (ImagenLibro.objects
-    .filter(id_libro=OuterRef('pk'))
-    .order_by('orden', 'id_imagen')
-    .values_list('url_imagen', flat=True)[:1])
 
 
 # Libros que el usuario YA pidió como libro_deseado
@@ -126,11 +162,12 @@ def _exclude_already_requested_by_user(qs, user_id_raw):
 
     return qs.annotate(_ya_pedido=Exists(si_sub)).filter(_ya_pedido=False)
 
-def media_abs(request, rel: str | None = None) -> str:
+def media_abs(request, rel: str | None = None, size: str | None = None) -> str:
     """
     Construye una URL ABSOLUTA a partir de una ruta relativa en MEDIA.
     Soporta MEDIA_URL relativo ('/media/') y absoluto ('https://host/media/').
     Soporta rel ya absoluto.
+    size: 'thumb' | 'card' | 'full' -> variante derivada (helpers_imagenes), si existe.
     """
     rel = (rel or "books/librodefecto.png").strip()
 
@@ -142,6 +179,7 @@ def media_abs(request, rel: str | None = None) -> str:
     rel = rel.lstrip("/").replace("\\", "/")
     if rel.startswith("media/"):
         rel = rel[len("media/"):]
+    rel = variante(rel, size)
 
     # 2) Lee MEDIA_URL
     mu = str(getattr(settings, "MEDIA_URL", "/media/")).strip()
@@ -160,74 +198,40 @@ def media_abs(request, rel: str | None = None) -> str:
 
 
 def _save_book_image(file_obj) -> str:
-    try:
-        file_obj.seek(0)
-    except Exception:
-        pass
-
-    original = getattr(file_obj, "name", "book")
-    ext = os.path.splitext(original)[1].lower() or ".jpg"
-    rel_path = f"books/{uuid.uuid4().hex}{ext}"
-
-    try:
-        base_str = str(settings.MEDIA_ROOT)
-        os.makedirs(os.path.join(base_str, "books"), exist_ok=True)
-    except Exception:
-        pass
-
-    saved_rel = default_storage.save(rel_path, file_obj)
-    return str(saved_rel).replace("\\", "/")
+    """
+    Guarda la imagen en MEDIA/books/ con sus derivados (thumb/card/full, JPEG+WebP,
+    sin EXIF) y devuelve la ruta relativa de la variante base.
+    """
+    return guardar_imagen(file_obj, "books")
 
 
 # =========================
 # Libros (read-only) — en_negociacion = intercambios activos O pendiente saliente
+# (columna libro.en_negociacion, mantenida por helpers_estado.recalcular_negociacion)
 # =========================
 
-# Intercambios activos (Pendiente/Aceptado) donde participa el libro (cualquiera de los roles)
-# Intercambios activos (Pendiente/Aceptado) donde participa el libro (cualquiera de los roles)
-intercambio_activo_ix = Exists(
-    Intercambio.objects.filter(
-        Q(id_libro_ofrecido_aceptado=OuterRef('pk')) |
-        Q(id_solicitud__id_libro_deseado=OuterRef('pk'))
-    ).filter(
-        Q(estado_intercambio__iexact=INTERCAMBIO_ESTADO["PENDIENTE"]) |
-        Q(estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"])
-    )
-)
-
-# Pendiente SALIENTE: el dueño ofreció este libro en una solicitud PENDIENTE
-pendiente_saliente_ix = Exists(
-    SolicitudOferta.objects.filter(
-        id_libro_ofrecido_id=OuterRef('pk'),
-        id_solicitud__id_usuario_solicitante_id=OuterRef('id_usuario_id'),
-    ).filter(
-        id_solicitud__estado__iexact=SOLICITUD_ESTADO["PENDIENTE"]
-    )
-)
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 200
+IMG_LISTADO = "card"  # variante de first_image en listados (?img= la cambia)
 
 
 class LibroViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = LibroSerializer
     permission_classes = [permissions.AllowAny]
+    search_next_cursor = None
 
     def get_queryset(self):
         qs = (
             Libro.objects
             .select_related('id_usuario', 'id_genero')
-            .annotate(_ix=intercambio_activo_ix, _sal=pendiente_saliente_ix)
             .annotate(
-                en_negociacion=Case(
-                    When(Q(_ix=True) | Q(_sal=True), then=Value(True)),
-                    default=Value(False),
-                    output_field=BooleanField(),
-                ),
                 public_disponible=Case(
                     When(disponible=True, en_negociacion=False, then=Value(True)),
                     default=Value(False),
                     output_field=BooleanField(),
                 ),
-                # 👇 clave: traer primera imagen ya resuelta
-                first_image=Coalesce(Subquery(portada_sq), Subquery(first_by_order_sq), Value(''))
+                # 👇 clave: portada ya resuelta en libro.portada
+                first_image=Coalesce(F('portada'), Value(''))
             )
             .all()
             .order_by('-id_libro')
@@ -235,26 +239,46 @@ class LibroViewSet(viewsets.ReadOnlyModelViewSet):
 
         q = self.request.query_params.get('query')
         if q:
-            qs = qs.filter(
-                Q(titulo__icontains=q) |
-                Q(autor__icontains=q) |
-                Q(id_genero__nombre__icontains=q)
+            # Índice de búsqueda (market/busqueda.py): relevancia + keyset (?cursor=).
+            # Sin ?limit= ni ?cursor= se devuelven todos los resultados (clientes previos).
+            params = self.request.query_params
+            limit = cursor = None
+            if 'limit' in params or 'cursor' in params:
+                try:
+                    limit = int(params.get('limit') or SEARCH_PAGE_SIZE)
+                except (TypeError, ValueError):
+                    limit = SEARCH_PAGE_SIZE
+                limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+                cursor = parse_cursor(params.get('cursor'))
+
+            ids, self.search_next_cursor = buscar_libros(q, limit=limit, cursor=cursor)
+            qs = qs.filter(pk__in=ids).order_by(
+                Case(*[When(pk=pk, then=Value(pos)) for pos, pk in enumerate(ids)],
+                     default=Value(len(ids)), output_field=IntegerField())
             )
         return qs
 
+    def get_serializer_context(self):
+        ctx = super().get_serializer_context()
+        if self.action != "retrieve":
+            ctx["img_size"] = IMG_LISTADO  # el detalle conserva la variante grande
+        return ctx
+
+    def list(self, request, *args, **kwargs):
+        resp = super().list(request, *args, **kwargs)
+        # Siguiente página de la búsqueda (mismo formato de lista para el front)
+        next_cursor = getattr(self, 'search_next_cursor', None)
+        if next_cursor:
+            resp['X-Next-Cursor'] = next_cursor
+        return resp
+
     @action(detail=False, methods=['get'])
+    @con_etag(v_libros_publicos)
+    @cached_response(LIBROS)
     def latest(self, request):
         qs = (
             Libro.objects
             .select_related('id_usuario', 'id_genero')
-            .annotate(_ix=intercambio_activo_ix, _sal=pendiente_saliente_ix)
-            .annotate(
-                en_negociacion=Case(
-                    When(Q(_ix=True) | Q(_sal=True), then=Value(True)),
-                    default=Value(False),
-                    output_field=BooleanField(),
-                )
-            )
             .filter(disponible=True, en_negociacion=False)
             .order_by('-fecha_subida', '-id_libro')[:10]
         )
@@ -266,57 +290,24 @@ class LibroViewSet(viewsets.ReadOnlyModelViewSet):
 
         qs = qs[:10]
 
-        data = LibroSerializer(qs, many=True, context={'request': request}).data
+        data = LibroSerializer(qs, many=True, context={'request': request, 'img_size': IMG_LISTADO}).data
         return Response(data)
 
 
     @action(detail=False, methods=['get'])
+    @con_etag(v_populares)
+    @cached_response(LIBROS)
     def populares(self, request):
-        # 1) Conteo de intercambios completados por TÍTULO (sumando ambos roles)
-        qs_aceptado = (
-            Intercambio.objects
-            .filter(estado_intercambio='Completado')
-            .values(title=F('id_libro_ofrecido_aceptado__titulo'))
-            .annotate(n=Count('id_intercambio'))
-        )
-        qs_deseado = (
-            Intercambio.objects
-            .filter(estado_intercambio='Completado')
-            .values(title=F('id_solicitud__id_libro_deseado__titulo'))
-            .annotate(n=Count('id_intercambio'))
-        )
-
-        acc = {}
-        display_map = {}
-
-        def key_of(t):
-            t = (t or '').strip()
-            return t.casefold() if t else '(sin título)'
-
-        for row in qs_aceptado:
-            t = row['title'] or '(sin título)'
-            k = key_of(t)
-            acc[k] = acc.get(k, 0) + int(row['n'] or 0)
-            display_map.setdefault(k, (t or '(sin título)').strip())
-
-        for row in qs_deseado:
-            t = row['title'] or '(sin título)'
-            k = key_of(t)
-            acc[k] = acc.get(k, 0) + int(row['n'] or 0)
-            display_map.setdefault(k, (t or '(sin título)').strip())
-
-        top_keys = sorted(acc.keys(), key=lambda k: (-acc[k], display_map[k]))[:10]
-
-        out = []
-        for k in top_keys:
-            title = display_map[k]
-            repeticiones = Libro.objects.filter(titulo__iexact=title, disponible=True).count()
-            out.append({
-                "titulo": title,
-                "total_intercambios": acc[k],
-                "repeticiones": int(repeticiones),
-            })
-
+        # Ranking materializado (titulo_popularidad): una lectura top-K indexada.
+        # Se mantiene en completar_intercambio / rebuild_populares.
+        out = [
+            {
+                "titulo": row["titulo"],
+                "total_intercambios": int(row["total_intercambios"]),
+                "repeticiones": int(row["repeticiones"]),
+            }
+            for row in top_populares(10)
+        ]
         return Response(out)
 
 
@@ -326,6 +317,8 @@ class LibroViewSet(viewsets.ReadOnlyModelViewSet):
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@con_etag(v_libros_publicos)
+@cached_response(LIBROS)
 def libros_por_genero(request):
     try:
         genero_id = int(request.query_params.get("id_genero"))
@@ -335,14 +328,6 @@ def libros_por_genero(request):
     qs = (
         Libro.objects
         .select_related('id_usuario', 'id_genero')
-        .annotate(_ix=intercambio_activo_ix, _sal=pendiente_saliente_ix)
-        .annotate(
-            en_negociacion=Case(
-                When(Q(_ix=True) | Q(_sal=True), then=Value(True)),
-                default=Value(False),
-                output_field=BooleanField(),
-            )
-        )
         .filter(
             id_genero_id=genero_id,
             disponible=True,
@@ -360,13 +345,14 @@ def libros_por_genero(request):
 
     qs = qs[:20]  # solo dejamos el límite
 
-    data = LibroSerializer(qs, many=True, context={'request': request}).data
+    data = LibroSerializer(qs, many=True, context={'request': request, 'img_size': IMG_LISTADO}).data
     return Response(data)
 
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@cached_response(CATALOGO, timeout=60 * 60)
 def catalog_generos(request):
     qs = Genero.objects.all().order_by("nombre")
     return Response(GeneroSerializer(qs, many=True).data)
@@ -451,6 +437,9 @@ def upload_image(request, libro_id: int):
             if kwargs.get("is_portada"):
                 ImagenLibro.objects.filter(id_libro=libro).update(is_portada=False)
             img = ImagenLibro.objects.create(**kwargs)
+            recalcular_portada([libro.id_libro])
+            emitir(EVENTO_TIPO["LIBRO_ACTUALIZADO"], solicitudes_activas_de_libro(libro.id_libro),
+                   id_libro=libro.id_libro, campos=["imagenes"])
 
         return Response({
             "id_imagen": getattr(img, "id_imagen", None),
@@ -520,7 +509,11 @@ def update_image(request, imagen_id: int):
         changed = True
 
     if changed:
-        img.save()
+        with transaction.atomic():
+            img.save()
+            recalcular_portada([img.id_libro_id])
+            emitir(EVENTO_TIPO["LIBRO_ACTUALIZADO"], solicitudes_activas_de_libro(img.id_libro_id),
+                   id_libro=img.id_libro_id, campos=["imagenes"])
 
     rel = (img.url_imagen or "").replace("\\", "/")
     return Response({
@@ -547,14 +540,15 @@ def delete_image(request, imagen_id: int):
         )
 
     rel = (img.url_imagen or "").replace("\\", "/")
+    libro_id = img.id_libro_id
     try:
-        img.delete()
+        with transaction.atomic():
+            img.delete()
+            recalcular_portada([libro_id])
+            emitir(EVENTO_TIPO["LIBRO_ACTUALIZADO"], solicitudes_activas_de_libro(libro_id),
+                   id_libro=libro_id, campos=["imagenes"])
     finally:
-        try:
-            if rel:
-                default_storage.delete(rel)
-        except Exception:
-            pass
+        borrar_imagen(rel)
     return Response(status=204)
 
 
@@ -583,20 +577,23 @@ def create_book(request):
         dt = timezone.now()
 
     try:
-        libro = Libro.objects.create(
-            titulo=data["titulo"],
-            isbn=str(data["isbn"]),
-            anio_publicacion=int(data["anio_publicacion"]),
-            autor=data["autor"],
-            estado=data["estado"],
-            descripcion=data["descripcion"],
-            editorial=data["editorial"],
-            tipo_tapa=data["tipo_tapa"],
-            id_usuario_id=int(data["id_usuario"]),
-            id_genero_id=int(data["id_genero"]),
-            disponible=bool(data.get("disponible", True)),
-            fecha_subida=dt,
-        )
+        with transaction.atomic():
+            libro = Libro.objects.create(
+                titulo=data["titulo"],
+                isbn=str(data["isbn"]),
+                anio_publicacion=int(data["anio_publicacion"]),
+                autor=data["autor"],
+                estado=data["estado"],
+                descripcion=data["descripcion"],
+                editorial=data["editorial"],
+                tipo_tapa=data["tipo_tapa"],
+                id_usuario_id=int(data["id_usuario"]),
+                id_genero_id=int(data["id_genero"]),
+                disponible=bool(data.get("disponible", True)),
+                fecha_subida=dt,
+            )
+            indexar_libro(libro.id_libro)
+            emitir(EVENTO_TIPO["LIBRO_CREADO"], id_libro=libro.id_libro, titulos=[libro.titulo])
         return Response({"id": libro.id_libro}, status=201)
     except Exception as e:
         return Response({"detail": f"No se pudo crear: {e}"}, status=400)
@@ -613,29 +610,13 @@ def my_books(request):
     if not user_id:
         return Response({"detail": "Falta user_id"}, status=400)
 
-    # --- NUEVO: reusa flags de negociación para anotar ---
+    # en_negociacion ya viene como columna de libro
     qs_base = (Libro.objects
                .filter(id_usuario_id=user_id)
-               .select_related("id_genero", "id_usuario")
-               .annotate(_ix=intercambio_activo_ix, _sal=pendiente_saliente_ix)
-               .annotate(
-                   en_negociacion=Case(
-                       When(Q(_ix=True) | Q(_sal=True), then=Value(True)),
-                       default=Value(False),
-                       output_field=BooleanField(),
-                   )
-               ))
-
-    # Portada/primera imagen
-    portada_sq = (ImagenLibro.objects
-                  .filter(id_libro=OuterRef("pk"), is_portada=True)
-                  .order_by("id_imagen").values_list("url_imagen", flat=True)[:1])
-    first_by_order_sq = (ImagenLibro.objects
-                         .filter(id_libro=OuterRef("pk"))
-                         .order_by("orden","id_imagen").values_list("url_imagen", flat=True)[:1])
+               .select_related("id_genero", "id_usuario"))
 
     qs = (qs_base
-          .annotate(first_image=Coalesce(Subquery(portada_sq), Subquery(first_by_order_sq)))
+          .annotate(first_image=F("portada"))
           .order_by("-fecha_subida", "-id_libro"))
 
     # Comuna para todos
@@ -682,34 +663,19 @@ def my_books(request):
             Q(id_solicitud__id_libro_deseado=OuterRef("pk"))
         )
     )
-    max_ix_acc_sq = (Intercambio.objects
-                     .filter(id_libro_ofrecido_aceptado=OuterRef("pk"))
-                     .values("id_libro_ofrecido_aceptado")
-                     .annotate(m=Max("id_intercambio")).values("m")[:1])
-    max_ix_des_sq = (Intercambio.objects
-                     .filter(id_solicitud__id_libro_deseado=OuterRef("pk"))
-                     .values("id_solicitud__id_libro_deseado")
-                     .annotate(m=Max("id_intercambio")).values("m")[:1])
-    max_si_sq = (SolicitudIntercambio.objects
-                 .filter(id_libro_deseado=OuterRef("pk"))
-                 .values("id_libro_deseado")
-                 .annotate(m=Max("id_solicitud")).values("m")[:1])
+    # Novedades: libro.ultima_actividad_id vs lo último visto (columna, sin MAX por libro)
     seen_sq = (LibroSolicitudesVistas.objects
                .filter(id_usuario_id=user_id, id_libro=OuterRef("pk"))
                .values("ultimo_visto_id_intercambio")[:1])
 
     qs = (qs
           .annotate(has_si=has_si, has_ix=has_ix_any)
-          .annotate(max_ix_acc=Coalesce(Subquery(max_ix_acc_sq), Value(0)))
-          .annotate(max_ix_des=Coalesce(Subquery(max_ix_des_sq), Value(0)))
-          .annotate(max_si=Coalesce(Subquery(max_si_sq), Value(0)))
-          .annotate(max_activity_id=Greatest(F("max_ix_acc"), F("max_ix_des"), F("max_si")))
           .annotate(last_seen=Coalesce(Subquery(seen_sq), Value(0))))
 
     data = []
     for b in qs:
         img_rel = (b.first_image or "").replace("\\", "/")
-        has_new = int(getattr(b, "max_activity_id", 0) or 0) > int(getattr(b, "last_seen", 0) or 0)
+        has_new = int(b.ultima_actividad_id or 0) > int(getattr(b, "last_seen", 0) or 0)
         sr = (getattr(b, 'status_reason', None) or '').upper()
         locked = sr in ('BAJA', 'COMPLETADO')
         editable = bool(b.disponible) and not locked and (b.id_libro not in completed_any)
@@ -733,7 +699,7 @@ def my_books(request):
             "tipo_tapa": b.tipo_tapa,
             "disponible": bool(b.disponible),
             "fecha_subida": b.fecha_subida,
-            "first_image": media_abs(request, img_rel),
+            "first_image": media_abs(request, img_rel, size_pedido(request, "card")),
             "has_requests": bool(getattr(b, "has_si", False) or getattr(b, "has_ix", False)),
             "has_new_requests": bool(has_new),
             "comuna_nombre": comuna_nombre,
@@ -763,14 +729,6 @@ def my_books_with_history(request):
     except Exception:
         limit = 10
 
-    portada_sq = (ImagenLibro.objects
-                  .filter(id_libro=OuterRef("pk"), is_portada=True)
-                  .order_by("id_imagen").values_list("url_imagen", flat=True)[:1])
-
-    first_by_order_sq = (ImagenLibro.objects
-                         .filter(id_libro=OuterRef("pk"))
-                         .order_by("orden", "id_imagen").values_list("url_imagen", flat=True)[:1])
-
     has_si = Exists(SolicitudIntercambio.objects.filter(id_libro_deseado=OuterRef("pk")))
     has_ix_any = Exists(
         Intercambio.objects.filter(
@@ -779,21 +737,7 @@ def my_books_with_history(request):
         )
     )
 
-    max_ix_acc_sq = (Intercambio.objects
-                     .filter(id_libro_ofrecido_aceptado=OuterRef("pk"))
-                     .values("id_libro_ofrecido_aceptado")
-                     .annotate(m=Max("id_intercambio")).values("m")[:1])
-
-    max_ix_des_sq = (Intercambio.objects
-                     .filter(id_solicitud__id_libro_deseado=OuterRef("pk"))
-                     .values("id_solicitud__id_libro_deseado")
-                     .annotate(m=Max("id_intercambio")).values("m")[:1])
-
-    max_si_sq = (SolicitudIntercambio.objects
-                 .filter(id_libro_deseado=OuterRef("pk"))
-                 .values("id_libro_deseado")
-                 .annotate(m=Max("id_solicitud")).values("m")[:1])
-
+    # Novedades: libro.ultima_actividad_id vs lo último visto
     seen_sq = (LibroSolicitudesVistas.objects
                .filter(id_usuario_id=user_id, id_libro=OuterRef("pk"))
                .values("ultimo_visto_id_intercambio")[:1])
@@ -801,12 +745,8 @@ def my_books_with_history(request):
     qs = (Libro.objects
           .filter(id_usuario_id=user_id)
           .select_related("id_genero", "id_usuario")
-          .annotate(first_image=Coalesce(Subquery(portada_sq), Subquery(first_by_order_sq)))
+          .annotate(first_image=F("portada"))
           .annotate(has_si=has_si, has_ix=has_ix_any)
-          .annotate(max_ix_acc=Coalesce(Subquery(max_ix_acc_sq), Value(0)))
-          .annotate(max_ix_des=Coalesce(Subquery(max_ix_des_sq), Value(0)))
-          .annotate(max_si=Coalesce(Subquery(max_si_sq), Value(0)))
-          .annotate(max_activity_id=Greatest(F("max_ix_acc"), F("max_ix_des"), F("max_si")))
           .annotate(last_seen=Coalesce(Subquery(seen_sq), Value(0)))
           .order_by("-fecha_subida", "-id_libro"))
 
@@ -836,15 +776,23 @@ def my_books_with_history(request):
                        .annotate(ff=Coalesce("fecha_completado", "fecha_intercambio_pactada"))
                        .values("ff")[:1])
 
+    # Top-N por libro en SQL (ROW_NUMBER() OVER (PARTITION BY libro)): como mucho
+    # `limit` filas por libro y por rol salen de la BD; luego se mezclan y recortan.
     si_qs = (SolicitudIntercambio.objects
              .filter(id_libro_deseado_id__in=book_ids)
-             .select_related("id_usuario_solicitante", "id_libro_ofrecido_aceptado", "id_libro_deseado")
+             .select_related("id_usuario_solicitante", "id_libro_ofrecido_aceptado")
              .annotate(ix_id=Subquery(ix_for_si_id))
              .annotate(ix_estado=Subquery(ix_for_si_estado))
              .annotate(fecha_calc=Coalesce(Subquery(ix_for_si_fecha),
                                            F("fecha_intercambio_pactada"),
                                            F("actualizada_en"),
                                            F("creada_en")))
+             .annotate(rn=Window(
+                 expression=RowNumber(),
+                 partition_by=[F("id_libro_deseado_id")],
+                 order_by=[F("fecha_calc").desc(nulls_first=True), F("id_solicitud").desc()],
+             ))
+             .filter(rn__lte=limit)
              .order_by("-fecha_calc", "-id_solicitud"))
 
     ix_qs = (Intercambio.objects
@@ -855,6 +803,12 @@ def my_books_with_history(request):
                                            F("id_solicitud__fecha_intercambio_pactada"),
                                            F("id_solicitud__actualizada_en"),
                                            F("id_solicitud__creada_en")))
+             .annotate(rn=Window(
+                 expression=RowNumber(),
+                 partition_by=[F("id_libro_ofrecido_aceptado_id")],
+                 order_by=[F("fecha_calc").desc(nulls_first=True), F("id_intercambio").desc()],
+             ))
+             .filter(rn__lte=limit)
              .order_by("-fecha_calc", "-id_intercambio"))
 
     estado_map = {
@@ -864,6 +818,23 @@ def my_books_with_history(request):
         "Cancelada": "Cancelado",
     }
 
+    # Contadores sobre TODO el historial (COUNT agrupado, sin traer filas)
+    counts_by_book = defaultdict(lambda: defaultdict(int))
+    for row in (SolicitudIntercambio.objects
+                .filter(id_libro_deseado_id__in=book_ids)
+                .annotate(ix_estado=Subquery(ix_for_si_estado))
+                .values("id_libro_deseado_id", "estado", "ix_estado")
+                .annotate(n=Count("id_solicitud"))
+                .order_by()):
+        estado_unificado = (row["ix_estado"] or estado_map.get(row["estado"], row["estado"])) or "Pendiente"
+        counts_by_book[row["id_libro_deseado_id"]][estado_unificado] += row["n"]
+    for row in (Intercambio.objects
+                .filter(id_libro_ofrecido_aceptado_id__in=book_ids)
+                .values("id_libro_ofrecido_aceptado_id", "estado_intercambio")
+                .annotate(n=Count("id_intercambio"))
+                .order_by()):
+        counts_by_book[row["id_libro_ofrecido_aceptado_id"]][row["estado_intercambio"]] += row["n"]
+
     items_by_book = defaultdict(list)
 
     for si in si_qs:
@@ -901,7 +872,7 @@ def my_books_with_history(request):
     data = []
     for b in qs:
         img_rel = (b.first_image or "").replace("\\", "/")
-        has_new = int(getattr(b, "max_activity_id", 0) or 0) > int(getattr(b, "last_seen", 0) or 0)
+        has_new = int(b.ultima_actividad_id or 0) > int(getattr(b, "last_seen", 0) or 0)
         sr = (getattr(b, 'status_reason', None) or '').upper()
         locked = sr in ('BAJA', 'COMPLETADO')
         editable = bool(b.disponible) and not locked and (b.id_libro not in completed_any)
@@ -910,12 +881,13 @@ def my_books_with_history(request):
                            key=lambda x: (x["fecha"] or timezone.now()),
                            reverse=True)[:limit]
 
+        cnt = counts_by_book.get(b.id_libro, {})
         counters = {
-            "total": len(raw_items),
-            "completados": sum(1 for it in raw_items if it["estado"] == "Completado"),
-            "pendientes": sum(1 for it in raw_items if it["estado"] == "Pendiente"),
-            "aceptados": sum(1 for it in raw_items if it["estado"] == "Aceptado"),
-            "rechazados": sum(1 for it in raw_items if it["estado"] == "Rechazado"),
+            "total": sum(cnt.values()),
+            "completados": cnt.get("Completado", 0),
+            "pendientes": cnt.get("Pendiente", 0),
+            "aceptados": cnt.get("Aceptado", 0),
+            "rechazados": cnt.get("Rechazado", 0),
         }
 
         data.append({
@@ -929,7 +901,7 @@ def my_books_with_history(request):
             "tipo_tapa": b.tipo_tapa,
             "disponible": bool(b.disponible),
             "fecha_subida": b.fecha_subida,
-            "first_image": media_abs(request, img_rel),
+            "first_image": media_abs(request, img_rel, size_pedido(request, "card")),
             "has_requests": bool(getattr(b, "has_si", False) or getattr(b, "has_ix", False)),
             "has_new_requests": bool(has_new),
             "comuna_nombre": comuna_nombre,
@@ -949,32 +921,28 @@ def marcar_solicitudes_vistas(request, libro_id: int):
     if not user_id:
         return Response({"detail": "Falta user_id"}, status=400)
 
-    libro = Libro.objects.filter(pk=libro_id, id_usuario_id=user_id).first()
-    if not libro:
+    visto = (Libro.objects
+             .filter(pk=libro_id, id_usuario_id=user_id)
+             .values_list("ultima_actividad_id", flat=True)
+             .first())
+    if visto is None:
         return Response({"detail": "Libro no encontrado o no pertenece al usuario"}, status=404)
 
-    max_ix_acc = (Intercambio.objects
-                  .filter(id_libro_ofrecido_aceptado_id=libro_id)
-                  .aggregate(m=Max("id_intercambio"))["m"] or 0)
-
-    max_ix_des = (Intercambio.objects
-                  .filter(id_solicitud__id_libro_deseado_id=libro_id)
-                  .aggregate(m=Max("id_intercambio"))["m"] or 0)
-
-    max_si = (SolicitudIntercambio.objects
-              .filter(id_libro_deseado_id=libro_id)
-              .aggregate(m=Max("id_solicitud"))["m"] or 0)
-
-    composite_max = max(int(max_ix_acc or 0), int(max_ix_des or 0), int(max_si or 0))
-
-    obj, _ = LibroSolicitudesVistas.objects.update_or_create(
-        id_usuario_id=user_id, id_libro_id=libro_id,
-        defaults={
-            "ultimo_visto_id_intercambio": composite_max,
-            "visto_por_ultima_vez": timezone.now(),
-        }
+    # Upsert único (ON DUPLICATE KEY UPDATE en MySQL) sobre (id_usuario, id_libro)
+    conflict_target = {}
+    if connection.features.supports_update_conflicts_with_target:
+        conflict_target["unique_fields"] = ["id_usuario", "id_libro"]
+    LibroSolicitudesVistas.objects.bulk_create(
+        [LibroSolicitudesVistas(
+            id_usuario_id=user_id, id_libro_id=libro_id,
+            ultimo_visto_id_intercambio=int(visto or 0),
+            visto_por_ultima_vez=timezone.now(),
+        )],
+        update_conflicts=True,
+        update_fields=["ultimo_visto_id_intercambio", "visto_por_ultima_vez"],
+        **conflict_target,
     )
-    return Response({"ok": True, "ultimo_visto_id_intercambio": obj.ultimo_visto_id_intercambio})
+    return Response({"ok": True, "ultimo_visto_id_intercambio": int(visto or 0)})
 
 
 @api_view(["PATCH"])
@@ -1004,6 +972,8 @@ def update_book(request, libro_id: int):
             status=status.HTTP_409_CONFLICT
         )
 
+    titulo_antes = libro.titulo
+
     allowed = {
         "titulo", "autor", "isbn", "anio_publicacion", "estado",
         "descripcion", "editorial", "tipo_tapa", "disponible", "id_genero"
@@ -1067,7 +1037,13 @@ def update_book(request, libro_id: int):
 
     if changed:
         try:
-            libro.save(update_fields=list(set(changed)))
+            with transaction.atomic():
+                libro.save(update_fields=list(set(changed)))
+                if {"titulo", "autor", "editorial", "id_genero"} & set(changed):
+                    indexar_libro(libro.id_libro)
+                titulos = [titulo_antes, libro.titulo] if {"titulo", "disponible"} & set(changed) else []
+                emitir(EVENTO_TIPO["LIBRO_ACTUALIZADO"], solicitudes_activas_de_libro(libro.id_libro),
+                       id_libro=libro.id_libro, campos=sorted(set(changed)), titulos=titulos)
         except IntegrityError as e:
             return Response({"detail": f"Restricción de integridad: {e}"}, status=400)
         except Exception as e:
@@ -1124,6 +1100,17 @@ def delete_book(request, libro_id: int):
 
     try:
         with transaction.atomic():
+            afectados = libros_de_solicitudes(
+                SolicitudIntercambio.objects
+                .filter(
+                    Q(id_libro_deseado_id=libro_id) |
+                    Q(intercambio__id_libro_ofrecido_aceptado_id=libro_id)
+                )
+                .values_list("id_solicitud", flat=True)
+                .distinct()
+            ) - {libro_id}
+            convs_afectadas = conversaciones_de_libro(libro_id)
+
             inter_qs = (
                 Intercambio.objects
                 .select_for_update()
@@ -1142,6 +1129,8 @@ def delete_book(request, libro_id: int):
                     estado="Cancelada", actualizada_en=timezone.now()
                 )
                 Intercambio.objects.filter(pk__in=inter_ids).delete()
+                liberar(sol_ids)
+                emitir(EVENTO_TIPO["SOLICITUD_CANCELADA"], sol_ids, motivo="libro_eliminado", id_libro=libro_id)
 
             inter_pen = list(
                 inter_qs.filter(estado_intercambio="Pendiente")
@@ -1154,6 +1143,8 @@ def delete_book(request, libro_id: int):
                     estado="Rechazada", actualizada_en=timezone.now()
                 )
                 Intercambio.objects.filter(pk__in=inter_ids).delete()
+                liberar(sol_ids)
+                emitir(EVENTO_TIPO["SOLICITUD_RECHAZADA"], sol_ids, motivo="libro_eliminado", id_libro=libro_id)
 
             sol_qs = (
                 SolicitudIntercambio.objects
@@ -1172,6 +1163,8 @@ def delete_book(request, libro_id: int):
                 Intercambio.objects.filter(id_solicitud_id__in=sol_aceptadas_ids).exclude(
                     estado_intercambio="Completado"
                 ).delete()
+                liberar(sol_aceptadas_ids)
+                emitir(EVENTO_TIPO["SOLICITUD_CANCELADA"], sol_aceptadas_ids, motivo="libro_eliminado", id_libro=libro_id)
 
             sol_pend_ids = list(
                 sol_qs.filter(estado="Pendiente").values_list("id_solicitud", flat=True)
@@ -1181,6 +1174,8 @@ def delete_book(request, libro_id: int):
                     estado="Rechazada", actualizada_en=timezone.now()
                 )
                 Intercambio.objects.filter(id_solicitud_id__in=sol_pend_ids).delete()
+                liberar(sol_pend_ids)
+                emitir(EVENTO_TIPO["SOLICITUD_RECHAZADA"], sol_pend_ids, motivo="libro_eliminado", id_libro=libro_id)
 
             try:
                 Favorito.objects.filter(id_libro_id=libro_id).delete()
@@ -1188,18 +1183,21 @@ def delete_book(request, libro_id: int):
                 pass
 
             LibroSolicitudesVistas.objects.filter(id_libro_id=libro_id).delete()
+            desindexar_libro(libro_id)
 
             for im in ImagenLibro.objects.filter(id_libro_id=libro_id):
                 rel = (im.url_imagen or '').replace('\\', '/')
                 im.delete()
-                try:
-                    if rel:
-                        default_storage.delete(rel)
-                except Exception:
-                    pass
+                borrar_imagen(rel)
 
             libro.delete()
 
+            recalcular_negociacion(afectados)
+            actualizar_escribible(convs_afectadas)
+            # el libro ya no existe: el evento lleva lo que los consumidores no pueden releer
+            emitir(EVENTO_TIPO["LIBRO_ELIMINADO"], id_libro=libro_id, id_usuario=libro.id_usuario_id,
+                   titulos=[libro.titulo], conversaciones=convs_afectadas)
+
         return Response(status=204)
 
     except IntegrityError as e:
@@ -1246,10 +1244,7 @@ def crear_intercambio(request):
 
     lugar = (data.get("lugar_intercambio") or "A coordinar").strip()[:255]
 
-    if Intercambio.objects.filter(
-        id_solicitud__id_libro_deseado_id=libro_sol_id,
-        estado_intercambio__iexact="Aceptado",
-    ).exists():
+    if tiene(reservas_de([libro_sol_id]), libro_sol_id, RESERVA_ROL["INTERCAMBIO"]):
         return Response({"detail": "El libro solicitado ya está comprometido en un intercambio aceptado."}, status=409)
 
     with transaction.atomic():
@@ -1263,6 +1258,10 @@ def crear_intercambio(request):
             lugar_intercambio=lugar,
             fecha_intercambio_pactada=fecha,
         )
+        if not reservar([(libro_sol_id, RESERVA_ROL["INTERCAMBIO"], 0, si.id_solicitud),
+                         (libro_ofr_id, RESERVA_ROL["INTERCAMBIO"], 0, si.id_solicitud)]):
+            transaction.set_rollback(True)
+            return Response({"detail": "Alguno de los libros ya está comprometido en un intercambio."}, status=409)
         SolicitudOferta.objects.create(id_solicitud=si, id_libro_ofrecido_id=libro_ofr_id)
         si.id_libro_ofrecido_aceptado_id = libro_ofr_id
         si.save(update_fields=["id_libro_ofrecido_aceptado"])
@@ -1276,6 +1275,8 @@ def crear_intercambio(request):
                 "fecha_intercambio_pactada": fecha,
             },
         )
+        registrar_actividad([libro_sol_id], si.id_solicitud)
+        registrar_actividad([libro_sol_id, libro_ofr_id], ix.id_intercambio)
 
         conv, _ = Conversacion.objects.get_or_create(
             id_intercambio_id=ix.id_intercambio,
@@ -1289,6 +1290,9 @@ def crear_intercambio(request):
             id_conversacion_id=conv.id_conversacion, id_usuario_id=uid_ofr,
             defaults={"rol": "ofreciente", "ultimo_visto_id_mensaje": 0, "silenciado": False, "archivado": False},
         )
+        actualizar_escribible([conv.id_conversacion])
+        recalcular_negociacion({libro_sol_id, libro_ofr_id})
+        emitir(EVENTO_TIPO["INTERCAMBIO_CREADO"], [si.id_solicitud], intercambio_id=ix.id_intercambio, actor=uid_sol)
 
     return Response({"id_intercambio": ix.id_intercambio}, status=201)
 
@@ -1308,8 +1312,14 @@ def responder_intercambio(request, intercambio_id: int):
     if not it:
         return Response({"detail": "Intercambio no encontrado"}, status=404)
 
-    it.estado_intercambio = estado
-    it.save(update_fields=["estado_intercambio"])
+    with transaction.atomic():
+        it.estado_intercambio = estado
+        it.save(update_fields=["estado_intercambio"])
+        if estado == "Rechazado":
+            liberar([it.id_solicitud_id])
+        recalcular_negociacion(libros_de_solicitudes([it.id_solicitud_id]))
+        emitir(EVENTO_TIPO["SOLICITUD_ACEPTADA" if estado == "Aceptado" else "SOLICITUD_RECHAZADA"],
+               [it.id_solicitud_id], intercambio_id=it.id_intercambio, estado_intercambio=estado)
     return Response({"ok": True})
 
 
@@ -1358,13 +1368,6 @@ def books_by_title(request):
     if not title:
         return Response({"detail": "Falta title"}, status=400)
 
-    portada_sq = (ImagenLibro.objects
-                  .filter(id_libro=OuterRef("pk"), is_portada=True)
-                  .order_by("id_imagen").values_list("url_imagen", flat=True)[:1])
-    first_by_order_sq = (ImagenLibro.objects
-                         .filter(id_libro=OuterRef("pk"))
-                         .order_by("orden", "id_imagen").values_list("url_imagen", flat=True)[:1])
-
     avg_sq = (Calificacion.objects
               .filter(id_usuario_calificado=OuterRef("id_usuario_id"))
               .values("id_usuario_calificado")
@@ -1379,7 +1382,7 @@ def books_by_title(request):
     qs = (Libro.objects
           .filter(titulo__iexact=title)
           .select_related("id_usuario")
-          .annotate(first_image=Coalesce(Subquery(portada_sq), Subquery(first_by_order_sq)))
+          .annotate(first_image=F("portada"))
           .annotate(owner_rating_avg=Coalesce(Subquery(avg_sq), Value(None)))
           .annotate(owner_rating_count=Coalesce(Subquery(cnt_sq), Value(0)))
           .order_by("-fecha_subida", "-id_libro"))
@@ -1394,7 +1397,7 @@ def books_by_title(request):
             "estado": b.estado,
             "fecha_subida": b.fecha_subida,
             "disponible": bool(b.disponible),
-            "first_image": media_abs(request, rel) if rel else None,
+            "first_image": media_abs(request, rel, size_pedido(request, "card")) if rel else None,
             "genero_nombre": getattr(getattr(b, "id_genero", None), "nombre", None),
             "owner": {
                 "id": getattr(b.id_usuario, "id_usuario", None),
@@ -1414,7 +1417,7 @@ def owner_toggle(request, libro_id: int):
     - Si disponible=true  -> set_owner_unavailable(..., False)  (reactiva si era OWNER)
     - Si disponible=false -> set_owner_unavailable(..., True)   (desactiva por OWNER)
     """
-    libro = Libro.objects.filter(pk=libro_id).only("status_reason", "disponible").first()
+    libro = Libro.objects.filter(pk=libro_id).only("status_reason", "disponible", "titulo").first()
     if not libro:
         return Response({"detail": "Libro no encontrado."}, status=404)
 
@@ -1438,7 +1441,10 @@ def owner_toggle(request, libro_id: int):
     desired_active = to_bool(raw)
     # desired_active True  -> queremos activo -> helper flag False (reactivar si OWNER)
     # desired_active False -> queremos desactivar -> helper flag True  (OWNER off)
-    set_owner_unavailable(libro, flag=(not desired_active))
+    with transaction.atomic():
+        set_owner_unavailable(libro, flag=(not desired_active))
+        emitir(EVENTO_TIPO["LIBRO_ACTUALIZADO"], solicitudes_activas_de_libro(libro_id),
+               id_libro=libro_id, campos=["disponible"], titulos=[libro.titulo])
 
     return Response({
         "id": libro_id,
@@ -1477,97 +1483,61 @@ def _conv_payload(conv_id: int, me_id: int):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@con_etag(v_conversaciones)
 def lista_conversaciones(request, user_id: int):
-    sql = """
-    SELECT
-      c.id_conversacion,
-      c.actualizado_en                         AS ultimo_enviado_en,
-      cm.cuerpo                                AS ultimo_mensaje,
-      me.rol                                   AS my_role,
-      other_u.id_usuario                       AS otro_usuario_id,
-      other_u.nombre_usuario                   AS nombre_usuario,
-      other_u.nombres                          AS nombres,
-      other_u.imagen_perfil                    AS imagen_perfil,
-      c.titulo                                 AS titulo_chat,
-      i.id_intercambio                         AS id_intercambio,
-      i.estado_intercambio                     AS estado_intercambio,   -- 👈 NUEVO
-      si.estado                                AS estado_solicitud,     -- 👈 OPCIONAL (backup)
-      lo.titulo                                AS libro_ofrecido_titulo,
-      ls.titulo                                AS libro_solicitado_titulo,
-      GREATEST(
-        COALESCE(c.ultimo_id_mensaje,0)
-        - COALESCE(me.ultimo_visto_id_mensaje,0),
-        0
-      ) AS unread_count
-    FROM conversacion c
-    JOIN conversacion_participante me
-      ON me.id_conversacion = c.id_conversacion
-     AND me.id_usuario      = %s
-     AND me.archivado       = 0          -- 👈 sigue filtrando sólo no archivados “manuales”
-    LEFT JOIN conversacion_participante other_p
-      ON other_p.id_conversacion = c.id_conversacion
-     AND other_p.id_usuario     <> %s
-    LEFT JOIN usuario other_u
-      ON other_u.id_usuario = other_p.id_usuario
-    LEFT JOIN conversacion_mensaje cm
-      ON cm.id_mensaje = c.ultimo_id_mensaje
-    LEFT JOIN intercambio i
-      ON i.id_intercambio = c.id_intercambio
-    LEFT JOIN solicitud_intercambio si
-      ON si.id_solicitud = i.id_solicitud
-    LEFT JOIN libro ls
-      ON ls.id_libro = si.id_libro_deseado
-    LEFT JOIN libro lo
-      ON lo.id_libro = i.id_libro_ofrecido_aceptado
-    ORDER BY c.actualizado_en DESC
-    """
-
-    with connection.cursor() as cur:
-        cur.execute(sql, [user_id, user_id])
-        cols = [c[0] for c in cur.description]
-        raw = [dict(zip(cols, r)) for r in cur.fetchall()]
+    """
+    Bandeja del usuario (tabla bandeja_chat, helpers_bandeja): un scan indexado,
+    más recientes primero. Sólo pagina si llega ?limit= (def. 50) o ?cursor=;
+    siguiente página en X-Next-Cursor. Sin ellos, la bandeja completa (como antes).
+    """
+    params = request.query_params
+    # 👈 clientes viejos (sin limit ni cursor) siguen recibiendo todas sus conversaciones
+    paginar = 'limit' in params or 'cursor' in params
+    filas, next_cursor = pagina_bandeja(
+        user_id,
+        limit=params.get('limit', BANDEJA_PAGE_SIZE) if paginar else None,
+        cursor=params.get('cursor'),
+    )
 
     data = []
-    for r in raw:
-        nombre = r["nombre_usuario"] or r["nombres"] or None
+    for r in filas:
+        nombre = r.otro_nombre_usuario or r.otro_nombres or None
 
         # Determinar “mi libro” y “del otro” según el rol
-        if (r.get("my_role") or "").lower() == "solicitante":
-            my_book = r.get("libro_ofrecido_titulo")
-            other_book = r.get("libro_solicitado_titulo")
+        if (r.rol or "").lower() == "solicitante":
+            my_book = r.libro_ofrecido_titulo
+            other_book = r.libro_solicitado_titulo
         else:
-            my_book = r.get("libro_solicitado_titulo")
-            other_book = r.get("libro_ofrecido_titulo")
-
-        avatar_rel = r["imagen_perfil"] or "avatars/avatardefecto.jpg"
-        display_title = nombre or r["titulo_chat"] or "Conversación"
+            my_book = r.libro_solicitado_titulo
+            other_book = r.libro_ofrecido_titulo
 
-        # 👇 NUEVO: estado unificado (prioriza el del Intercambio)
-        estado_inter = (r.get("estado_intercambio") or "").strip()
-        estado_sol = (r.get("estado_solicitud") or "").strip()
-        estado_unificado = estado_inter or estado_sol  # si no hay intercambio, usa el de la solicitud
+        avatar_rel = r.otro_imagen_perfil or "avatars/avatardefecto.jpg"
 
         data.append({
-            "id_conversacion": r["id_conversacion"],
-            "ultimo_enviado_en": r["ultimo_enviado_en"],
-            "ultimo_mensaje": r["ultimo_mensaje"],
+            "id_conversacion": r.id_conversacion_id,
+            "ultimo_enviado_en": r.ultimo_enviado_en,
+            "ultimo_mensaje": r.ultimo_mensaje,
             "otro_usuario": {
-                "id_usuario": r["otro_usuario_id"],
-                "nombre_usuario": r["nombre_usuario"],
-                "nombres": r["nombres"],
-                "imagen_perfil": media_abs(request, avatar_rel),
+                "id_usuario": r.otro_usuario_id,
+                "nombre_usuario": r.otro_nombre_usuario,
+                "nombres": r.otro_nombres,
+                "imagen_perfil": media_abs(request, avatar_rel, "thumb"),
             },
-            "titulo_chat": r["titulo_chat"],
-            "display_title": display_title,
-            "requested_book_title": r.get("libro_solicitado_titulo"),
+            "titulo_chat": r.titulo,
+            "display_title": nombre or r.titulo or "Conversación",
+            "requested_book_title": r.libro_solicitado_titulo,
             "my_book_title": my_book,
             "counterpart_book_title": other_book,
-            "unread_count": r["unread_count"] or 0,
+            "unread_count": r.no_leidos or 0,
 
-            # 👇 NUEVO: lo que leerá el front
-            "intercambio_estado": estado_unificado,
+            # estado unificado (prioriza el del Intercambio; si no, el de la solicitud)
+            "intercambio_estado": r.intercambio_estado or "",
         })
-    return Response(data)
+
+    resp = Response(data)
+    if next_cursor:
+        resp['X-Next-Cursor'] = next_cursor
+    return resp
 
 def _roles(itc: Intercambio):
         si = itc.id_solicitud
@@ -1620,85 +1590,192 @@ def calificar_intercambio(request, intercambio_id: int):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
-def mensajes_de_conversacion(request, conversacion_id: int):
-    qs = (ConversacionMensaje.objects
-          .filter(id_conversacion_id=conversacion_id)
-          .order_by('id_mensaje'))
+def buscar_en_chats(request, user_id: int):
+    """
+    Busca en los mensajes de las conversaciones del usuario (busqueda_chat.py).
+    ?q= (requerido), ?conversacion= (opcional), ?limit= (def. 20) y ?cursor=;
+    siguiente página en X-Next-Cursor. Más nuevos primero.
+    """
+    q = (request.query_params.get('q') or '').strip()
+    if not q:
+        return Response({"detail": "Parámetro q requerido."}, status=400)
+    try:
+        conv_id = int(request.query_params.get('conversacion') or 0) or None
+    except (TypeError, ValueError):
+        conv_id = None
+
+    data, next_cursor = buscar_mensajes(
+        user_id, q,
+        limit=request.query_params.get('limit'),
+        cursor=request.query_params.get('cursor'),
+        conversacion_id=conv_id,
+    )
+    resp = Response(data, status=200)
+    if next_cursor:
+        resp['X-Next-Cursor'] = next_cursor
+    return resp
 
-    after = request.query_params.get('after') or request.query_params.get('after_id')
-    if after:
-        try:
-            after_i = int(after)
-            qs = qs.filter(id_mensaje__gt=after_i)
-        except (TypeError, ValueError):
-            pass
 
-    data = [{
-        "id_mensaje": m.id_mensaje,
-        "emisor_id": m.id_usuario_emisor_id,
-        "cuerpo": m.cuerpo,
-        "enviado_en": m.enviado_en,
-        "eliminado": m.eliminado,
-    } for m in qs]
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def mensajes_de_conversacion(request, conversacion_id: int):
+    """
+    Keyset (helpers_chat.pagina_mensajes): ?before_id= / ?after_id= (o ?after=) / ?limit=.
+    Sólo pagina si llega ?limit= o ?before_id=: sin ellos devuelve todo el historial
+    (o todo lo posterior a ?after=), como antes. Con ?limit= y sin cursor: los más recientes.
+    La respuesta es una lista ascendente; X-Has-More: 1 indica que hay más en la
+    dirección pedida. ?envelope=1 -> {"results": [...], "has_more": bool}.
+    """
+    params = request.query_params
 
-    return Response(data, status=200)
+    def _cursor(*names):
+        for n in names:
+            raw = params.get(n)
+            if raw not in (None, ""):
+                try:
+                    return int(raw)
+                except (TypeError, ValueError):
+                    pass
+        return None
+
+    before_id = _cursor('before_id', 'before')
+    after_id = _cursor('after', 'after_id')
+    if before_id is not None and after_id is not None:
+        return Response({"detail": "Usa before_id o after_id, no ambos."}, status=400)
+
+    # 👈 clientes viejos (sin limit ni before_id) siguen recibiendo el historial completo
+    paginar = 'limit' in params or before_id is not None
+    data, has_more = pagina_mensajes(
+        conversacion_id,
+        before_id=before_id,
+        after_id=after_id,
+        limit=parse_limit(params.get('limit')) if paginar else None,
+    )
+
+    if str(params.get('envelope') or '').strip().lower() in ('1', 'true', 't', 'yes', 'y', 'on'):
+        resp = Response({"results": data, "has_more": has_more}, status=200)
+    else:
+        resp = Response(data, status=200)
+    resp['X-Has-More'] = '1' if has_more else '0'
+    return resp
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def enviar_mensaje(request, conversacion_id: int):
-    emisor_id = int(request.data.get('id_usuario_emisor'))
+    try:
+        emisor_id = int(request.data.get('id_usuario_emisor'))
+    except (TypeError, ValueError):
+        return Response({"detail": "id_usuario_emisor requerido."}, status=400)
     cuerpo = (request.data.get('cuerpo') or '').strip()
     if not cuerpo:
         return Response({"detail": "Mensaje vacío."}, status=400)
 
-    conv = Conversacion.objects.select_related("id_intercambio").filter(pk=conversacion_id).first()
-    if not conv:
-        return Response({"detail": "Conversación no existe."}, status=404)
-
-    solicitud_id = getattr(getattr(conv, "id_intercambio", None), "id_solicitud_id", None)
-    if not solicitud_id:
-        return Response({"detail": "La conversación no está ligada a una solicitud."}, status=400)
-
+    # 👈 sin select_for_update: la transición de estado mantiene conversacion.escribible
     with transaction.atomic():
-        solicitud = (
-            SolicitudIntercambio.objects
-            .select_for_update()
-            .select_related("id_usuario_solicitante", "id_usuario_receptor", "id_libro_deseado")
-            .filter(
-                pk=solicitud_id,
-                estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]],
-            )
-            .first()
-        )
-
-    if not solicitud:
+        now = timezone.now()
+        m = insertar_mensaje(conversacion_id, emisor_id, cuerpo, now)
+        if m is not None:
+            usuarios = bandeja_mensaje(conversacion_id, m, now)
+            indexar_mensajes([m], usuarios)
+            # 🔔 tiempo real: a los sockets abiertos de la conversación
+            publicar_chat(conversacion_id, "mensaje", {"mensaje": mensaje_dict(m)}, usuarios=usuarios)
+
+    if m is None:
+        # sólo en el camino de error: explicar por qué
+        conv = (Conversacion.objects
+                .filter(pk=conversacion_id)
+                .values("escribible", "id_intercambio__id_solicitud_id")
+                .first())
+        if not conv:
+            return Response({"detail": "Conversación no existe."}, status=404)
+        if not conv["id_intercambio__id_solicitud_id"]:
+            return Response({"detail": "La conversación no está ligada a una solicitud."}, status=400)
+        if not ConversacionParticipante.objects.filter(
+            id_conversacion_id=conversacion_id, id_usuario_id=emisor_id
+        ).exists():
+            return Response({"detail": "No participas de esta conversación."}, status=403)
+        if conv["escribible"]:
+            return Response({"detail": "Emisor inválido."}, status=400)
         return Response({"detail": "La solicitud no existe o ya fue respondida."}, status=404)
-
-    m = ConversacionMensaje.objects.create(
-        id_conversacion=conv,
-        id_usuario_emisor_id=emisor_id,
-        cuerpo=cuerpo,
-        enviado_en=timezone.now()
-    )
-    Conversacion.objects.filter(pk=conversacion_id).update(
-        actualizado_en=timezone.now(),
-        ultimo_id_mensaje=m.id_mensaje
-    )
     return Response({"id_mensaje": m.id_mensaje}, status=201)
 
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def sincronizar_mensajes(request):
+    """
+    Cola offline de la app: varios mensajes (de varias conversaciones) en un POST.
+    Body:
+    {
+        "id_usuario_emisor": 1,
+        "mensajes": [{"client_id": "uuid", "id_conversacion": 5, "cuerpo": "hola"}, ...]
+    }
+    Respuesta (mismo orden): {"resultados": [{"client_id", "id_conversacion", "id_mensaje", "estado"}]}
+    estado: creado | duplicado (reenvío: id_mensaje del original) | rechazado.
+    """
+    try:
+        emisor_id = int(request.data.get('id_usuario_emisor'))
+    except (TypeError, ValueError):
+        return Response({"detail": "id_usuario_emisor requerido."}, status=400)
+    mensajes = request.data.get('mensajes')
+    if not isinstance(mensajes, list) or not mensajes:
+        return Response({"detail": "mensajes debe ser una lista no vacía."}, status=400)
+    if len(mensajes) > SYNC_MAX_LOTE:
+        return Response({"detail": f"Máximo {SYNC_MAX_LOTE} mensajes por lote."}, status=400)
+
+    items, vistos = [], set()
+    for i, raw in enumerate(mensajes):
+        raw = raw if isinstance(raw, dict) else {}
+        cid = str(raw.get('client_id') or '').strip()
+        cuerpo = (raw.get('cuerpo') or '').strip()
+        try:
+            conv_id = int(raw.get('id_conversacion'))
+        except (TypeError, ValueError):
+            conv_id = None
+        if not cid or len(cid) > ID_CLIENTE_MAX or cid in vistos or not cuerpo or not conv_id:
+            return Response({"detail": f"Mensaje #{i} inválido (client_id único, id_conversacion y cuerpo)."},
+                            status=400)
+        vistos.add(cid)
+        items.append({"client_id": cid, "id_conversacion": conv_id, "cuerpo": cuerpo})
+
+    with transaction.atomic():
+        now = timezone.now()
+        resultado, por_conv = insertar_lote(emisor_id, items, now)
+        for conv_id, ms in por_conv.items():
+            usuarios = bandeja_mensaje(conv_id, ms[-1], now, n=len(ms))
+            indexar_mensajes(ms, usuarios)
+            # 🔔 tiempo real: uno por mensaje, en orden
+            for m in ms:
+                publicar_chat(conv_id, "mensaje", {"mensaje": mensaje_dict(m)}, usuarios=usuarios)
+
+    return Response({"resultados": [{
+        "client_id": it["client_id"],
+        "id_conversacion": it["id_conversacion"],
+        "id_mensaje": resultado[it["client_id"]][1],
+        "estado": resultado[it["client_id"]][0],
+    } for it in items]}, status=200)
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def marcar_visto(request, conversacion_id: int):
     user_id = int(request.data.get('id_usuario'))
-    last_id = ConversacionMensaje.objects.filter(
-        id_conversacion_id=conversacion_id
-    ).aggregate(max_id=Max('id_mensaje'))['max_id'] or 0
+    # 👈 lectura por PK; también vale para conversaciones archivadas (mensajes en otra tabla)
+    last_id = (Conversacion.objects
+               .filter(pk=conversacion_id)
+               .values_list("ultimo_id_mensaje", flat=True)
+               .first()) or 0
 
-    ConversacionParticipante.objects.filter(
-        id_conversacion_id=conversacion_id, id_usuario_id=user_id
-    ).update(ultimo_visto_id_mensaje=last_id, visto_en=timezone.now())
+    with transaction.atomic():
+        ConversacionParticipante.objects.filter(
+            id_conversacion_id=conversacion_id, id_usuario_id=user_id
+        ).update(ultimo_visto_id_mensaje=last_id, visto_en=timezone.now())
+        bandeja_visto(conversacion_id, user_id)
+
+    # 🔔 confirmación de lectura al otro participante
+    publicar_chat(conversacion_id, "visto", {"id_usuario": user_id, "ultimo_visto_id_mensaje": last_id},
+                  usuarios=[user_id])
 
     return Response({"ultimo_visto_id_mensaje": last_id})
 
@@ -1739,23 +1816,20 @@ def crear_solicitud_intercambio(request):
     if libro_deseado_id in libros_ofrecidos_ids:
         return Response({"detail": "No puedes ofrecer el mismo libro que estás solicitando."}, status=400)
 
-    try:
-        libro_deseado = Libro.objects.get(pk=libro_deseado_id, disponible=True)
-    except Libro.DoesNotExist:
+    # 👈 una lectura para los libros + una al ledger de reservas (helpers_reservas)
+    libros = {pk: (dueno, disp) for pk, dueno, disp in (Libro.objects
+              .filter(pk__in=[libro_deseado_id, *libros_ofrecidos_ids])
+              .values_list("id_libro", "id_usuario_id", "disponible"))}
+
+    if not libros.get(libro_deseado_id, (None, False))[1]:
         return Response({"detail": "El libro deseado no existe o no está disponible."}, status=404)
 
-    receptor_id = libro_deseado.id_usuario_id
+    receptor_id = libros[libro_deseado_id][0]
     if solicitante_id == receptor_id:
         return Response({"detail": "No puedes enviar una solicitud a tu propio libro."}, status=400)
 
-    ofrecidos_qs = Libro.objects.filter(
-        pk__in=libros_ofrecidos_ids,
-        id_usuario_id=solicitante_id,
-        disponible=True
-    ).values_list("id_libro", flat=True)
-
-    validos = set(ofrecidos_qs)
-    faltantes = [lid for lid in libros_ofrecidos_ids if lid not in validos]
+    faltantes = [lid for lid in libros_ofrecidos_ids
+                 if libros.get(lid, (None, False)) != (solicitante_id, True)]
     if faltantes:
         return Response(
             {"detail": f"Algunos libros ofrecidos no son válidos / no te pertenecen / no están disponibles: {faltantes}"},
@@ -1763,50 +1837,25 @@ def crear_solicitud_intercambio(request):
         )
 
 
-    # === Bloqueos adicionales ===
+    # === Bloqueos adicionales (ledger reserva_libro) ===
+    reservas = reservas_de([libro_deseado_id, *libros_ofrecidos_ids])
 
-    # a) Tus libros ofrecidos NO pueden estar ya ofrecidos por ti en otra PENDIENTE (pendiente saliente previa)
-    if SolicitudOferta.objects.filter(
-        id_libro_ofrecido_id__in=libros_ofrecidos_ids,
-        id_solicitud__id_usuario_solicitante_id=solicitante_id,
-        id_solicitud__estado='Pendiente',
-    ).exists():
+    # a) Tus libros ofrecidos NO pueden estar ya ofrecidos en otra PENDIENTE (pendiente saliente previa)
+    if any(tiene(reservas, lid, RESERVA_ROL["OFERTA"]) for lid in libros_ofrecidos_ids):
         return Response({"detail": "Ya ofreciste uno de esos libros en otra solicitud pendiente."}, status=409)
 
     # b) El libro deseado NO puede estar siendo ofrecido por su dueño (pendiente saliente del dueño)
-    if SolicitudOferta.objects.filter(
-        id_libro_ofrecido_id=libro_deseado_id,
-        id_solicitud__estado='Pendiente',
-    ).exists():
+    if tiene(reservas, libro_deseado_id, RESERVA_ROL["OFERTA"]):
         return Response({"detail": "El dueño está ofreciendo ese libro en otra solicitud; no se puede solicitar por ahora."}, status=409)
 
-    # c) Reservado lógico por Intercambio aceptado
-    if Intercambio.objects.filter(
-        id_solicitud__id_libro_deseado_id=libro_deseado_id,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exists():
-        return Response({"detail": "Ese libro ya tiene un intercambio aceptado en curso."}, status=409)
-
-    # d) En negociación (pendiente/aceptado)
-    if Intercambio.objects.filter(
-        Q(id_solicitud__id_libro_deseado_id=libro_deseado_id) | Q(id_libro_ofrecido_aceptado_id=libro_deseado_id),
-        estado_intercambio__in=['Pendiente', 'Aceptado'],
-    ).exists():
+    # c/d) En negociación (intercambio pendiente/aceptado, en cualquiera de los roles)
+    if tiene(reservas, libro_deseado_id, RESERVA_ROL["INTERCAMBIO"]):
         return Response({"detail": "Ese libro está en negociación. No se puede proponer por ahora."}, status=409)
 
-    if Intercambio.objects.filter(
-        id_libro_ofrecido_aceptado_id__in=libros_ofrecidos_ids,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exists():
+    if any(tiene(reservas, lid, RESERVA_ROL["INTERCAMBIO"]) for lid in libros_ofrecidos_ids):
         return Response({"detail": "Alguno de tus libros ofrecidos ya está comprometido en un intercambio aceptado."}, status=409)
 
-    ya_pendiente = SolicitudIntercambio.objects.filter(
-        id_usuario_solicitante_id=solicitante_id,
-        id_usuario_receptor_id=receptor_id,
-        id_libro_deseado_id=libro_deseado_id,
-        estado__iexact="pendiente",
-    ).exists()
-    if ya_pendiente:
+    if tiene(reservas, libro_deseado_id, RESERVA_ROL["SOLICITUD"], clave=solicitante_id):
         return Response({"detail": "Ya existe una solicitud pendiente para este libro."}, status=400)
 
     with transaction.atomic():
@@ -1818,27 +1867,95 @@ def crear_solicitud_intercambio(request):
             creada_en=timezone.now(),
             actualizada_en=timezone.now(),
         )
-        for lid in libros_ofrecidos_ids:
-            SolicitudOferta.objects.create(
-                id_solicitud=solicitud,
-                id_libro_ofrecido_id=lid
-            )
+        # toma de reservas: si otro request se adelantó entre la lectura y aquí, choca el UNIQUE
+        if not reservar(
+            [(libro_deseado_id, RESERVA_ROL["SOLICITUD"], solicitante_id, solicitud.id_solicitud)] +
+            [(lid, RESERVA_ROL["OFERTA"], 0, solicitud.id_solicitud) for lid in libros_ofrecidos_ids]
+        ):
+            transaction.set_rollback(True)
+            return Response({"detail": "Alguno de los libros acaba de comprometerse en otra solicitud."}, status=409)
+
+        SolicitudOferta.objects.bulk_create([
+            SolicitudOferta(id_solicitud=solicitud, id_libro_ofrecido_id=lid)
+            for lid in libros_ofrecidos_ids
+        ])
+        registrar_actividad([libro_deseado_id], solicitud.id_solicitud)
 
         # Rechazar atómicamente PENDIENTES ENTRANTES contra mis libros ofrecidos
-        (SolicitudIntercambio.objects
-            .filter(id_libro_deseado_id__in=libros_ofrecidos_ids, estado='Pendiente')
-            .update(estado='Rechazada', actualizada_en=timezone.now()))
+        entrantes_qs = SolicitudIntercambio.objects.filter(
+            id_libro_deseado_id__in=libros_ofrecidos_ids, estado='Pendiente'
+        )
+        entrantes_ids = list(entrantes_qs.values_list("id_solicitud", flat=True))
+        afectados = libros_de_solicitudes(entrantes_ids)
+        rechazadas = entrantes_qs.update(estado='Rechazada', actualizada_en=timezone.now())
+        liberar(entrantes_ids)
+
+        recalcular_negociacion(afectados | {libro_deseado_id, *libros_ofrecidos_ids})
+        # 🔔 badges (receptor y, si hubo rechazadas, solicitante): consumidor "contadores"
+        emitir(EVENTO_TIPO["SOLICITUD_CREADA"], [solicitud.id_solicitud], actor=solicitante_id)
+        if rechazadas:
+            emitir(EVENTO_TIPO["SOLICITUD_RECHAZADA"], entrantes_ids, actor=solicitante_id, motivo="oferta_cruzada")
 
     serializer = SolicitudIntercambioSerializer(solicitud)
     return Response(serializer.data, status=201)
 
 
+CATALOGO_STREAM_CHUNK = 500
+
+
+def _stream_catalogo(request, qs, ndjson: bool = False, chunk: int = CATALOGO_STREAM_CHUNK):
+    """
+    Generador para StreamingHttpResponse: serializa el catálogo por lotes con
+    keyset (fecha_subida, id_libro) en vez de un solo LibroSerializer(many=True).
+    Con MySQL, QuerySet.iterator() igual trae todo el resultado al cliente, así
+    que cada lote es una consulta acotada y la memoria queda plana.
+    Un trozo por lote (no por libro): bajo ASGI cada trozo es un salto de hilo
+    (helpers_stream.como_async).
+    - ndjson=False: un arreglo JSON (mismo formato que la respuesta normal)
+    - ndjson=True : un libro por línea (application/x-ndjson)
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    ctx = {'request': request, 'img_size': IMG_LISTADO}
+    first = True
+    last = None
+
+    if not ndjson:
+        yield "["
+    while True:
+        page = qs
+        if last is not None:
+            page = page.filter(
+                Q(fecha_subida__lt=last[0]) |
+                Q(fecha_subida=last[0], id_libro__lt=last[1])
+            )
+        batch = list(page[:chunk])
+        if not batch:
+            break
+
+        items = [encoder.encode(item) for item in LibroSerializer(batch, many=True, context=ctx).data]
+        if ndjson:
+            yield "\n".join(items) + "\n"
+        else:
+            yield ("" if first else ",") + ",".join(items)
+        first = False
+
+        if len(batch) < chunk:
+            break
+        last = (batch[-1].fecha_subida, batch[-1].id_libro)
+    if not ndjson:
+        yield "]"
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@con_etag(v_catalogo)
 def catalogo_completo(request):
     """
     Devuelve TODOS los libros que están disponibles y no en negociación,
     incluyendo la calificación de su dueño.
+
+    ?stream=1       -> misma respuesta JSON, pero en streaming por lotes
+    ?stream=ndjson  -> un libro por línea (NDJSON)
     """
     # Subqueries para la calificación del dueño (copiadas de 'books_by_title')
     avg_sq = (Calificacion.objects
@@ -1855,14 +1972,6 @@ def catalogo_completo(request):
     qs = (
         Libro.objects
         .select_related('id_usuario', 'id_genero')
-        .annotate(_ix=intercambio_activo_ix, _sal=pendiente_saliente_ix)
-        .annotate(
-            en_negociacion=Case(
-                When(Q(_ix=True) | Q(_sal=True), then=Value(True)),
-                default=Value(False),
-                output_field=BooleanField(),
-            )
-        )
         .annotate(owner_rating_avg=Coalesce(Subquery(avg_sq), Value(None)))
         .annotate(owner_rating_count=Coalesce(Subquery(cnt_sq), Value(0)))
         .filter(
@@ -1877,7 +1986,18 @@ def catalogo_completo(request):
     # if user_id_raw:
     #     qs = _exclude_already_requested_by_user(qs, user_id_raw)
 
-    data = LibroSerializer(qs, many=True, context={'request': request}).data
+    stream = (request.query_params.get("stream") or "").strip().lower()
+    if stream in ("1", "true", "json", "ndjson"):
+        ndjson = stream == "ndjson"
+        # 👈 bajo ASGI, iterador async: si no, Django junta la respuesta entera en memoria
+        resp = StreamingHttpResponse(
+            contenido(request, _stream_catalogo(request, qs, ndjson=ndjson)),
+            content_type="application/x-ndjson" if ndjson else "application/json",
+        )
+        resp["Cache-Control"] = "no-cache"
+        return resp
+
+    data = LibroSerializer(qs, many=True, context={'request': request, 'img_size': IMG_LISTADO}).data
     return Response(data)
 
 @api_view(["GET"])
@@ -1937,24 +2057,34 @@ def aceptar_solicitud(request, solicitud_id):
     if not es_de_oferta:
         return Response({"detail": "El libro seleccionado no es parte de la oferta original."}, status=400)
 
-    if not Libro.objects.filter(pk=solicitud.id_libro_deseado_id, disponible=True).exists():
+    deseado_id = solicitud.id_libro_deseado_id
+    disponibles = set(Libro.objects
+                      .filter(pk__in=[deseado_id, libro_aceptado_id], disponible=True)
+                      .values_list("id_libro", flat=True))
+    if deseado_id not in disponibles:
         return Response({"detail": "Tu libro deseado ya no está disponible."}, status=409)
-    if not Libro.objects.filter(pk=libro_aceptado_id, disponible=True).exists():
+    if libro_aceptado_id not in disponibles:
         return Response({"detail": "El libro aceptado ya no está disponible."}, status=409)
 
-    if Intercambio.objects.filter(
-        id_solicitud__id_libro_deseado_id=solicitud.id_libro_deseado_id,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exclude(id_solicitud_id=solicitud.id_solicitud).exists():
+    # 👈 ledger reserva_libro: una lectura en vez de dos EXISTS sobre intercambio
+    reservas = reservas_de([deseado_id, libro_aceptado_id])
+    if tiene(reservas, deseado_id, RESERVA_ROL["INTERCAMBIO"], excepto_solicitud=solicitud.id_solicitud):
         return Response({"detail": "Ese libro ya tiene otro intercambio aceptado en curso."}, status=409)
-
-    if Intercambio.objects.filter(
-        id_libro_ofrecido_aceptado_id=libro_aceptado_id,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exclude(id_solicitud_id=solicitud.id_solicitud).exists():
+    if tiene(reservas, libro_aceptado_id, RESERVA_ROL["INTERCAMBIO"], excepto_solicitud=solicitud.id_solicitud):
         return Response({"detail": "El libro aceptado ya está comprometido en otro intercambio."}, status=409)
 
     with transaction.atomic():
+        # deja de ser Pendiente: suelta sus OFERTA/SOLICITUD y toma INTERCAMBIO
+        liberar([solicitud.id_solicitud], roles=(RESERVA_ROL["OFERTA"], RESERVA_ROL["SOLICITUD"]))
+        # toma de reservas (las que esta solicitud no tenga ya): el UNIQUE cierra la carrera
+        if not reservar([
+            (lid, RESERVA_ROL["INTERCAMBIO"], 0, solicitud.id_solicitud)
+            for lid in (deseado_id, libro_aceptado_id)
+            if not tiene(reservas, lid, RESERVA_ROL["INTERCAMBIO"])
+        ]):
+            transaction.set_rollback(True)
+            return Response({"detail": "Uno de los libros acaba de comprometerse en otro intercambio."}, status=409)
+
         solicitud.estado = SOLICITUD_ESTADO["ACEPTADA"]
         solicitud.id_libro_ofrecido_aceptado_id = libro_aceptado_id
         solicitud.actualizada_en = timezone.now()
@@ -1975,6 +2105,7 @@ def aceptar_solicitud(request, solicitud_id):
             intercambio.id_libro_ofrecido_aceptado_id = libro_aceptado_id
             intercambio.estado_intercambio = INTERCAMBIO_ESTADO["ACEPTADO"]
             intercambio.save(update_fields=["id_libro_ofrecido_aceptado", "estado_intercambio"])
+        registrar_actividad([solicitud.id_libro_deseado_id, libro_aceptado_id], intercambio.id_intercambio)
 
         conv, _ = Conversacion.objects.get_or_create(
             id_intercambio_id=intercambio.id_intercambio,
@@ -1995,14 +2126,23 @@ def aceptar_solicitud(request, solicitud_id):
             id_usuario_id=solicitud.id_usuario_receptor_id,
             defaults={"rol": "ofreciente", "ultimo_visto_id_mensaje": 0, "silenciado": False, "archivado": False},
         )
+        actualizar_escribible([conv.id_conversacion])
 
-        (SolicitudIntercambio.objects.filter(
+        otras_qs = (SolicitudIntercambio.objects.filter(
             id_libro_deseado_id=solicitud.id_libro_deseado_id,
             estado__iexact=SOLICITUD_ESTADO["PENDIENTE"],
         )
-         .exclude(pk=solicitud.id_solicitud)
-         .update(estado=SOLICITUD_ESTADO["RECHAZADA"], actualizada_en=timezone.now())
-         )
+         .exclude(pk=solicitud.id_solicitud))
+        otras_ids = list(otras_qs.values_list("id_solicitud", flat=True))
+        afectados = libros_de_solicitudes([solicitud.id_solicitud, *otras_ids])
+        otras_qs.update(estado=SOLICITUD_ESTADO["RECHAZADA"], actualizada_en=timezone.now())
+        liberar(otras_ids)
+
+        recalcular_negociacion(afectados)
+        emitir(EVENTO_TIPO["SOLICITUD_ACEPTADA"], [solicitud.id_solicitud],
+               intercambio_id=intercambio.id_intercambio, actor=user_id, id_libro_aceptado=libro_aceptado_id)
+        if otras_ids:
+            emitir(EVENTO_TIPO["SOLICITUD_RECHAZADA"], otras_ids, actor=user_id, motivo="otra_aceptada")
 
     return Response(
         {"message": "Intercambio aceptado. Chat habilitado.", "intercambio_id": intercambio.id_intercambio},
@@ -2049,6 +2189,10 @@ def rechazar_solicitud(request, solicitud_id: int):
         if not updated:
             return Response({"detail": "La solicitud ya fue respondida."}, status=409)
 
+        liberar([solicitud_id])
+        recalcular_negociacion(libros_de_solicitudes([solicitud_id]))
+        emitir(EVENTO_TIPO["SOLICITUD_RECHAZADA"], [solicitud_id], actor=user_id)
+
     return Response({
         "ok": True,
         "id_solicitud": solicitud_id,
@@ -2056,67 +2200,318 @@ def rechazar_solicitud(request, solicitud_id: int):
     }, status=200)
 
 
-# En tu views.py
+SOLICITUDES_BULK_MAX = 100
 
-@api_view(["GET"])
+
+@api_view(["POST"])
 @permission_classes([AllowAny])
-def listar_solicitudes_recibidas(request):
+def solicitudes_bulk(request):
+    """
+    Aceptar/rechazar varias solicitudes RECIBIDAS de una vez.
+    Body:
+    {
+        "user_id": 2,
+        "items": [
+            {"solicitud_id": 10, "action": "rechazar"},
+            {"solicitud_id": 11, "action": "aceptar", "id_libro_aceptado": 55}
+        ]
+    }
+    Una transacción: lectura (con lock) de todas las solicitudes, UPDATEs por
+    conjunto y bulk_create de Intercambio / Conversacion / participantes.
+    Respuesta: {"resultados": [{"solicitud_id", "action", "status", "detail"?, "intercambio_id"?}]}
+    (status por ítem: 200 ok, 400/403/404/409 como en los endpoints individuales).
+    """
+    try:
+        user_id = int(request.data.get("user_id"))
+    except (TypeError, ValueError):
+        return Response({"detail": "user_id inválido."}, status=400)
+    items = request.data.get("items")
+    if not isinstance(items, list) or not items:
+        return Response({"detail": "items debe ser una lista no vacía."}, status=400)
+    if len(items) > SOLICITUDES_BULK_MAX:
+        return Response({"detail": f"Máximo {SOLICITUDES_BULK_MAX} ítems por lote."}, status=400)
+
+    res = {}      # solicitud_id -> resultado
+    orden = []    # (solicitud_id, action, resultado fijo | None) en el orden del body
+    pedidos = {}  # solicitud_id -> (action, id_libro_aceptado)
+    for raw in items:
+        raw = raw if isinstance(raw, dict) else {}
+        action = (raw.get("action") or "").strip().lower()
+        try:
+            sid = int(raw.get("solicitud_id"))
+        except (TypeError, ValueError):
+            orden.append((None, action, {"status": 400, "detail": "solicitud_id inválido."}))
+            continue
+        if any(o[0] == sid for o in orden):
+            # sólo cuenta la primera aparición
+            orden.append((sid, action, {"status": 400, "detail": "Solicitud repetida en el lote."}))
+            continue
+        orden.append((sid, action, None))
+        if action not in ("aceptar", "rechazar"):
+            res[sid] = {"status": 400, "detail": "action debe ser 'aceptar' o 'rechazar'."}
+        elif action == "aceptar":
+            try:
+                pedidos[sid] = (action, int(raw.get("id_libro_aceptado")))
+            except (TypeError, ValueError):
+                res[sid] = {"status": 400, "detail": "id_libro_aceptado inválido."}
+        else:
+            pedidos[sid] = (action, None)
+
+    intercambio_de = {}
+    with transaction.atomic():
+        now = timezone.now()
+        # 1) dueño + estado de todas en una consulta (lock de las filas del lote)
+        filas = {r["id_solicitud"]: r for r in (
+            SolicitudIntercambio.objects
+            .select_for_update()
+            .filter(pk__in=list(pedidos))
+            .values("id_solicitud", "id_usuario_receptor_id", "id_usuario_solicitante_id",
+                    "id_libro_deseado_id", "estado"))}
+        for sid in list(pedidos):
+            f = filas.get(sid)
+            if not f:
+                res[sid] = {"status": 404, "detail": "La solicitud no existe."}
+            elif f["id_usuario_receptor_id"] != user_id:
+                res[sid] = {"status": 403, "detail": "Solo el receptor puede responder esta solicitud."}
+            elif (f["estado"] or "").lower() != SOLICITUD_ESTADO["PENDIENTE"].lower():
+                res[sid] = {"status": 409, "detail": "La solicitud ya fue respondida."}
+            else:
+                continue
+            pedidos.pop(sid)
+
+        # 2) validación de aceptaciones: oferta, disponibilidad y reservas (3 lecturas)
+        aceptar = {sid: lid for sid, (a, lid) in pedidos.items() if a == "aceptar"}
+        if aceptar:
+            ofertas = set(SolicitudOferta.objects
+                          .filter(id_solicitud_id__in=list(aceptar))
+                          .values_list("id_solicitud_id", "id_libro_ofrecido_id"))
+            libros = {filas[sid]["id_libro_deseado_id"] for sid in aceptar} | set(aceptar.values())
+            disponibles = set(Libro.objects.filter(pk__in=libros, disponible=True).values_list("id_libro", flat=True))
+            reservas = reservas_de(libros)
+            deseados_tomados = set()
+            for sid, lid in sorted(aceptar.items()):
+                deseado = filas[sid]["id_libro_deseado_id"]
+                if (sid, lid) not in ofertas:
+                    res[sid] = {"status": 400, "detail": "El libro seleccionado no es parte de la oferta original."}
+                elif deseado not in disponibles:
+                    res[sid] = {"status": 409, "detail": "Tu libro deseado ya no está disponible."}
+                elif lid not in disponibles:
+                    res[sid] = {"status": 409, "detail": "El libro aceptado ya no está disponible."}
+                elif deseado in deseados_tomados or tiene(reservas, deseado, RESERVA_ROL["INTERCAMBIO"]):
+                    res[sid] = {"status": 409, "detail": "Ese libro ya tiene otro intercambio aceptado en curso."}
+                elif tiene(reservas, lid, RESERVA_ROL["INTERCAMBIO"]):
+                    res[sid] = {"status": 409, "detail": "El libro aceptado ya está comprometido en otro intercambio."}
+                else:
+                    deseados_tomados.add(deseado)
+                    continue
+                del aceptar[sid]
+                pedidos.pop(sid)
+
+            # toma de reservas: todo junto; si alguien se adelantó, ítem por ítem
+            def _reservas(sid):
+                return [(filas[sid]["id_libro_deseado_id"], RESERVA_ROL["INTERCAMBIO"], 0, sid),
+                        (aceptar[sid], RESERVA_ROL["INTERCAMBIO"], 0, sid)]
+            if not reservar([r for sid in aceptar for r in _reservas(sid)]):
+                for sid in list(aceptar):
+                    if not reservar(_reservas(sid)):
+                        res[sid] = {"status": 409, "detail": "Uno de los libros acaba de comprometerse en otro intercambio."}
+                        del aceptar[sid]
+                        pedidos.pop(sid)
+
+        rechazar = [sid for sid, (a, _) in pedidos.items() if a == "rechazar"]
+        # las demás PENDIENTES de un libro aceptado se rechazan (igual que aceptar_solicitud)
+        otras = list(SolicitudIntercambio.objects
+                     .filter(id_libro_deseado_id__in={filas[sid]["id_libro_deseado_id"] for sid in aceptar},
+                             estado__iexact=SOLICITUD_ESTADO["PENDIENTE"])
+                     .exclude(pk__in=list(aceptar))
+                     .values_list("id_solicitud", flat=True)) if aceptar else []
+        afectados = libros_de_solicitudes([*aceptar, *rechazar, *otras])
+
+        # 3) transiciones por conjunto
+        if rechazar or otras:
+            SolicitudIntercambio.objects.filter(pk__in={*rechazar, *otras}).update(
+                estado=SOLICITUD_ESTADO["RECHAZADA"], actualizada_en=now)
+            liberar([*rechazar, *otras])
+        if aceptar:
+            liberar(list(aceptar), roles=(RESERVA_ROL["OFERTA"], RESERVA_ROL["SOLICITUD"]))
+            SolicitudIntercambio.objects.filter(pk__in=list(aceptar)).update(
+                estado=SOLICITUD_ESTADO["ACEPTADA"],
+                actualizada_en=now,
+                id_libro_ofrecido_aceptado_id=Case(
+                    *[When(pk=sid, then=Value(lid)) for sid, lid in aceptar.items()],
+                    output_field=IntegerField(),
+                ),
+            )
+
+            # Intercambio: reactiva los que ya existían, crea el resto en bloque
+            for ix in Intercambio.objects.filter(id_solicitud_id__in=list(aceptar)):
+                ix.id_libro_ofrecido_aceptado_id = aceptar[ix.id_solicitud_id]
+                ix.estado_intercambio = INTERCAMBIO_ESTADO["ACEPTADO"]
+                ix.save(update_fields=["id_libro_ofrecido_aceptado", "estado_intercambio"])
+                intercambio_de[ix.id_solicitud_id] = ix.id_intercambio
+            Intercambio.objects.bulk_create([
+                Intercambio(id_solicitud_id=sid, id_libro_ofrecido_aceptado_id=lid,
+                            estado_intercambio=INTERCAMBIO_ESTADO["ACEPTADO"], lugar_intercambio="A coordinar")
+                for sid, lid in aceptar.items() if sid not in intercambio_de
+            ])
+            # MySQL no devuelve los PK del INSERT múltiple: se releen
+            intercambio_de = dict(Intercambio.objects
+                                  .filter(id_solicitud_id__in=list(aceptar))
+                                  .values_list("id_solicitud_id", "id_intercambio"))
+            for sid, ix_id in intercambio_de.items():
+                registrar_actividad([filas[sid]["id_libro_deseado_id"], aceptar[sid]], ix_id)
+
+            # Conversacion + participantes
+            existentes = set(Conversacion.objects
+                             .filter(id_intercambio_id__in=list(intercambio_de.values()))
+                             .values_list("id_intercambio_id", flat=True))
+            Conversacion.objects.bulk_create([
+                Conversacion(id_intercambio_id=ix_id, creado_en=now, actualizado_en=now, ultimo_id_mensaje=0)
+                for ix_id in intercambio_de.values() if ix_id not in existentes
+            ])
+            conv_de = dict(Conversacion.objects
+                           .filter(id_intercambio_id__in=list(intercambio_de.values()))
+                           .values_list("id_intercambio_id", "id_conversacion"))
+            ya = set(ConversacionParticipante.objects
+                     .filter(id_conversacion_id__in=list(conv_de.values()))
+                     .values_list("id_conversacion_id", "id_usuario_id"))
+            nuevos = []
+            for sid, ix_id in intercambio_de.items():
+                conv_id = conv_de[ix_id]
+                for uid, rol in ((filas[sid]["id_usuario_solicitante_id"], "solicitante"),
+                                 (filas[sid]["id_usuario_receptor_id"], "ofreciente")):
+                    if (conv_id, uid) not in ya:
+                        nuevos.append(ConversacionParticipante(
+                            id_conversacion_id=conv_id, id_usuario_id=uid, rol=rol,
+                            ultimo_visto_id_mensaje=0, silenciado=False, archivado=False))
+            ConversacionParticipante.objects.bulk_create(nuevos)
+            actualizar_escribible(list(conv_de.values()))
+
+        if rechazar or otras or aceptar:
+            recalcular_negociacion(afectados)
+            for sid, ix_id in intercambio_de.items():
+                emitir(EVENTO_TIPO["SOLICITUD_ACEPTADA"], [sid], intercambio_id=ix_id, actor=user_id,
+                       id_libro_aceptado=aceptar[sid])
+            if rechazar:
+                emitir(EVENTO_TIPO["SOLICITUD_RECHAZADA"], rechazar, actor=user_id)
+            if otras:
+                emitir(EVENTO_TIPO["SOLICITUD_RECHAZADA"], otras, actor=user_id, motivo="otra_aceptada")
+
+    for sid in rechazar:
+        res[sid] = {"status": 200, "estado": SOLICITUD_ESTADO["RECHAZADA"]}
+    for sid in aceptar:
+        res[sid] = {"status": 200, "estado": SOLICITUD_ESTADO["ACEPTADA"], "intercambio_id": intercambio_de.get(sid)}
+
+    resultados = []
+    for sid, action, fijo in orden:
+        resultados.append({"solicitud_id": sid, "action": action, **(fijo or res[sid])})
+    return Response({"resultados": resultados}, status=200)
+
+
+# =========================
+# Listados de solicitudes (completo o incremental con ?since=)
+# =========================
+# Sin `since`: el listado completo de siempre (array) + cabecera X-Sync-Cursor.
+# Con `since=<cursor>`: sólo las solicitudes de la ventana Pendiente/Aceptada que
+# se movieron (solicitud, intercambio, propuestas o libros) y lápidas para las
+# que salieron de la ventana:
+#   {"solicitudes": [...], "eliminadas": [{"id_solicitud", "estado"}], "cursor": "..."}
+# El cursor es un instante en microsegundos; se devuelve con un margen hacia
+# atrás para no perder transacciones que comitean tarde (el cliente hace upsert
+# por id_solicitud, así que repetir filas es inocuo).
+
+SYNC_MARGEN = timedelta(seconds=5)
+
+
+def _sync_cursor(instante) -> str:
+    return str(int((instante - SYNC_MARGEN).timestamp() * 1_000_000))
+
+
+def _parse_since(raw):
+    """'1718000000000000' -> datetime aware; basura -> None."""
+    try:
+        return datetime.fromtimestamp(int(raw) / 1_000_000, tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def _listar_solicitudes(request, campo_usuario: str):
     user_id = request.query_params.get("user_id")
     if not user_id:
          return Response({"detail": "Falta user_id"}, status=400)
 
-    # --- INICIO DE OPTIMIZACIÓN ---
+    raw_since = request.query_params.get("since")
+    since = _parse_since(raw_since) if raw_since else None
+    if raw_since and since is None:
+        return Response({"detail": "since inválido."}, status=400)
+
+    ahora = timezone.now()
+    ventana = [SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]]
+    base = SolicitudIntercambio.objects.filter(**{campo_usuario: user_id})
 
     # 1. Prefetch para Intercambio Y sus datos anidados (Conversacion y Propuesta)
     prefetch_intercambio = Prefetch(
         'intercambio',
         queryset=Intercambio.objects.order_by('-id_intercambio').prefetch_related(
-            # Prefetch la conversación de cada intercambio
             Prefetch('conversaciones', queryset=Conversacion.objects.order_by('id_conversacion')),
-            
-            # Prefetch SOLO la propuesta ACEPTADA de cada intercambio
-            # 👇 --- ¡AQUÍ ESTÁ LA CORRECCIÓN! --- 👇
-            Prefetch('propuestas', 
+            # SOLO la propuesta ACEPTADA de cada intercambio
+            Prefetch('propuestas',
                      queryset=PropuestaEncuentro.objects.filter(estado="ACEPTADA").order_by('-id'),
-                     to_attr='propuesta_aceptada') # Guardar en un atributo fácil de usar
+                     to_attr='propuesta_aceptada')
         )
     )
 
-    # 2. Prefetch para las IMÁGENES de todos los libros involucrados
-    prefetch_ofertas_imgs = Prefetch(
-        'ofertas__id_libro_ofrecido__imagenes',
-        queryset=ImagenLibro.objects.order_by('-is_portada', 'orden')
-    )
-    prefetch_deseado_imgs = Prefetch(
-        'id_libro_deseado__imagenes',
-        queryset=ImagenLibro.objects.order_by('-is_portada', 'orden')
-    )
-    prefetch_aceptado_imgs = Prefetch(
-        'id_libro_ofrecido_aceptado__imagenes',
-        queryset=ImagenLibro.objects.order_by('-is_portada', 'orden')
-    )
+    # 2. Las portadas vienen en libro.portada (sin prefetch de imágenes)
+    qs = base.filter(estado__in=ventana)
+    eliminadas = []
+    if since is not None:
+        # lápidas: índice (usuario, actualizada_en); toda salida de la ventana mueve actualizada_en
+        eliminadas = [
+            {"id_solicitud": pk, "estado": estado}
+            for pk, estado in (base
+                               .filter(actualizada_en__gt=since)
+                               .exclude(estado__in=ventana)
+                               .values_list("id_solicitud", "estado"))
+        ]
+        # cambiadas: la ventana de un usuario es chica, el OR sobre joins va acotado por el índice de usuario
+        cambiadas = (qs
+                     .filter(Q(actualizada_en__gt=since) |
+                             Q(intercambio__actualizado_en__gt=since) |
+                             Q(intercambio__propuestas__creada_en__gt=since) |
+                             Q(intercambio__propuestas__decidida_en__gt=since) |
+                             Q(id_libro_deseado__actualizado_en__gt=since) |
+                             Q(ofertas__id_libro_ofrecido__actualizado_en__gt=since))
+                     .values_list("id_solicitud", flat=True)
+                     .distinct())
+        qs = qs.filter(pk__in=list(cambiadas))
 
-    qs = (SolicitudIntercambio.objects
-          .filter(
-              id_usuario_receptor_id=user_id,
-              estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]]
-          )
+    qs = (qs
           .select_related(
               'id_usuario_solicitante', 'id_usuario_receptor',
               'id_libro_deseado', 'id_libro_ofrecido_aceptado'
           )
           .prefetch_related(
-              'ofertas__id_libro_ofrecido', 
-              prefetch_intercambio,         
-              prefetch_ofertas_imgs,        
-              prefetch_deseado_imgs,
-              prefetch_aceptado_imgs
+              'ofertas__id_libro_ofrecido',
+              prefetch_intercambio,
           )
           .order_by('-creada_en'))
-    
-    serializer = SolicitudIntercambioSerializer(qs, many=True, context={'request': request})
-    return Response(serializer.data)
-    # --- FIN DE OPTIMIZACIÓN ---
+
+    data = SolicitudIntercambioSerializer(qs, many=True, context={'request': request}).data
+    cursor = _sync_cursor(ahora)
+    if since is None:
+        resp = Response(data)
+    else:
+        resp = Response({"solicitudes": data, "eliminadas": eliminadas, "cursor": cursor})
+    resp['X-Sync-Cursor'] = cursor
+    return resp
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@con_etag(v_solicitudes_recibidas)
+def listar_solicitudes_recibidas(request):
+    """GET /api/solicitudes/recibidas/?user_id=&since= (ver _listar_solicitudes)."""
+    return _listar_solicitudes(request, "id_usuario_receptor_id")
 
 
 @api_view(["GET"])
@@ -2137,13 +2532,8 @@ def resumen_solicitudes(request):
     except (TypeError, ValueError):
         return Response({"detail": "user_id inválido."}, status=400)
 
-    qs = SolicitudIntercambio.objects.filter(
-        id_usuario_receptor_id=user_id,
-        estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]],
-        visto_por_receptor=False,
-    )
-
-    count = qs.count()
+    # id_solicitud > solicitudes_visto_hasta (rango sobre el índice del receptor)
+    count = contar_solicitudes([user_id])[user_id]
     return Response({
         "has_new": count > 0,
         "count": count,
@@ -2157,9 +2547,10 @@ def marcar_listado_solicitudes_visto(request):
     POST /api/solicitudes/marcar-listado-visto/
     Body JSON: { "user_id": 123 }
 
-    Marca TODAS las solicitudes recibidas (Pendiente/Aceptada) como vistas
-    por el receptor. Lo llamas cuando el usuario entra a la página de
-    "Solicitudes recibidas".
+    Marca como vistas todas las solicitudes recibidas hasta ahora. Lo llamas
+    cuando el usuario entra a la página de "Solicitudes recibidas".
+    Es un upsert de UNA fila (usuario_contadores.solicitudes_visto_hasta = mayor
+    id_solicitud recibido); no reescribe las solicitudes ni su actualizada_en.
     """
     try:
         user_id = int(request.data.get("user_id") or 0)
@@ -2169,75 +2560,42 @@ def marcar_listado_solicitudes_visto(request):
     if not user_id:
         return Response({"detail": "Falta user_id"}, status=400)
 
-    updated = (
-        SolicitudIntercambio.objects
-        .filter(
-            id_usuario_receptor_id=user_id,
-            estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]],
-        )
-        .update(
-            visto_por_receptor=True,
-            actualizada_en=timezone.now(),
-        )
-    )
+    with transaction.atomic():
+        visto_hasta = marcar_solicitudes_vistas_hasta(user_id)
 
-    return Response({"ok": True, "updated": int(updated)})
+    return Response({"ok": True, "visto_hasta": visto_hasta})
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
-def listar_solicitudes_enviadas(request):
-    user_id = request.query_params.get("user_id")
+def me_badges(request):
+    """
+    GET /api/me/badges/   (JWT; sin auth acepta ?user_id= como el resto de la app)
+
+    Badge global: chat no leídos + solicitudes recibidas no vistas, desde
+    usuario_contadores (una lectura por PK, helpers_badges).
+    """
+    user = getattr(request, "user", None)
+    user_id = getattr(user, "id_usuario", None) if getattr(user, "is_authenticated", False) else None
     if not user_id:
-         return Response({"detail": "Falta user_id"}, status=400)
+        try:
+            user_id = int(request.query_params.get("user_id") or 0)
+        except (TypeError, ValueError):
+            user_id = 0
+    if not user_id:
+        return Response({"detail": "Falta user_id"}, status=400)
 
-    # --- INICIO DE OPTIMIZACIÓN (Mismos prefetches que 'recibidas') ---
-    prefetch_intercambio = Prefetch(
-        'intercambio',
-        queryset=Intercambio.objects.order_by('-id_intercambio').prefetch_related(
-            Prefetch('conversaciones', queryset=Conversacion.objects.order_by('id_conversacion')),
-            
-            # 👇 --- ¡LA CORRECCIÓN FINAL ESTÁ AQUÍ! --- 👇
-            # No es 'intercambio__propuestas', solo 'propuestas'
-            Prefetch('propuestas', 
-                     queryset=PropuestaEncuentro.objects.filter(estado="ACEPTADA").order_by('-id'),
-                     to_attr='propuesta_aceptada')
-        )
-    )
-    prefetch_ofertas_imgs = Prefetch(
-        'ofertas__id_libro_ofrecido__imagenes',
-        queryset=ImagenLibro.objects.order_by('-is_portada', 'orden')
-    )
-    prefetch_deseado_imgs = Prefetch(
-        'id_libro_deseado__imagenes',
-        queryset=ImagenLibro.objects.order_by('-is_portada', 'orden')
-    )
-    prefetch_aceptado_imgs = Prefetch(
-        'id_libro_ofrecido_aceptado__imagenes',
-        queryset=ImagenLibro.objects.order_by('-is_portada', 'orden')
-    )
+    resp = Response(badges(user_id))
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
 
-    qs = (SolicitudIntercambio.objects
-          .filter(
-              id_usuario_solicitante_id=user_id,
-              estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]]
-          )
-          .select_related(
-              'id_usuario_solicitante', 'id_usuario_receptor',
-              'id_libro_deseado', 'id_libro_ofrecido_aceptado'
-          )
-          .prefetch_related(
-              'ofertas__id_libro_ofrecido',
-              prefetch_intercambio,
-              prefetch_ofertas_imgs,
-              prefetch_deseado_imgs,
-              prefetch_aceptado_imgs
-          )
-          .order_by('-creada_en'))
-    
-    serializer = SolicitudIntercambioSerializer(qs, many=True, context={'request': request})
-    return Response(serializer.data)
-    # --- FIN DE OPTIMIZACIÓN ---
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@con_etag(v_solicitudes_enviadas)
+def listar_solicitudes_enviadas(request):
+    """GET /api/solicitudes/enviadas/?user_id=&since= (ver _listar_solicitudes)."""
+    return _listar_solicitudes(request, "id_usuario_solicitante_id")
 
 
 @api_view(["PATCH"])
@@ -2318,24 +2676,23 @@ def proponer_encuentro(request, intercambio_id: int):
             estado="PENDIENTE",
             activa=True,
         )
-
-        # Notificar en el chat (no bloqueante)
-        try:
-            conv = Conversacion.objects.filter(id_intercambio_id=it.id_intercambio).first()
-            if conv:
-                cuerpo = f"🗺️ Propuesta de encuentro: {direccion} — {dt.strftime('%Y-%m-%d %H:%M')}"
-                m = ConversacionMensaje.objects.create(
-                    id_conversacion=conv,
-                    id_usuario_emisor_id=user_id,
-                    cuerpo=cuerpo,
-                    enviado_en=timezone.now()
-                )
-                Conversacion.objects.filter(pk=conv.id_conversacion).update(
-                    actualizado_en=timezone.now(),
-                    ultimo_id_mensaje=m.id_mensaje
-                )
-        except Exception:
-            pass
+        emitir(EVENTO_TIPO["ENCUENTRO_PROPUESTO"], [it.id_solicitud_id], intercambio_id=it.id_intercambio,
+               actor=user_id, id_propuesta=prop.id)
+
+        # Notificar en el chat: mismo camino que enviar_mensaje (bandeja, badge, índice, tiempo real).
+        # insertar_mensaje usa su propio savepoint: si no se puede escribir, la propuesta sigue en pie.
+        conv_id = (Conversacion.objects
+                   .filter(id_intercambio_id=it.id_intercambio)
+                   .values_list("id_conversacion", flat=True)
+                   .first())
+        if conv_id:
+            now = timezone.now()
+            cuerpo = f"🗺️ Propuesta de encuentro: {direccion} — {dt.strftime('%Y-%m-%d %H:%M')}"
+            m = insertar_mensaje(conv_id, user_id, cuerpo, now)
+            if m is not None:
+                usuarios = bandeja_mensaje(conv_id, m, now)
+                indexar_mensajes([m], usuarios)  # 👈 direcciones/fechas buscables desde el chat
+                publicar_chat(conv_id, "mensaje", {"mensaje": mensaje_dict(m)}, usuarios=usuarios)
 
         return Response({
             "ok": True,
@@ -2392,6 +2749,8 @@ def confirmar_encuentro(request, intercambio_id: int):
             si.lugar_intercambio = p.direccion
             si.fecha_intercambio_pactada = p.fecha_hora
             si.save(update_fields=["lugar_intercambio", "fecha_intercambio_pactada"])
+            emitir(EVENTO_TIPO["ENCUENTRO_CONFIRMADO"], [si.id_solicitud], intercambio_id=it.id_intercambio,
+                   actor=user_id, id_propuesta=p.id)
 
             return Response(
                 {"ok": True, "coordinado": True, "lugar": p.direccion, "fecha": p.fecha_hora},
@@ -2406,6 +2765,8 @@ def confirmar_encuentro(request, intercambio_id: int):
             if notas:
                 p.notas = (p.notas or "") + f"\n[RECHAZO] {notas}"[:240]
             p.save(update_fields=["estado", "decidida_por", "decidida_en", "activa", "notas"])
+            emitir(EVENTO_TIPO["ENCUENTRO_RECHAZADO"], [it.id_solicitud_id], intercambio_id=it.id_intercambio,
+                   actor=user_id, id_propuesta=p.id)
             return Response({"ok": True, "coordinado": False}, status=200)
 
 
@@ -2484,19 +2845,28 @@ def completar_intercambio(request, intercambio_id: int):
     ctrl.usado_en = timezone.now()
     ctrl.save(update_fields=["usado_en"])
 
+    si = it.id_solicitud
+    libros_ids = [it.id_libro_ofrecido_aceptado_id, getattr(si, "id_libro_deseado_id", None)]
+
     try:
-        with connection.cursor() as cur:
-            cur.callproc("sp_marcar_intercambio_completado", [intercambio_id, fecha])
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                cur.callproc("sp_marcar_intercambio_completado", [intercambio_id, fecha])
 
-        try:
-    # reforzar estado en libros (idempotente si el SP ya lo hizo)
-            si = it.id_solicitud
-            libros_ids = [it.id_libro_ofrecido_aceptado_id, getattr(si, "id_libro_deseado_id", None)]
-            (Libro.objects
-                .filter(id_libro__in=[x for x in libros_ids if x])
-                .update(disponible=False, status_reason=STATUS_COMPLETADO))
-        except Exception:
-            pass
+            try:
+                # reforzar estado en libros (idempotente si el SP ya lo hizo)
+                (Libro.objects
+                    .filter(id_libro__in=[x for x in libros_ids if x])
+                    .update(disponible=False, status_reason=STATUS_COMPLETADO))
+            except Exception:
+                pass
+
+            liberar([it.id_solicitud_id])
+            recalcular_negociacion(libros_de_solicitudes([it.id_solicitud_id]))
+            actualizar_escribible(conversaciones_de_solicitudes([it.id_solicitud_id]))
+            # ranking de populares (+1 por rol) lo suma el consumidor "populares"
+            emitir(EVENTO_TIPO["INTERCAMBIO_COMPLETADO"], [it.id_solicitud_id],
+                   intercambio_id=it.id_intercambio, actor=user_id)
 
         return Response({"ok": True})
 
@@ -2521,8 +2891,13 @@ def cancelar_solicitud(request, solicitud_id):
     if (s.estado or "").lower() != SOLICITUD_ESTADO["PENDIENTE"].lower():
         return Response({"detail": "Solo se puede cancelar una solicitud pendiente."}, status=400)
 
-    s.estado = SOLICITUD_ESTADO["CANCELADA"]
-    s.save(update_fields=["estado"])
+    with transaction.atomic():
+        s.estado = SOLICITUD_ESTADO["CANCELADA"]
+        s.actualizada_en = timezone.now()
+        s.save(update_fields=["estado", "actualizada_en"])
+        liberar([s.id_solicitud])
+        recalcular_negociacion(libros_de_solicitudes([s.id_solicitud]))
+        emitir(EVENTO_TIPO["SOLICITUD_CANCELADA"], [s.id_solicitud], actor=user_id)
     return Response({"ok": True, "estado": s.estado})
 
 
@@ -2548,8 +2923,14 @@ def cancelar_intercambio(request, intercambio_id: int):
         it.save(update_fields=["estado_intercambio"])
         si = it.id_solicitud
         si.estado = SOLICITUD_ESTADO["CANCELADA"]
-        si.save(update_fields=["estado"])
+        si.actualizada_en = timezone.now()
+        si.save(update_fields=["estado", "actualizada_en"])
         IntercambioCodigo.objects.filter(id_intercambio=it).delete()
+        liberar([si.id_solicitud])
+        recalcular_negociacion(libros_de_solicitudes([si.id_solicitud]))
+        actualizar_escribible(conversaciones_de_solicitudes([si.id_solicitud]))
+        emitir(EVENTO_TIPO["INTERCAMBIO_CANCELADO"], [si.id_solicitud],
+               intercambio_id=it.id_intercambio, actor=user_id)
 
     return Response({"ok": True, "estado_intercambio": it.estado_intercambio, "estado_solicitud": it.id_solicitud.estado})
 
@@ -2569,6 +2950,7 @@ def mi_calificacion(request, intercambio_id: int):
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@con_etag(v_favoritos)
 def favoritos_list(request):
     """
     GET /api/favoritos/?user_id=123
@@ -2577,20 +2959,13 @@ def favoritos_list(request):
     if not user_id:
         return Response({"detail": "Falta user_id"}, status=400)
 
-    portada_sq = (ImagenLibro.objects
-                  .filter(id_libro=OuterRef("pk"), is_portada=True)
-                  .order_by("id_imagen").values_list("url_imagen", flat=True)[:1])
-    first_by_order_sq = (ImagenLibro.objects
-                         .filter(id_libro=OuterRef("pk"))
-                         .order_by("orden", "id_imagen").values_list("url_imagen", flat=True)[:1])
-
     qs = (Libro.objects
           .filter(id_libro__in=Favorito.objects
                   .filter(id_usuario_id=user_id)
                   .values_list("id_libro_id", flat=True)))
     qs = (qs
           .select_related("id_usuario")
-          .annotate(first_image=Coalesce(Subquery(portada_sq), Subquery(first_by_order_sq)))
+          .annotate(first_image=F("portada"))
           .order_by("-fecha_subida", "-id_libro"))
 
     data = []
@@ -2603,7 +2978,7 @@ def favoritos_list(request):
             "estado": b.estado,
             "disponible": bool(b.disponible),
             "fecha_subida": b.fecha_subida,
-            "first_image": media_abs(request, rel) if rel else None,
+            "first_image": media_abs(request, rel, size_pedido(request, "card")) if rel else None,
             "owner_nombre": getattr(b.id_usuario, "nombre_usuario", None),
             "owner_id": getattr(b.id_usuario, "id_usuario", None),
         })
@@ -2659,6 +3034,7 @@ def favoritos_toggle(request, libro_id: int):
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@cached_response(PUNTOS, timeout=60 * 60)
 def puntos_encuentro(request):
     qs = PuntoEncuentro.objects.all()
     tipo = (request.query_params.get("tipo") or "").upper().strip()
@@ -2976,4 +3352,13 @@ def reportar_publicacion(request, libro_id: int):
     )
 
     ser = ReportePublicacionSerializer(rep, context={"request": request})
-    return Response(ser.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+    return Response(ser.data, status=status.HTTP_201_CREATED)
+
+@api_view(["GET"])
+@permission_classes([IsCambiotecaAdmin])
+def admin_cache_stats(request):
+    """
+    GET /api/admin/cache/stats/
+    Versión actual y contadores hit/miss por dominio de la caché de respuestas.
+    """
+    return Response(cache_stats())
@@ -0,0 +1,187 @@
+# market/views_longpoll.py
+"""
+Long-poll del chat (para clientes sin WebSocket).
+
+    GET chat/conversacion/<id>/mensajes/espera/?after=<id_mensaje>&timeout=25
+        -> [mensajes con id_mensaje > after, hasta ?limit=] ([] si venció el plazo)
+    GET chat/<user_id>/conversaciones/espera/?after=<id_mensaje>&timeout=25
+        -> {"cursor", "unread_total", "conversaciones": [...]}  sólo las que
+           tienen ultimo_id_mensaje > after (cursor = nuevo "after").
+
+La vista es async: comprueba una vez la BD y, si no hay nada nuevo, espera
+en el broker (helpers_realtime) a que enviar_mensaje publique. Nada de
+re-consultar en un bucle con sleep. Con varios procesos, usar RedisBroker
+(si no, un mensaje enviado en otro worker sólo se ve al vencer el plazo).
+
+Ambas exigen JWT (Authorization: Bearer, o ?token= como el WebSocket; mismo
+UsuarioJWTAuthentication que la API): 401 sin token válido, 403 si el usuario
+no participa de la conversación / no es <user_id>.
+
+Sólo espera bajo ASGI (proceso `realtime` del Procfile). Bajo WSGI (`web`) ocuparía
+un worker sync durante todo el plazo, así que responde de inmediato
+(timeout=0: una sola comprobación) y el cliente vuelve a consultar.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.utils.encoders import JSONEncoder
+
+from .helpers_chat import pagina_mensajes, parse_limit
+from .helpers_realtime import canal_chat, canal_usuario, esperar_evento
+from .models import BandejaChat, Conversacion, ConversacionParticipante
+
+LONGPOLL_DEFAULT = 25
+LONGPOLL_MAX = 30
+
+
+def _int(raw, default=0):
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return default
+
+
+def _timeout(request) -> float:
+    if not isinstance(request, ASGIRequest):
+        return 0.0  # 👈 WSGI: no bloquear el worker
+    try:
+        t = float(request.GET.get("timeout", LONGPOLL_DEFAULT))
+    except (TypeError, ValueError):
+        t = LONGPOLL_DEFAULT
+    return max(0.0, min(t, LONGPOLL_MAX))
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, safe=False, encoder=JSONEncoder)
+
+
+def _usuario(request):
+    """id del usuario del JWT (cabecera o ?token=), o None si no es válido."""
+    from core.authentication import UsuarioJWTAuthentication
+
+    auth = UsuarioJWTAuthentication()
+    raw = auth.get_raw_token(auth.get_header(request) or b"") or request.GET.get("token")
+    if not raw:
+        return None
+    close_old_connections()
+    try:
+        return auth.get_user(auth.get_validated_token(raw)).pk
+    except Exception:
+        return None
+    finally:
+        close_old_connections()
+
+
+def _autorizar_conversacion(request, conversacion_id: int):
+    """None si puede esperar en la conversación; si no, la respuesta de error."""
+    user_id = _usuario(request)
+    if not user_id:
+        return _json({"detail": "Token inválido o ausente."}, status=401)
+    if not ConversacionParticipante.objects.filter(
+        id_conversacion_id=conversacion_id, id_usuario_id=user_id
+    ).exists():
+        if not Conversacion.objects.filter(pk=conversacion_id).exists():
+            return _json({"detail": "Conversación no existe."}, status=404)
+        return _json({"detail": "No participas de esta conversación."}, status=403)
+    return None
+
+
+def _autorizar_usuario(request, user_id: int):
+    propio = _usuario(request)
+    if not propio:
+        return _json({"detail": "Token inválido o ausente."}, status=401)
+    if propio != user_id:
+        return _json({"detail": "No autorizado."}, status=403)
+    return None
+
+
+# =========================
+# Mensajes de una conversación
+# =========================
+
+def _ultimo_id(conversacion_id: int):
+    return (Conversacion.objects
+            .filter(pk=conversacion_id)
+            .values_list("ultimo_id_mensaje", flat=True)
+            .first())
+
+
+def _mensajes_despues(conversacion_id: int, after: int, limit: int):
+    return pagina_mensajes(conversacion_id, after_id=after, limit=limit)
+
+
+@require_GET
+async def mensajes_espera(request, conversacion_id: int):
+    error = await sync_to_async(_autorizar_conversacion)(request, conversacion_id)
+    if error is not None:
+        return error
+    after = _int(request.GET.get("after") or request.GET.get("after_id"))
+    estado = {}
+
+    async def listo():
+        estado["ultimo"] = await sync_to_async(_ultimo_id)(conversacion_id)
+        return estado["ultimo"] is None or (estado["ultimo"] or 0) > after
+
+    evento = await esperar_evento(canal_chat(conversacion_id), _timeout(request),
+                                  tipos={"mensaje"}, listo=listo)
+    if "ultimo" in estado and estado["ultimo"] is None:
+        return _json({"detail": "Conversación no existe."}, status=404)
+    if evento is None:
+        return _json([])
+    data, has_more = await sync_to_async(_mensajes_despues)(
+        conversacion_id, after, parse_limit(request.GET.get("limit")))
+    resp = _json(data)
+    resp["X-Has-More"] = "1" if has_more else "0"
+    return resp
+
+
+# =========================
+# Lista de conversaciones (contadores)
+# =========================
+
+def _mis_conversaciones(user_id: int):
+    return BandejaChat.objects.filter(id_usuario_id=user_id, archivado=False)
+
+
+def _hay_nuevas(user_id: int, after: int) -> bool:
+    return _mis_conversaciones(user_id).filter(ultimo_id_mensaje__gt=after).exists()
+
+
+def _delta_conversaciones(user_id: int, after: int) -> dict:
+    rows = list(
+        _mis_conversaciones(user_id)
+        .filter(ultimo_id_mensaje__gt=after)
+        .values("id_conversacion_id", "ultimo_id_mensaje", "ultimo_enviado_en", "ultimo_mensaje", "no_leidos")
+        .order_by("-ultimo_enviado_en")
+    )
+    total = _mis_conversaciones(user_id).aggregate(t=Sum("no_leidos"))["t"] or 0
+
+    conversaciones = [{
+        "id_conversacion": r["id_conversacion_id"],
+        "ultimo_id_mensaje": r["ultimo_id_mensaje"],
+        "ultimo_enviado_en": r["ultimo_enviado_en"],
+        "ultimo_mensaje": r["ultimo_mensaje"],
+        "unread_count": r["no_leidos"] or 0,
+    } for r in rows]
+    cursor = max([after] + [c["ultimo_id_mensaje"] or 0 for c in conversaciones])
+    return {"cursor": cursor, "unread_total": total, "conversaciones": conversaciones}
+
+
+@require_GET
+async def conversaciones_espera(request, user_id: int):
+    error = await sync_to_async(_autorizar_usuario)(request, user_id)
+    if error is not None:
+        return error
+    after = _int(request.GET.get("after"))
+
+    async def listo():
+        return await sync_to_async(_hay_nuevas)(user_id, after)
+
+    evento = await esperar_evento(canal_usuario(user_id), _timeout(request),
+                                  tipos={"mensaje"}, listo=listo)
+    if evento is None:
+        return _json({"cursor": after, "unread_total": None, "conversaciones": []})
+    return _json(await sync_to_async(_delta_conversaciones)(user_id, after))
@@ -0,0 +1,178 @@
+# market/views_media.py
+"""
+Servido de /media/ sin Nginx (Railway).
+
+- Bajo WSGI (proceso `web` del Procfile: gunicorn sync) FileResponse usa
+  wsgi.file_wrapper -> sendfile() (zero-copy). Bajo ASGI no hay file_wrapper y
+  Django juntaría el archivo en memoria, así que se envía con un iterador async
+  por trozos de CHUNK (helpers_stream); /media/ debería quedarse en `web`.
+- ETag fuerte (tamaño + mtime) y Last-Modified; If-None-Match -> 304.
+- Range: un solo rango "bytes=a-b" / "a-" / "-n" -> 206 (If-Range respetado).
+- Archivos con nombre UUID (books/, avatars/) son inmutables:
+  Cache-Control: public, max-age=1 año, immutable.
+- Negociación WebP: si el cliente acepta image/webp y existe el derivado
+  .webp (helpers_imagenes), se sirve ese con Vary: Accept.
+- originales/ (subidas tal cual, con EXIF; helpers_imagenes) no se sirve: 404.
+- Opcional: settings.MEDIA_ACCEL_REDIRECT="/protected-media/" delega el envío
+  a Nginx (X-Accel-Redirect) si algún día hay proxy delante.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+from .helpers_imagenes import ORIGINALES
+from .helpers_stream import como_async, es_asgi
+
+INMUTABLE_RE = re.compile(r"[0-9a-f]{32}(_[a-z]+)?\.[a-z0-9]+$")
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_DEFAULT = "public, max-age=3600"
+CHUNK = 256 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _resolver(path: str) -> str:
+    if path.replace("\\", "/").lstrip("/").startswith(f"{ORIGINALES}/"):
+        raise Http404("Archivo no encontrado")
+    try:
+        full = safe_join(str(settings.MEDIA_ROOT), path)
+    except Exception:
+        raise Http404("Ruta inválida")
+    if not os.path.isfile(full):
+        raise Http404("Archivo no encontrado")
+    return full
+
+
+def _negociar_webp(request, full: str) -> str:
+    if not getattr(settings, "MEDIA_NEGOCIAR_WEBP", True):
+        return full
+    if "image/webp" not in request.META.get("HTTP_ACCEPT", ""):
+        return full
+    stem, ext = os.path.splitext(full)
+    if ext.lower() not in (".jpg", ".jpeg", ".png"):
+        return full
+    alt = f"{stem}.webp"
+    return alt if os.path.isfile(alt) else full
+
+
+def _etag(st) -> str:
+    return '"%x-%x"' % (st.st_size, st.st_mtime_ns)
+
+
+def _rango(header: str, size: int):
+    """(inicio, fin) inclusivo; None = sin rango válido (servir completo); False = 416."""
+    m = _RANGE_RE.match((header or "").strip())
+    if not m:
+        return None
+    a, b = m.groups()
+    if a == "" and b == "":
+        return None
+    if a == "":
+        n = int(b)
+        if n == 0:
+            return False
+        return max(0, size - n), size - 1
+    start = int(a)
+    end = int(b) if b else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _leer(fh, start: int, length: int):
+    try:
+        fh.seek(start)
+        while length > 0:
+            data = fh.read(min(CHUNK, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        fh.close()
+
+
+def _cabeceras(resp, etag, st, cache_control, negociado):
+    resp["ETag"] = etag
+    resp["Last-Modified"] = http_date(st.st_mtime)
+    resp["Cache-Control"] = cache_control
+    resp["Accept-Ranges"] = "bytes"
+    if negociado:
+        resp["Vary"] = "Accept"
+    return resp
+
+
+def serve_media(request, path: str):
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+
+    original = _resolver(path)
+    full = _negociar_webp(request, original)
+    negociado = getattr(settings, "MEDIA_NEGOCIAR_WEBP", True) and os.path.splitext(original)[1].lower() in (".jpg", ".jpeg", ".png")
+
+    st = os.stat(full)
+    etag = _etag(st)
+    cache_control = CACHE_INMUTABLE if INMUTABLE_RE.search(os.path.basename(original)) else CACHE_DEFAULT
+    content_type = mimetypes.guess_type(full)[0] or "application/octet-stream"
+
+    # Condicionales
+    inm = request.META.get("HTTP_IF_NONE_MATCH")
+    if inm:
+        if inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]:
+            return _cabeceras(HttpResponse(status=304), etag, st, cache_control, negociado)
+    else:
+        ims = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE") or "")
+        if ims is not None and int(st.st_mtime) <= ims:
+            return _cabeceras(HttpResponse(status=304), etag, st, cache_control, negociado)
+
+    accel = getattr(settings, "MEDIA_ACCEL_REDIRECT", None)
+    if accel:
+        rel = os.path.relpath(full, str(settings.MEDIA_ROOT)).replace(os.sep, "/")
+        resp = HttpResponse(content_type=content_type)
+        resp["X-Accel-Redirect"] = f"{accel.rstrip('/')}/{rel}"
+        return _cabeceras(resp, etag, st, cache_control, negociado)
+
+    # Range (si If-Range no coincide, se ignora y va completo)
+    rango = None
+    if request.META.get("HTTP_RANGE"):
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if not if_range or if_range.strip() == etag:
+            rango = _rango(request.META["HTTP_RANGE"], st.st_size)
+    if rango is False:
+        resp = HttpResponse(status=416)
+        resp["Content-Range"] = f"bytes */{st.st_size}"
+        return _cabeceras(resp, etag, st, cache_control, negociado)
+
+    if rango:
+        start, end = rango
+        length = end - start + 1
+        if request.method == "HEAD":
+            resp = HttpResponse(status=206, content_type=content_type)
+        else:
+            cuerpo = _leer(open(full, "rb"), start, length)
+            resp = StreamingHttpResponse(como_async(cuerpo) if es_asgi(request) else cuerpo,
+                                         status=206, content_type=content_type)
+        resp["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+        resp["Content-Length"] = str(length)
+        return _cabeceras(resp, etag, st, cache_control, negociado)
+
+    if request.method == "HEAD":
+        resp = HttpResponse(content_type=content_type)
+        resp["Content-Length"] = str(st.st_size)
+        return _cabeceras(resp, etag, st, cache_control, negociado)
+
+    if es_asgi(request):
+        # 👈 sin wsgi.file_wrapper: trozos async en vez de leer el archivo entero
+        resp = StreamingHttpResponse(como_async(_leer(open(full, "rb"), 0, st.st_size)),
+                                     content_type=content_type)
+        resp["Content-Length"] = str(st.st_size)
+        return _cabeceras(resp, etag, st, cache_control, negociado)
+
+    resp = FileResponse(open(full, "rb"), content_type=content_type)
+    resp.block_size = CHUNK
+    return _cabeceras(resp, etag, st, cache_control, negociado)
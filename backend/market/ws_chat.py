@@ -0,0 +1,105 @@
+# market/ws_chat.py
+"""
+WebSocket del chat (ASGI puro, sin Channels).
+
+    ws(s)://<host>/ws/chat/<id_conversacion>/?token=<access JWT>
+
+- Al conectar: valida el JWT (mismo UsuarioJWTAuthentication que la API) y
+  que el usuario participe en la conversación. Son las ÚNICAS consultas.
+- Luego el socket sólo espera eventos del broker (helpers_realtime):
+    {"type": "mensaje", "id_conversacion", "mensaje": {...}}      <- enviar_mensaje
+    {"type": "visto",   "id_conversacion", "id_usuario", "ultimo_visto_id_mensaje"}  <- marcar_visto
+- Cliente -> servidor: {"type": "ping"} => {"type": "pong"}.
+- Tras reconectar, el cliente re-sincroniza con mensajes/?after=<último id>.
+
+Necesita servidor ASGI (api.asgi), p.ej.:
+    gunicorn api.asgi:application -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .helpers_realtime import canal_chat, get_broker
+from .models import ConversacionParticipante
+
+RUTA_RE = re.compile(r"^/ws/chat/(?P<conversacion_id>\d+)/?$")
+
+CIERRE_NO_AUTORIZADO = 4403
+CIERRE_RUTA = 4404
+
+
+def _autorizar(token: str, conversacion_id: int):
+    from core.authentication import UsuarioJWTAuthentication
+
+    close_old_connections()
+    try:
+        auth = UsuarioJWTAuthentication()
+        user = auth.get_user(auth.get_validated_token(token))
+        es_participante = ConversacionParticipante.objects.filter(
+            id_conversacion_id=conversacion_id, id_usuario_id=user.pk
+        ).exists()
+    except Exception:
+        return None
+    finally:
+        close_old_connections()
+    return user.pk if es_participante else None
+
+
+def _token(scope) -> str:
+    qs = parse_qs((scope.get("query_string") or b"").decode("latin-1"))
+    return (qs.get("token") or [""])[0]
+
+
+async def chat_websocket(scope, receive, send):
+    m = RUTA_RE.match(scope.get("path") or "")
+    evento = await receive()
+    if evento["type"] != "websocket.connect":
+        return
+    if not m:
+        await send({"type": "websocket.close", "code": CIERRE_RUTA})
+        return
+
+    conversacion_id = int(m.group("conversacion_id"))
+    user_id = await sync_to_async(_autorizar, thread_sensitive=True)(_token(scope), conversacion_id)
+    if not user_id:
+        await send({"type": "websocket.close", "code": CIERRE_NO_AUTORIZADO})
+        return
+
+    broker = get_broker()
+    canal = canal_chat(conversacion_id)
+    cola = broker.suscribir(canal)
+    await send({"type": "websocket.accept"})
+    await send({"type": "websocket.send", "text": json.dumps(
+        {"type": "hola", "id_conversacion": conversacion_id, "id_usuario": user_id}
+    )})
+
+    t_recv = asyncio.ensure_future(receive())
+    t_cola = asyncio.ensure_future(cola.get())
+    try:
+        while True:
+            hechos, _ = await asyncio.wait({t_recv, t_cola}, return_when=asyncio.FIRST_COMPLETED)
+
+            if t_cola in hechos:
+                await send({"type": "websocket.send", "text": t_cola.result()})
+                t_cola = asyncio.ensure_future(cola.get())
+
+            if t_recv in hechos:
+                evento = t_recv.result()
+                if evento["type"] == "websocket.disconnect":
+                    break
+                if evento["type"] == "websocket.receive":
+                    try:
+                        data = json.loads(evento.get("text") or "{}")
+                    except ValueError:
+                        data = {}
+                    if isinstance(data, dict) and data.get("type") == "ping":
+                        await send({"type": "websocket.send", "text": '{"type": "pong"}'})
+                t_recv = asyncio.ensure_future(receive())
+    finally:
+        broker.desuscribir(canal, cola)
+        for t in (t_recv, t_cola):
+            t.cancel()